@@ -3,15 +3,38 @@ A DSL for filtering trace logs.
 
 Tokens:
 - Ident: Identifer, i.e. some property of the trace message, e.g timestamp, module etc.
-- keywords: in, eq, and, or, not
+- keywords: in, eq, lt, le, gt, ge, between, contains, matches, and, or, not
 - parens: ( and )
 - Literals: Numbers, string and lists
 """
 
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+from math import prod
+from operator import ge, gt, itemgetter, le, lt
+from typing import Any, Callable, Mapping, Self, Sequence, Type
+
 from lark import Lark, Transformer
 from lark.exceptions import VisitError
 from lark.tree import Tree
 
+# The parser of the re module is private, without it patterns are searched for
+# without looking for their literals first
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parser
+except ImportError:
+    sre_parser = None
+
+Getter = Callable[[Any], Any]
+Predicate = Callable[[Any], bool]
+# A field value, or literal compared against one
+Scalar = int | str
+
+ORDERINGS = {"lt": lt, "le": le, "gt": gt, "ge": ge}
+
 
 class UnknownIdent(Exception):
     def __init__(self, ident) -> None:
@@ -19,48 +42,226 @@ class UnknownIdent(Exception):
         super().__init__(f"Unknown ident {ident}")
         self.ident = ident
 
-class FilterDSLEvaluator(Transformer):
-    def __init__(self, data: dict):
-        self.data = data
 
-    def start(self, exprs: list[Tree]) -> bool:
-        return bool(exprs[0])
+class Node:
+    """A node of a lowered filter expression."""
+
+
+@dataclass(frozen=True)
+class Compare(Node):
+    op: str
+    ident: str
+    value: Any
+
+
+@dataclass(frozen=True)
+class Not(Node):
+    operand: Node
+
+
+@dataclass(frozen=True)
+class And(Node):
+    operands: tuple[Node, ...]
+
+
+@dataclass(frozen=True)
+class Or(Node):
+    operands: tuple[Node, ...]
+
+
+@dataclass(frozen=True)
+class Regex:
+    """
+    A compiled `matches` pattern, and substrings every match must contain, which
+    are checked first as they are much cheaper to look for.
+    """
+    pattern: str
+    compiled: re.Pattern = field(compare=False)
+    required: tuple[str, ...] = field(compare=False)
+
+    def search(self, text: str) -> bool:
+        for literal in self.required:
+            if literal not in text:
+                return False
+        return self.compiled.search(text) is not None
+
+
+@lru_cache(maxsize=256)
+def regex(pattern: str) -> Regex:
+    """The compiled pattern, shared by every filter using it."""
+    compiled = re.compile(pattern)
+    return Regex(pattern, compiled, required_literals(compiled))
+
 
-    def name(self, exprs: list[Tree]) -> str | int:
-        if exprs[0] not in self.data:
-            raise UnknownIdent(str(exprs[0]))
-        return self.data[exprs[0]]
+def required_literals(compiled: re.Pattern) -> tuple[str, ...]:
+    """The literal runs in the top level sequence of a pattern, longest first."""
+    if sre_parser is None or compiled.flags & (re.IGNORECASE | re.VERBOSE):
+        return ()
+    runs: list[str] = []
+    run: list[str] = []
 
-    def eq(self, exprs: list[Tree]) -> bool:
-        (a,b) = exprs
-        return a == b
+    def walk(items: "sre_parser.SubPattern") -> None:
+        for op, arg in items:
+            if op == sre_constants.LITERAL:
+                run.append(chr(arg))
+                continue
+            if op == sre_constants.SUBPATTERN and arg[1] == 0 and arg[2] == 0:
+                walk(arg[3])
+                continue
+            if op == sre_constants.AT:
+                continue
+            runs.append("".join(run))
+            run.clear()
 
-    def contains(self, exprs: list[Tree]) -> bool:
-        (a,b) = exprs
-        return b in a
+    try:
+        walk(sre_parser.parse(compiled.pattern, compiled.flags))
+    except (AttributeError, TypeError, ValueError):
+        # The private parser changed shape
+        return ()
+    runs.append("".join(run))
+    return tuple(sorted((r for r in runs if r), key=len, reverse=True))
 
-    def is_in(self, exprs: list[Tree]) -> bool:
-        (a,b) = exprs
-        return a in b
 
-    def contains(self, exprs: list[Tree]) -> bool:
-        (a,b) = exprs
-        return b in a
+class FilterDSLLowering(Transformer):
+    """
+    Turns a parse tree into Compare/Not/And/Or nodes.
 
-    def invert(self, exprs: list[Tree]) -> bool:
-        return not exprs[0]
+    Chains of `and` and `or` are flattened into a single node, so the operands can
+    be reordered and short-circuited as a group.
+    """
+    def start(self, exprs: list[Node]) -> Node:
+        return exprs[0]
 
-    def combine_and(self, exprs: list[Tree]) -> bool:
-        return exprs[0] and exprs[1]
+    def name(self, exprs: list[Tree]) -> str:
+        return str(exprs[0])
 
-    def combine_or(self, exprs: list[Tree]) -> bool:
-        return exprs[0] or exprs[1]
+    def eq(self, exprs: list) -> Node:
+        return Compare("eq", *exprs)
+
+    def contains(self, exprs: list) -> Node:
+        return Compare("contains", *exprs)
+
+    def is_in(self, exprs: list) -> Node:
+        (ident, values) = exprs
+        return Compare("in", ident, frozenset(values))
+
+    def matches(self, exprs: list) -> Node:
+        (ident, pattern) = exprs
+        return Compare("matches", ident, regex(pattern))
+
+    def lt(self, exprs: list) -> Node:
+        return Compare("lt", *exprs)
+
+    def le(self, exprs: list) -> Node:
+        return Compare("le", *exprs)
+
+    def gt(self, exprs: list) -> Node:
+        return Compare("gt", *exprs)
+
+    def ge(self, exprs: list) -> Node:
+        return Compare("ge", *exprs)
+
+    def between(self, exprs: list) -> Node:
+        (ident, low, high) = exprs
+        return Compare("between", ident, (low, high))
+
+    def invert(self, exprs: list[Node]) -> Node:
+        return Not(exprs[0])
+
+    def combine_and(self, exprs: list[Node]) -> Node:
+        return And(flatten(And, exprs))
+
+    def combine_or(self, exprs: list[Node]) -> Node:
+        return Or(flatten(Or, exprs))
 
     def STRING(self, s):
         return s[1:-1]
 
+    def list(self, items: list) -> list:
+        return [i for i in items if i is not None]
+
     SIGNED_NUMBER = int
-    list = list
+
+
+def flatten(kind: type[And] | type[Or], operands: list[Node]) -> tuple[Node, ...]:
+    flat: list[Node] = []
+    for operand in operands:
+        if isinstance(operand, kind):
+            flat.extend(operand.operands)
+        else:
+            flat.append(operand)
+    return tuple(flat)
+
+
+def conjuncts(node: Node) -> tuple[Node, ...]:
+    """The operands node requires all of, node itself unless it is an And."""
+    return node.operands if isinstance(node, And) else (node,)
+
+
+def ordered(op: str, value: Scalar | tuple[Scalar, Scalar]) -> Predicate:
+    """
+    A predicate for an ordering comparison (lt, le, gt, ge, between) of a field
+    value against value. between includes both ends.
+    """
+    if op == "between":
+        (low, high) = value
+        return lambda v: low <= v <= high
+    compare = ORDERINGS[op]
+    return lambda v: compare(v, value)
+
+
+def compile_node(node: Node, getters: Mapping[str, Getter]) -> Predicate:
+    """
+    Build a predicate for node, reading fields through getters.
+
+    And/Or operands are evaluated in the order they appear in the node and stop at
+    the first operand that decides the result.
+    """
+    if isinstance(node, Compare):
+        if node.ident not in getters:
+            raise UnknownIdent(node.ident)
+        get = getters[node.ident]
+        value = node.value
+        if node.op == "eq":
+            return lambda row: get(row) == value
+        if node.op == "contains":
+            return lambda row: value in get(row)
+        if node.op == "matches":
+            return lambda row: value.search(get(row))
+        if node.op == "in":
+            return lambda row: get(row) in value
+        if node.op in ORDERINGS or node.op == "between":
+            match = ordered(node.op, value)
+            return lambda row: match(get(row))
+        raise ValueError(f"Unknown comparison {node.op}")
+
+    if isinstance(node, Not):
+        operand = compile_node(node.operand, getters)
+        return lambda row: not operand(row)
+
+    predicates = [compile_node(n, getters) for n in node.operands]
+    if isinstance(node, And):
+        if len(predicates) == 2:
+            (a, b) = predicates
+            return lambda row: a(row) and b(row)
+
+        def all_of(row: object) -> bool:
+            for p in predicates:
+                if not p(row):
+                    return False
+            return True
+        return all_of
+
+    if len(predicates) == 2:
+        (a, b) = predicates
+        return lambda row: a(row) or b(row)
+
+    def any_of(row: object) -> bool:
+        for p in predicates:
+            if p(row):
+                return True
+        return False
+    return any_of
 
 grammar = """
 start: combine+
@@ -78,7 +279,13 @@ invert: "not" expr
 
 comparison: name "eq" literal -> eq
     | name "contains" STRING -> contains
+    | name "matches" STRING -> matches
     | name "in" list -> is_in
+    | name "lt" literal -> lt
+    | name "le" literal -> le
+    | name "gt" literal -> gt
+    | name "ge" literal -> ge
+    | name "between" literal literal -> between
 
 
 ?literal: STRING
@@ -98,15 +305,168 @@ name: CNAME
 """
 parser = Lark(grammar, parser='lalr')
 
+
+class FieldStatistics:
+    """Value counts of one field over a sample of rows."""
+    def __init__(self, values: list[Any]) -> None:
+        self.rows = len(values)
+        self.counts = Counter(values)
+        self.numeric = all(isinstance(v, int) for v in self.counts)
+        self.mean_length = (
+            0.0 if self.numeric or self.rows == 0
+            else sum(len(str(v)) * c for v, c in self.counts.items()) / self.rows
+        )
+
+    def fraction(self, match: Predicate) -> float:
+        if self.rows == 0:
+            return 0.5
+        return sum(c for v, c in self.counts.items() if matches(match, v)) / self.rows
+
+
+def matches(match: Predicate, value: Scalar) -> bool:
+    try:
+        return match(value)
+    except TypeError:
+        # An ordering between a number and a string
+        return False
+
+
+class FilterStatistics:
+    """
+    Per-field statistics used by FilterPlanner to estimate selectivities.
+
+    Built from a sample of rows, by taking every n'th row, so gathering them stays
+    cheap on large models.
+    """
+    sample_size = 4096
+
+    def __init__(self, fields: dict[str, FieldStatistics]) -> None:
+        self.fields = fields
+
+    @classmethod
+    def from_rows(cls: Type[Self], rows: Sequence[Any], getters: Mapping[str, Getter]) -> Self:
+        step = max(1, len(rows) // cls.sample_size)
+        sample = rows[::step]
+        return cls({ident: FieldStatistics([get(r) for r in sample])
+                    for ident, get in getters.items()})
+
+
+class FilterPlanner:
+    """
+    Orders the operands of every And/Or by estimated cost and selectivity.
+
+    For an And the operand most likely to reject a row per unit of cost goes first,
+    for an Or the one most likely to accept. Without statistics integer equality is
+    assumed cheapest, then string equality, `in` lists, and `contains` last.
+    """
+    base_cost = {"eq": 1.0, "in": 1.2, "contains": 1.5, "matches": 3.0,
+                 "lt": 1.0, "le": 1.0, "gt": 1.0, "ge": 1.0, "between": 1.1}
+    default_selectivity = {"eq": 0.1, "in": 0.3, "contains": 0.2, "matches": 0.1,
+                           "lt": 0.5, "le": 0.5, "gt": 0.5, "ge": 0.5, "between": 0.2}
+
+    def __init__(self, statistics: FilterStatistics | None = None) -> None:
+        self.statistics = statistics
+
+    def field(self, ident: str) -> FieldStatistics | None:
+        if self.statistics is None:
+            return None
+        return self.statistics.fields.get(ident)
+
+    def cost(self, node: Node) -> float:
+        if isinstance(node, Compare):
+            cost = self.base_cost[node.op]
+            field = self.field(node.ident)
+            if node.op == "eq" and not isinstance(node.value, int):
+                cost += 0.1
+            if node.op in ("contains", "matches") and field is not None:
+                cost += field.mean_length / 128
+            return cost
+        if isinstance(node, Not):
+            return self.cost(node.operand) + 0.1
+
+        # Later operands only run for the rows the earlier ones let through
+        total = 0.0
+        reach = 1.0
+        for operand in node.operands:
+            total += reach * self.cost(operand)
+            selectivity = self.selectivity(operand)
+            reach *= selectivity if isinstance(node, And) else 1 - selectivity
+        return total
+
+    def selectivity(self, node: Node) -> float:
+        """Estimated fraction of rows the node accepts."""
+        if isinstance(node, Compare):
+            field = self.field(node.ident)
+            if field is None:
+                return self.default_selectivity[node.op]
+            value = node.value
+            if node.op == "eq":
+                return field.fraction(lambda v: v == value)
+            if node.op == "in":
+                return field.fraction(lambda v: v in value)
+            if node.op in ORDERINGS or node.op == "between":
+                return field.fraction(ordered(node.op, value))
+            if node.op == "matches":
+                return field.fraction(lambda v: isinstance(v, str) and value.search(v))
+            return field.fraction(lambda v: isinstance(v, str) and value in v)
+        if isinstance(node, Not):
+            return 1 - self.selectivity(node.operand)
+        if isinstance(node, And):
+            return prod(self.selectivity(n) for n in node.operands)
+        return 1 - prod(1 - self.selectivity(n) for n in node.operands)
+
+    def plan(self, node: Node) -> Node:
+        if isinstance(node, Compare):
+            return node
+        if isinstance(node, Not):
+            return Not(self.plan(node.operand))
+
+        operands = [self.plan(n) for n in node.operands]
+        if isinstance(node, And):
+            operands.sort(key=lambda n: self.cost(n) / max(1 - self.selectivity(n), 1e-6))
+            return And(tuple(operands))
+        operands.sort(key=lambda n: self.cost(n) / max(self.selectivity(n), 1e-6))
+        return Or(tuple(operands))
+
+
 class FilterDSL:
     def __init__(self, expr: str) -> None:
         self.tree = parser.parse(expr)
-
-    def eval(self, data) -> bool:
         try:
-            return FilterDSLEvaluator(data).transform(self.tree)
+            self.root: Node = FilterDSLLowering().transform(self.tree)
         except VisitError as e:
             raise e.orig_exc from e
+        self.idents = {str(t.children[0]) for t in self.tree.find_data("name")}
+        self.predicate = self.compile({i: itemgetter(i) for i in self.idents})
+
+    def plan(self, statistics: FilterStatistics | None = None) -> Node:
+        """
+        The expression with the cheap and selective operands of each and/or moved
+        to the front, using statistics when given.
+        """
+        return FilterPlanner(statistics).plan(self.root)
+
+    def compile(self, getters: Mapping[str, Getter],
+                statistics: FilterStatistics | None = None) -> Predicate:
+        """
+        Build a predicate of the planned expression, reading fields through getters.
+
+        Raises UnknownIdent if the expression uses a field without a getter.
+        """
+        return compile_node(self.plan(statistics), getters)
+
+    def refines(self, other: "FilterDSL") -> bool:
+        """
+        True if this expression is other and'ed with more conditions, so it only
+        accepts rows other accepts.
+        """
+        return set(conjuncts(other.root)) <= set(conjuncts(self.root))
+
+    def eval(self, data: Mapping[str, Any]) -> bool:
+        try:
+            return bool(self.predicate(data))
+        except KeyError as e:
+            raise UnknownIdent(e.args[0]) from e
 
 if __name__ == "__main__":
     test = FilterDSL("module eq 1")
@@ -0,0 +1,86 @@
+"""
+The filters of every view of one store, evaluated together over new rows.
+
+Views following the new rows of the store register their evaluator. The first
+view asking for the rows a flush added gets them evaluated for every registered
+filter in one pass over the chunks: filters that are the same are evaluated
+once, and the columns and the masks of subexpressions are shared by all of
+them, see ChunkColumns. The other views then get their rows from the results.
+So the cost of a flush grows with the number of different subexpressions, not
+with the number of views.
+"""
+
+from typing import Self
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from FilterDSL import Node
+from FilterMask import ChunkColumns, MaskEvaluator
+from TraceStore import CHUNK_BITS, CHUNK_ROWS, TraceStore
+
+
+class FilterEngine:
+    def __init__(self: Self, store: TraceStore) -> None:
+        self.store = store
+        # Evaluator of each view following the new rows
+        self.views: WeakKeyDictionary[object, MaskEvaluator] = WeakKeyDictionary()
+        # The rows evaluated last, and the rows each filter accepted among them
+        self.range = (0, 0)
+        self.results: dict[Node, np.ndarray] = {}
+
+    def register(self: Self, view: object, evaluator: MaskEvaluator) -> None:
+        self.views[view] = evaluator
+
+    def unregister(self: Self, view: object) -> None:
+        self.views.pop(view, None)
+
+    def reset(self: Self) -> None:
+        """Forget the results, for when store rows are numbered again or change."""
+        self.range = (0, 0)
+        self.results = {}
+
+    def accepted(self: Self, evaluator: MaskEvaluator, start: int, stop: int) -> np.ndarray:
+        """Store rows in [start, stop) accepted by evaluator."""
+        filters = {e.root: e for e in self.views.values()}
+        if evaluator.root not in filters:
+            # E.g. a view catching up after a refilter
+            return evaluator.accepted(start, stop).astype(np.int64)
+        if (start, stop) != self.range:
+            self.results = self.evaluate(list(filters.values()), start, stop)
+            self.range = (start, stop)
+        elif evaluator.root not in self.results:
+            # Registered since these rows were evaluated
+            self.results |= self.evaluate([evaluator], start, stop)
+        return self.results[evaluator.root]
+
+    def evaluate(self: Self, evaluators: list[MaskEvaluator], start: int,
+                 stop: int) -> dict[Node, np.ndarray]:
+        start = max(start, self.store.first)
+        stop = min(stop, self.store.end)
+        results = {}
+        shared = []
+        for evaluator in evaluators:
+            (window_start, window_stop, rest) = evaluator.split_rows()
+            if rest is not None and window_start <= start and stop <= window_stop:
+                shared.append((evaluator, rest))
+            else:
+                # Cut down to part of the rows, or no rows, by a binary search
+                results[evaluator.root] = evaluator.accepted(start, stop).astype(np.int64)
+
+        found: dict[Node, list[np.ndarray]] = {e.root: [] for e, _ in shared}
+        row = start
+        while shared and row < stop:
+            number = row >> CHUNK_BITS
+            lo = row - (number << CHUNK_BITS)
+            hi = min(CHUNK_ROWS, stop - (number << CHUNK_BITS))
+            columns = ChunkColumns(self.store.chunk(row), number, lo, hi, shared=True)
+            for evaluator, rest in shared:
+                if evaluator.skips(columns.chunk):
+                    continue
+                mask = evaluator.evaluate(rest, columns, None)
+                found[evaluator.root].append(row + np.flatnonzero(mask))
+            row += hi - lo
+        for root, rows in found.items():
+            results[root] = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        return results
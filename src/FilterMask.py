@@ -0,0 +1,512 @@
+"""
+Vectorized evaluation of filter expressions over the columns of a TraceStore.
+
+A planned FilterDSL node is evaluated one chunk at a time into a numpy boolean
+mask. Comparisons on module, task_id and source become comparisons of interned
+codes, `in` becomes np.isin, and not/and/or become mask algebra. `contains` on
+message searches the byte arena of the chunk directly. Comparisons on template
+compare the template id column, so they never render a deferred message.
+
+Operands of an and/or are evaluated in planned order and only look at the rows
+that are still undecided, so an expensive `contains` after a selective
+comparison only checks the few rows the comparison let through.
+
+Timestamp ranges that the whole expression depends on, e.g. the `between` in
+`timestamp between 1000 2000 and module eq "radio"`, are answered by a binary
+search for the rows inside the range, and the rest of the expression only runs
+on those rows. Rows of merged sources that arrived late can be out of timestamp
+order, see TraceStore.ordered, the whole expression then runs on every row.
+
+Chunks read from a capture file come with a summary of their timestamps, modules,
+tasks and sources, and are skipped when it shows that none of their rows can match.
+
+Columns of a chunk can be shared by the filters of several views, see
+FilterEngine. Their subexpressions are then evaluated once: the mask of each
+node is kept with the rows it was evaluated for, and only other rows are
+evaluated when the same node is met again.
+"""
+
+from array import array
+from typing import Self
+
+import numpy as np
+
+from FilterDSL import ORDERINGS, And, Compare, Node, Not, UnknownIdent, matches, ordered
+from TraceStore import (
+    CHUNK_BITS,
+    CHUNK_MASK,
+    CHUNK_ROWS,
+    TEXT,
+    ChunkSummary,
+    Interner,
+    TraceChunk,
+    TraceStore,
+)
+
+# Below this fraction of undecided rows, `contains` checks rows one by one
+# instead of scanning the byte arena of the chunk.
+SPARSE_FRACTION = 1 / 16
+# Fields stored as codes into an interner of the store, by the name of their
+# column and interner
+INTERNED = {"module": "modules", "task_id": "tasks", "source": "sources"}
+
+
+def column(chunk: TraceChunk, values: array | memoryview, dtype: type) -> np.ndarray:
+    """A numpy view of a chunk column, copied while the chunk can still grow."""
+    if len(chunk) == CHUNK_ROWS:
+        return np.frombuffer(values, dtype=dtype)
+    return np.frombuffer(bytes(values), dtype=dtype)
+
+
+def timestamps(store: TraceStore, rows: np.ndarray) -> np.ndarray:
+    """The timestamps of ascending store rows."""
+    values = np.empty(len(rows), dtype=np.int64)
+    chunks = rows >> CHUNK_BITS
+    bounds = np.flatnonzero(np.diff(chunks)) + 1
+    for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(rows)], strict=True):
+        if lo == hi:
+            continue
+        chunk = store.chunk(int(rows[lo]))
+        values[lo:hi] = column(chunk, chunk.timestamps, np.int64)[rows[lo:hi] & CHUNK_MASK]
+    return values
+
+
+class ChunkColumns:
+    """
+    The columns of rows [lo, hi) of one chunk, converted to numpy on first use.
+    With shared set, the mask of every node evaluated over them is kept too.
+    """
+    def __init__(self: Self, chunk: TraceChunk, number: int, lo: int, hi: int,
+                 shared: bool = False) -> None:
+        self.chunk = chunk
+        self.number = number
+        self.lo = lo
+        self.hi = hi
+        self.cache: dict[str, np.ndarray] = {}
+        # Mask of each node, and the rows it holds the result for
+        self.masks: dict[Node, tuple[np.ndarray, np.ndarray]] | None = {} if shared else None
+
+    def get(self: Self, ident: str) -> np.ndarray:
+        if ident not in self.cache:
+            if ident == "timestamp":
+                values = column(self.chunk, self.chunk.timestamps, np.int64)
+            elif ident == "template":
+                values = column(self.chunk, self.chunk.templates, np.uint16)
+            else:
+                values = column(self.chunk, getattr(self.chunk, INTERNED[ident]), np.uint16)
+            self.cache[ident] = values[self.lo:self.hi]
+        return self.cache[ident]
+
+    def offsets(self: Self) -> np.ndarray:
+        """Arena offsets of every row in the chunk, plus the end of the last one."""
+        if "offsets" not in self.cache:
+            self.cache["offsets"] = column(self.chunk, self.chunk.offsets, np.uint32)
+        return self.cache["offsets"]
+
+    def arena(self: Self) -> np.ndarray:
+        if "arena" not in self.cache:
+            self.cache["arena"] = column(self.chunk, self.chunk.arena, np.uint8)
+        return self.cache["arena"]
+
+
+def split_window(root: Node) -> tuple[list[Compare], Node | None]:
+    """
+    Split root into the timestamp ranges it requires, and the rest of the
+    expression, None if nothing is left.
+    """
+    operands = root.operands if isinstance(root, And) else (root,)
+    window = [n for n in operands if in_window(n)]
+    rest = [n for n in operands if not in_window(n)]
+    if not rest:
+        return window, None
+    if len(rest) == 1:
+        return window, rest[0]
+    return window, And(tuple(rest))
+
+
+def in_window(node: Node) -> bool:
+    if not isinstance(node, Compare) or node.ident != "timestamp":
+        return False
+    if node.op == "between":
+        return all(isinstance(v, int) for v in node.value)
+    return (node.op in ORDERINGS or node.op == "eq") and isinstance(node.value, int)
+
+
+class MaskEvaluator:
+    fields = ("task_id", "module", "timestamp", "message", "template", "source")
+
+    def __init__(self: Self, store: TraceStore, root: Node) -> None:
+        self.store = store
+        self.root = root
+        self.check(root)
+        (self.window, self.rest) = split_window(root)
+
+    def check(self: Self, node: Node) -> None:
+        """Raise for what can not be evaluated, before any rows are."""
+        if isinstance(node, Compare):
+            if node.ident not in self.fields:
+                raise UnknownIdent(node.ident)
+            if node.ident in ("timestamp", "template") and node.op in ("contains", "matches"):
+                raise TypeError(f"{node.op} is not supported on {node.ident}")
+            if node.ident == "message" and (node.op in ORDERINGS or node.op == "between"):
+                raise TypeError(f"{node.op} is not supported on message")
+        elif isinstance(node, Not):
+            self.check(node.operand)
+        else:
+            for operand in node.operands:
+                self.check(operand)
+
+    def accepted(self: Self, start: int, stop: int) -> np.ndarray:
+        """Row numbers in [start, stop) accepted by the filter."""
+        return max(start, self.store.first) + np.flatnonzero(self.mask(start, stop))
+
+    def accepted_rows(self: Self, rows: np.ndarray) -> np.ndarray:
+        """
+        The rows of ascending store rows accepted by the filter, checking only
+        those rows.
+        """
+        rows = rows[rows >= self.store.first]
+        keep = np.zeros(len(rows), dtype=bool)
+        chunks = rows >> CHUNK_BITS
+        bounds = np.flatnonzero(np.diff(chunks)) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(rows)], strict=True):
+            if lo == hi:
+                continue
+            number = int(chunks[lo])
+            offsets = rows[lo:hi] - (number << CHUNK_BITS)
+            (first, last) = (int(offsets[0]), int(offsets[-1]) + 1)
+            chunk = self.store.chunk(int(rows[lo]))
+            if self.skips(chunk):
+                continue
+            columns = ChunkColumns(chunk, number, first, last)
+            undecided = np.zeros(last - first, dtype=bool)
+            undecided[offsets - first] = True
+            keep[lo:hi] = self.evaluate(self.root, columns, undecided)[offsets - first]
+        return rows[keep]
+
+    def mask(self: Self, start: int, stop: int) -> np.ndarray:
+        """Mask of the rows in [start, stop), clipped to the rows kept in the store."""
+        start = max(start, self.store.first)
+        stop = min(stop, self.store.end)
+        mask = np.zeros(max(0, stop - start), dtype=bool)
+        (window_start, window_stop, rest) = self.split_rows()
+        row = max(start, window_start)
+        stop = min(stop, window_stop)
+        if row >= stop:
+            return mask
+        if rest is None:
+            mask[row - start:stop - start] = True
+            return mask
+        while row < stop:
+            index = row >> CHUNK_BITS
+            lo = row - (index << CHUNK_BITS)
+            hi = min(CHUNK_ROWS, stop - (index << CHUNK_BITS))
+            chunk = self.store.chunk(row)
+            if not self.skips(chunk):
+                columns = ChunkColumns(chunk, index, lo, hi)
+                mask[row - start:row - start + hi - lo] = self.evaluate(rest, columns, None)
+            row += hi - lo
+        return mask
+
+    def skips(self: Self, chunk: TraceChunk) -> bool:
+        """True if the summary of chunk shows the filter accepts none of its rows."""
+        return chunk.summary is not None and self.rejects(self.root, chunk.summary)
+
+    def rejects(self: Self, node: Node, summary: ChunkSummary) -> bool:
+        """True if node accepts no row of a chunk with summary, False if unsure."""
+        if isinstance(node, Not):
+            return False
+        if isinstance(node, And):
+            return any(self.rejects(operand, summary) for operand in node.operands)
+        if not isinstance(node, Compare):
+            return all(self.rejects(operand, summary) for operand in node.operands)
+
+        if node.ident == "timestamp":
+            if node.op == "between":
+                bounds = node.value
+            elif node.op in ("ge", "gt"):
+                bounds = (node.value, summary.max_timestamp)
+            elif node.op in ("le", "lt"):
+                bounds = (summary.min_timestamp, node.value)
+            else:
+                values = [v for v in self.wanted(node) if isinstance(v, int)]
+                return all(not summary.min_timestamp <= v <= summary.max_timestamp
+                           for v in values)
+            if not all(isinstance(v, int) for v in bounds):
+                return True
+            return bounds[0] > summary.max_timestamp or bounds[1] < summary.min_timestamp
+        if node.ident in INTERNED:
+            interner = self.interner(node.ident)
+            present = getattr(summary, INTERNED[node.ident])
+            if node.op in ORDERINGS or node.op == "between":
+                return present.isdisjoint(self.ordered_codes(interner, node))
+            return present.isdisjoint(self.codes(interner, node))
+        return False
+
+    def split_rows(self: Self) -> tuple[int, int, Node | None]:
+        """
+        The rows [start, stop) inside every timestamp range of the window, and the
+        rest of the filter to evaluate on them. Every row and the whole filter if
+        the store is not in timestamp order.
+        """
+        store = self.store
+        start = store.first
+        stop = store.end
+        if not store.ordered():
+            return start, stop, self.root
+        for node in self.window:
+            (low, high) = node.value if node.op == "between" else (node.value, node.value)
+            if node.op in ("ge", "eq", "between"):
+                start = max(start, store.find_timestamp(low))
+            elif node.op == "gt":
+                start = max(start, store.find_timestamp(low, after=True))
+            if node.op in ("le", "eq", "between"):
+                stop = min(stop, store.find_timestamp(high, after=True))
+            elif node.op == "lt":
+                stop = min(stop, store.find_timestamp(high))
+        return start, stop, self.rest
+
+    def evaluate(self: Self, node: Node, columns: ChunkColumns,
+                 undecided: np.ndarray | None) -> np.ndarray:
+        """
+        Mask of the rows accepted by node. Rows that are not undecided may be
+        wrong.
+        """
+        if columns.masks is None:
+            return self.evaluate_node(node, columns, undecided)
+        entry = columns.masks.get(node)
+        if entry is None:
+            mask = self.evaluate_node(node, columns, undecided)
+            if undecided is None:
+                decided = np.ones(len(mask), dtype=bool)
+            else:
+                decided = undecided.copy()
+        else:
+            (mask, decided) = entry
+            todo = ~decided if undecided is None else undecided & ~decided
+            if todo.any():
+                mask = np.where(decided, mask, self.evaluate_node(node, columns, todo))
+                decided = decided | todo
+        columns.masks[node] = (mask, decided)
+        # Callers combine masks in place
+        return mask.copy()
+
+    def evaluate_node(self: Self, node: Node, columns: ChunkColumns,
+                      undecided: np.ndarray | None) -> np.ndarray:
+        if isinstance(node, Compare):
+            return self.compare(node, columns, undecided)
+        if isinstance(node, Not):
+            return ~self.evaluate(node.operand, columns, undecided)
+
+        operands = iter(node.operands)
+        mask = self.evaluate(next(operands), columns, undecided)
+        for operand in operands:
+            if isinstance(node, And):
+                if undecided is not None:
+                    mask &= undecided
+                if not mask.any():
+                    break
+                mask &= self.evaluate(operand, columns, mask)
+            else:
+                rest = ~mask if undecided is None else undecided & ~mask
+                if not rest.any():
+                    break
+                mask |= self.evaluate(operand, columns, rest)
+        return mask
+
+    def compare(self: Self, node: Compare, columns: ChunkColumns,
+                undecided: np.ndarray | None) -> np.ndarray:
+        if node.op in ORDERINGS or node.op == "between":
+            return self.compare_ordered(node, columns)
+        if node.ident == "message":
+            return self.compare_message(node, columns, undecided)
+
+        values = columns.get(node.ident)
+        if node.ident in ("timestamp", "template"):
+            wanted = [v for v in self.wanted(node) if isinstance(v, int)]
+        else:
+            wanted = self.codes(self.interner(node.ident), node)
+
+        if len(wanted) == 0:
+            return np.zeros(len(values), dtype=bool)
+        if len(wanted) == 1:
+            return values == wanted[0]
+        return np.isin(values, wanted)
+
+    def compare_ordered(self: Self, node: Compare, columns: ChunkColumns) -> np.ndarray:
+        values = columns.get(node.ident)
+        if node.ident in INTERNED:
+            return np.isin(values, self.ordered_codes(self.interner(node.ident), node))
+
+        bounds = node.value if node.op == "between" else (node.value,)
+        if not all(isinstance(v, int) for v in bounds):
+            return np.zeros(len(values), dtype=bool)
+        if node.op == "between":
+            return (values >= bounds[0]) & (values <= bounds[1])
+        return ORDERINGS[node.op](values, node.value)
+
+    def interner(self: Self, ident: str) -> Interner:
+        return getattr(self.store, INTERNED[ident])
+
+    def ordered_codes(self: Self, interner: Interner, node: Compare) -> list[int]:
+        """Codes of the interned values an ordering or between accepts."""
+        match = ordered(node.op, node.value)
+        return [c for v, c in interner.items() if matches(match, v)]
+
+    def wanted(self: Self, node: Compare) -> list:
+        if node.op == "in":
+            return list(node.value)
+        return [node.value]
+
+    def codes(self: Self, interner: Interner, node: Compare) -> list[int]:
+        """Codes of the interned values the comparison accepts."""
+        if node.op == "contains":
+            return [c for v, c in interner.items() if node.value in v]
+        if node.op == "matches":
+            return [c for v, c in interner.items() if node.value.search(v)]
+        codes = (interner.codes.get(v) if isinstance(v, str) else None for v in self.wanted(node))
+        return [c for c in codes if c is not None]
+
+    def compare_message(self: Self, node: Compare, columns: ChunkColumns,
+                        undecided: np.ndarray | None) -> np.ndarray:
+        deferred = columns.get("template") != TEXT
+        if not deferred.any():
+            return self.compare_text(node, columns, undecided)
+
+        # Rows stored as text are searched as usual, and deferred rows are only
+        # rendered when their template alone does not decide them
+        text = ~deferred if undecided is None else undecided & ~deferred
+        mask = self.compare_text(node, columns, text) & ~deferred
+        if undecided is not None:
+            deferred &= undecided
+        if node.op == "contains":
+            templates = columns.get("template")
+            found, constant = self.template_matches(node.value, np.unique(templates[deferred]))
+            mask |= deferred & np.isin(templates, found)
+            deferred &= ~np.isin(templates, found + constant)
+
+        store = self.store
+        chunk = columns.chunk
+        for i in np.flatnonzero(deferred):
+            message = store.render(chunk, columns.lo + i)
+            if node.op == "contains":
+                mask[i] = node.value in message
+            elif node.op == "matches":
+                mask[i] = node.value.search(message)
+            elif node.op == "eq":
+                mask[i] = message == node.value
+            else:
+                mask[i] = message in node.value
+        return mask
+
+    def template_matches(self: Self, needle: str,
+                         templates: np.ndarray) -> tuple[list[int], list[int]]:
+        """
+        Templates whose text outside the replacement fields contains needle, and
+        the other templates without replacement fields, which can not match.
+        """
+        found = []
+        constant = []
+        for template in templates.tolist():
+            entry = self.store.templates.get(template)
+            if entry is None:
+                continue
+            if any(needle in literal for literal in entry.literals):
+                found.append(template)
+            elif entry.constant():
+                constant.append(template)
+        return found, constant
+
+    def compare_text(self: Self, node: Compare, columns: ChunkColumns,
+                     undecided: np.ndarray | None) -> np.ndarray:
+        chunk = columns.chunk
+        if node.op == "contains":
+            return self.contains(columns, node.value.encode(), undecided)
+
+        if node.op == "matches":
+            regex = node.value
+            if regex.required:
+                # Only rows with the longest literal of the pattern can match
+                candidates = self.contains(columns, regex.required[0].encode(), undecided)
+                if undecided is not None:
+                    candidates &= undecided
+                undecided = candidates
+            mask = np.zeros(columns.hi - columns.lo, dtype=bool)
+            rows = range(mask.size) if undecided is None else np.flatnonzero(undecided)
+            for i in rows:
+                mask[i] = regex.search(chunk.message(columns.lo + i))
+            return mask
+
+        mask = np.zeros(columns.hi - columns.lo, dtype=bool)
+        wanted = {node.value} if node.op == "eq" else node.value
+        rows = range(mask.size) if undecided is None else np.flatnonzero(undecided)
+        for i in rows:
+            mask[i] = chunk.message(columns.lo + i) in wanted
+        return mask
+
+    def contains(self: Self, columns: ChunkColumns, needle: bytes,
+                 undecided: np.ndarray | None) -> np.ndarray:
+        """
+        Mask of the rows containing needle. Rows that are not undecided may be
+        left False.
+        """
+        chunk = columns.chunk
+        rows = self.index_candidates(columns, needle)
+        if rows is None and undecided is not None:
+            rows = np.flatnonzero(undecided)
+        elif rows is not None and undecided is not None:
+            rows = rows[undecided[rows]]
+        if rows is None or len(rows) >= (columns.hi - columns.lo) * SPARSE_FRACTION:
+            return self.search(columns, needle)
+        mask = np.zeros(columns.hi - columns.lo, dtype=bool)
+        for i in rows:
+            mask[i] = needle in chunk.message_bytes(columns.lo + i)
+        return mask
+
+    def index_candidates(self: Self, columns: ChunkColumns, needle: bytes) -> np.ndarray | None:
+        """
+        The rows of the chunk that may contain needle, relative to lo, or None if
+        the message index can not tell.
+        """
+        index = self.store.message_index
+        first = columns.number << CHUNK_BITS
+        if index is None or not index.covers(first + columns.lo, first + columns.hi):
+            return None
+        rows = index.candidates(columns.number, needle)
+        if rows is None:
+            return None
+        rows = rows[(rows >= columns.lo) & (rows < columns.hi)].astype(np.int64)
+        return rows - columns.lo
+
+    def search(self: Self, columns: ChunkColumns, needle: bytes) -> np.ndarray:
+        """Mask of the rows in [lo, hi) of the chunk whose message contains needle."""
+        rows = columns.hi - columns.lo
+        if not needle:
+            return np.ones(rows, dtype=bool)
+        offsets = columns.offsets()[columns.lo:columns.hi + 1].astype(np.int64)
+        start = int(offsets[0])
+        offsets -= start
+        text = columns.arena()[start:start + offsets[-1]]
+
+        # Candidate start positions, narrowed one needle byte at a time
+        positions = np.flatnonzero(text[:max(0, len(text) - len(needle) + 1)] == needle[0])
+        for k in range(1, len(needle)):
+            positions = positions[text[positions + k] == needle[k]]
+
+        if len(positions) < rows:
+            found = np.searchsorted(offsets, positions, side="right") - 1
+            # A match must end inside the message it started in
+            found = found[positions + len(needle) <= offsets[found + 1]]
+            mask = np.zeros(rows, dtype=bool)
+            mask[found] = True
+            return mask
+
+        # Many matches, reduce a per byte hit array per message instead
+        hits = np.zeros(len(text) + 1, dtype=bool)
+        hits[positions] = True
+        for k in range(1, len(needle)):
+            tails = offsets[1:] - k
+            hits[tails[tails >= offsets[:-1]]] = False
+        mask = np.logical_or.reduceat(hits, offsets[:-1])
+        mask[offsets[:-1] == offsets[1:]] = False
+        return mask
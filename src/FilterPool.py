@@ -0,0 +1,268 @@
+"""
+Filter evaluation in worker processes, for refilters of large stores.
+
+Full chunks never change, so each one is copied once, when it is sealed, into a
+block of shared memory that the workers map, instead of receiving the rows. The
+block is kept until the chunk is evicted or made cold, which doubles the memory
+of the history in memory, so the pool is off by default. Chunks kept in segment
+files are mapped from their file instead, chunks of a capture file are read from
+it, and compressed chunks are sent compressed. The workers are started once and
+kept. A refilter pickles its planned filter, the interned names and the
+templates once, and each worker builds its evaluator from them on the first
+chunk of the refilter it gets. After that a chunk only costs its block name. The
+accepted rows come back per chunk, in order.
+"""
+
+import os
+import pickle
+import threading
+import time
+import weakref
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from itertools import count
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Iterator, Self
+
+import numpy as np
+from loguru import logger
+
+from FilterMask import MaskEvaluator
+from TraceCapture import CaptureChunk, decode_block, read_block
+from TraceCompression import CompressedChunk
+from TraceSegments import LazyChunk, MappedChunk, SegmentChunk, chunk_bytes, map_segment
+from TraceStore import CHUNK_BITS, CHUNK_ROWS, TraceChunk, TraceStore
+
+# Stores with fewer rows are filtered in process, starting the workers costs more
+MIN_POOL_ROWS = 4 * CHUNK_ROWS
+# Filter in process unless more workers are asked for, see the module docstring
+DEFAULT_WORKERS = 1
+
+# Workers are forked from a server process without the threads of the GUI
+context = get_context("forkserver")
+context.set_forkserver_preload(["FilterPool"])
+
+
+class SharedChunk(MappedChunk):
+    """A full TraceChunk mapped from a block of shared memory, read only."""
+    def __init__(self: Self, name: str, arena: int) -> None:
+        self.block = SharedMemory(name)
+        super().__init__(self.block.buf, arena)
+
+    def release(self: Self) -> None:
+        super().release()
+        self.block.close()
+
+
+class SharedChunks:
+    """The blocks of shared memory full chunks are copied to for the workers."""
+    def __init__(self: Self) -> None:
+        # Chunk and block by id of the chunk, the chunk is kept so the id stays unique
+        self.blocks: dict[int, tuple[TraceChunk, SharedMemory]] = {}
+        # Exports happen on the threads of refilters too
+        self.lock = threading.Lock()
+        weakref.finalize(self, SharedChunks.free, self.blocks)
+
+    def export(self: Self, chunk: TraceChunk | LazyChunk) -> str | tuple | bytes:
+        """
+        The name of the block holding chunk, which must be full, the path of its
+        segment file, where it is in a capture file, or its compressed block. An
+        in-memory chunk is copied on its first export only.
+        """
+        if isinstance(chunk, SegmentChunk):
+            return chunk.path
+        if isinstance(chunk, CompressedChunk):
+            return chunk.data
+        if isinstance(chunk, CaptureChunk):
+            return chunk.location()
+        with self.lock:
+            entry = self.blocks.get(id(chunk))
+            if entry is None or entry[0] is not chunk:
+                entry = (chunk, self.copy(chunk))
+                self.blocks[id(chunk)] = entry
+            return entry[1].name
+
+    def seal(self: Self, chunks: list[TraceChunk | LazyChunk]) -> None:
+        """Export the full in-memory chunks among chunks not exported yet."""
+        for chunk in chunks:
+            if isinstance(chunk, TraceChunk) and len(chunk) == CHUNK_ROWS:
+                self.export(chunk)
+
+    def copy(self: Self, chunk: TraceChunk) -> SharedMemory:
+        parts = chunk_bytes(chunk)
+        block = SharedMemory(create=True, size=max(1, sum(len(part) for part in parts)))
+        start = 0
+        for part in parts:
+            block.buf[start:start + len(part)] = part
+            start += len(part)
+        return block
+
+    def release(self: Self, chunks: list[TraceChunk]) -> None:
+        """Free the blocks of every chunk not in chunks, e.g. evicted ones."""
+        if not self.blocks:
+            return
+        kept = {id(chunk) for chunk in chunks}
+        with self.lock:
+            stale = {k: v for k, v in self.blocks.items() if k not in kept}
+            for key in stale:
+                del self.blocks[key]
+        SharedChunks.free(stale)
+
+    @staticmethod
+    def free(blocks: dict[int, tuple[TraceChunk, SharedMemory]]) -> None:
+        for _, block in blocks.values():
+            block.close()
+            block.unlink()
+
+
+def start_worker(owner: int) -> None:
+    """
+    Exit once the process owning the pool is gone. Workers are stopped when it
+    exits, but would be left behind if it is killed.
+    """
+    def watch() -> None:
+        while True:
+            time.sleep(1)
+            try:
+                os.kill(owner, 0)
+            except ProcessLookupError:
+                os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+# The refilter a worker process last evaluated a chunk for, and its filter
+worker_job = -1
+worker_evaluator: MaskEvaluator | None = None
+
+
+def load_job(job: int, context: bytes) -> MaskEvaluator:
+    global worker_job, worker_evaluator
+    if job != worker_job:
+        (root, modules, tasks, sources, templates) = pickle.loads(context)
+        store = TraceStore()
+        for value in modules:
+            store.modules.code(value)
+        for value in tasks:
+            store.tasks.code(value)
+        for value in sources:
+            store.sources.code(value)
+        for template, (text, args) in templates.items():
+            store.templates.add(template, text, args)
+        worker_evaluator = MaskEvaluator(store, root)
+        worker_job = job
+    return worker_evaluator
+
+
+def open_chunk(name: str | tuple | bytes, arena: int) -> MappedChunk:
+    """A chunk exported by SharedChunks.export."""
+    if isinstance(name, bytes):
+        return decode_block(name, CHUNK_ROWS)
+    if isinstance(name, tuple):
+        return read_block(*name)
+    if os.path.isabs(name):
+        return map_segment(name)
+    return SharedChunk(name, arena)
+
+
+def evaluate_chunk(job: int, context: bytes, number: int, name: str | tuple | bytes,
+                   arena: int, ordered: bool, lo: int, hi: int) -> np.ndarray:
+    """The accepted rows among rows [lo, hi) of chunk number number."""
+    evaluator = load_job(job, context)
+    store = evaluator.store
+    chunk = open_chunk(name, arena)
+    chunk.ordered = ordered
+    try:
+        store.chunks = [chunk]
+        store.chunk_base = number
+        store.first = (number << CHUNK_BITS) + lo
+        store.end = (number << CHUNK_BITS) + hi
+        return evaluator.accepted(store.first, store.end).astype(np.int64)
+    finally:
+        store.chunks = []
+        chunk.release()
+
+
+class FilterPool:
+    """
+    Worker processes shared by the refilters of every view of a store. They are
+    started on first use, as each one imports the main module when it starts.
+    """
+    def __init__(self: Self, workers: int) -> None:
+        self.workers = workers
+        self.shared = SharedChunks()
+        self.executor: ProcessPoolExecutor | None = None
+        self.jobs = count()
+        # Refilters of different views run on different threads
+        self.lock = threading.Lock()
+
+    def resize(self: Self, workers: int) -> None:
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+            self.workers = workers
+        if workers == 1:
+            self.shared.release([])
+
+    def seal(self: Self, store: TraceStore) -> None:
+        """Export the chunks of store filled since the last call, while the pool is on."""
+        if self.workers > 1:
+            self.shared.seal(store.chunks)
+
+    def submit(self: Self, *args: object) -> Future:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=context,
+                                                    initializer=start_worker,
+                                                    initargs=(os.getpid(),))
+            return self.executor.submit(evaluate_chunk, *args)
+
+    def accepted(self: Self, evaluator: MaskEvaluator,
+                 cancelled: Callable[[], bool]) -> Iterator[tuple[np.ndarray, int]]:
+        """
+        The accepted rows of every chunk of the store of evaluator, in order, with
+        the store row evaluated up to. Chunks still growing, and chunks a worker
+        could not read, are evaluated in process. Stops once cancelled() is true.
+        """
+        store = evaluator.store
+        job = next(self.jobs)
+        templates = {template: (entry.format, entry.args)
+                     for template, entry in store.templates.templates.items()}
+        context = pickle.dumps((evaluator.root, list(store.modules.values),
+                                list(store.tasks.values), list(store.sources.values),
+                                templates))
+        chunks: list[tuple[int, int, Future | None]] = []
+        try:
+            row = store.first
+            while row < store.end:
+                if cancelled():
+                    return
+                number = row >> CHUNK_BITS
+                stop = min((number + 1) << CHUNK_BITS, store.end)
+                chunk = store.chunk(row)
+                future = None
+                if len(chunk) == CHUNK_ROWS and not evaluator.skips(chunk):
+                    name = self.shared.export(chunk)
+                    future = self.submit(job, context, number, name, len(chunk.arena),
+                                         chunk.ordered, row & (CHUNK_ROWS - 1),
+                                         stop - (number << CHUNK_BITS))
+                chunks.append((row, stop, future))
+                row = stop
+            for row, stop, future in chunks:
+                if cancelled():
+                    return
+                accepted = None
+                if future is not None:
+                    try:
+                        accepted = future.result()
+                    except (OSError, RuntimeError, CancelledError) as e:
+                        # Evicted and freed before a worker got to it, a worker died,
+                        # or the pool was resized
+                        logger.warning(f"Filtering rows {row}-{stop} in process: {e!r}")
+                if accepted is None:
+                    accepted = evaluator.accepted(row, stop).astype(np.int64)
+                yield accepted, stop
+        finally:
+            for _, _, future in chunks:
+                if future is not None:
+                    future.cancel()
@@ -0,0 +1,206 @@
+"""
+Capture files, the rows of a TraceStore saved to be opened again later.
+
+Every chunk of the store is saved as one block, its columns laid out as in
+TraceSegments with the timestamps as differences to the one before, compressed
+with zlib. A footer after the blocks holds the interned names, the templates and
+an index of the blocks. All little endian:
+
+    header   b"TRACECAP", u32 version
+    blocks   one per chunk
+    footer   JSON, compressed with zlib
+    trailer  u64 position and u64 size of the footer, b"TRACECAP"
+
+For each block the index has its position, and the range of its timestamps and
+the modules, tasks and sources of its rows, see ChunkSummary, and whether its rows
+are in timestamp order, see TraceStore.ordered. Opening a capture only
+reads the footer. A block is read when rows in it are first used, and filters
+skip the blocks whose summary shows none of their rows can match.
+"""
+
+import json
+import os
+import struct
+import threading
+import weakref
+import zlib
+from array import array
+from functools import partial
+from typing import Self
+
+import numpy as np
+
+from TraceSegments import (
+    COLUMNS,
+    BlockCache,
+    LazyChunk,
+    MappedChunk,
+    chunk_bytes,
+    column_sizes,
+)
+from TraceStore import CHUNK_BITS, CHUNK_ROWS, ChunkSummary, TraceChunk, TraceStore
+
+MAGIC = b"TRACECAP"
+VERSION = 1
+HEADER = struct.Struct("<8sI")
+TRAILER = struct.Struct("<QQ8s")
+# Higher levels take several times longer to save, for little gain
+LEVEL = 1
+
+
+def encode_block(chunk: TraceChunk) -> bytes:
+    parts: list[bytes | memoryview] = chunk_bytes(chunk)
+    timestamps = np.frombuffer(parts[0], dtype=np.int64)
+    parts[0] = np.diff(timestamps, prepend=0).tobytes()
+    return zlib.compress(b"".join(parts), LEVEL)
+
+
+def decode_block(data: bytes, rows: int) -> MappedChunk:
+    buffer = bytearray(zlib.decompress(data))
+    timestamps = np.frombuffer(buffer, dtype=np.int64, count=rows)
+    np.cumsum(timestamps, out=timestamps)
+    return MappedChunk(memoryview(buffer), len(buffer) - sum(column_sizes(rows)), rows)
+
+
+def read_block(path: str, offset: int, size: int) -> MappedChunk:
+    """The full chunk in the block at offset of the capture file at path."""
+    with open(path, "rb") as file:
+        file.seek(offset)
+        return decode_block(file.read(size), CHUNK_ROWS)
+
+
+def is_capture(path: str) -> bool:
+    """True if path is a capture file, rather than e.g. a device or a recorded stream."""
+    if not os.path.isfile(path):
+        # Reading a device could block, and would take bytes meant for its source
+        return False
+    try:
+        with open(path, "rb") as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def save_capture(store: TraceStore, path: str) -> None:
+    """Save the rows kept in store to a capture file at path."""
+    blocks = []
+    # Written next to path first, so a failed save leaves an older capture alone
+    with open(path + ".part", "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION))
+        for chunk in store.chunks:
+            data = encode_block(chunk)
+            timestamps = np.frombuffer(chunk.timestamps, dtype=np.int64)
+            blocks.append([file.tell(), len(data), len(chunk),
+                           int(timestamps.min()), int(timestamps.max()),
+                           np.unique(np.frombuffer(chunk.modules, dtype=np.uint16)).tolist(),
+                           np.unique(np.frombuffer(chunk.tasks, dtype=np.uint16)).tolist(),
+                           np.unique(np.frombuffer(chunk.sources, dtype=np.uint16)).tolist(),
+                           chunk.ordered])
+            file.write(data)
+        templates = {template: [entry.format, entry.args]
+                     for template, entry in store.templates.templates.items()}
+        footer = zlib.compress(json.dumps({
+            "first": store.first,
+            "end": store.end,
+            "modules": store.modules.values,
+            "tasks": store.tasks.values,
+            "sources": store.sources.values,
+            "templates": templates,
+            "blocks": blocks,
+        }).encode())
+        offset = file.tell()
+        file.write(footer)
+        file.write(TRAILER.pack(offset, len(footer), MAGIC))
+    os.replace(path + ".part", path)
+
+
+class CaptureChunk(LazyChunk):
+    """A full TraceChunk in a block of a capture file, read while it is used."""
+    def __init__(self: Self, capture: "CaptureFile", block: int, summary: ChunkSummary) -> None:
+        self.capture = capture
+        self.block = block
+        self.summary = summary
+
+    def mapped(self: Self) -> MappedChunk:
+        return self.capture.load(self.block)
+
+    def location(self: Self) -> tuple[str, int, int]:
+        """The path of the capture file, and the offset and size of the block."""
+        (offset, size) = self.capture.blocks[self.block][:2]
+        return self.capture.path, offset, size
+
+
+class CaptureFile:
+    """
+    A capture file opened for reading. The `cached` most recently used blocks
+    are kept decoded.
+    """
+    def __init__(self: Self, path: str, cached: int = 16) -> None:
+        self.path = path
+        self.file = open(path, "rb")  # noqa: SIM115, read from for as long as the rows are kept
+        weakref.finalize(self, self.file.close)
+        try:
+            (magic, version) = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("not a capture file")
+            if version != VERSION:
+                raise ValueError(f"capture file version {version} is not supported")
+            self.file.seek(-TRAILER.size, os.SEEK_END)
+            (offset, size, _) = TRAILER.unpack(self.file.read(TRAILER.size))
+            self.file.seek(offset)
+            self.footer = json.loads(zlib.decompress(self.file.read(size)))
+        except (struct.error, zlib.error) as e:
+            raise ValueError(f"damaged capture file: {e}") from e
+        self.blocks: list[list] = self.footer["blocks"]
+        # Blocks decoded by number
+        self.decoded = BlockCache(cached)
+        # Reads of blocks seek the file
+        self.lock = threading.Lock()
+
+    def restore(self: Self, store: TraceStore) -> None:
+        """Replace the rows of store with those of the capture."""
+        store.clear()
+        # Only the templates of the capture, not those of what was loaded before
+        store.templates.clear()
+        for value in self.footer["modules"]:
+            store.modules.code(value)
+        for value in self.footer["tasks"]:
+            store.tasks.code(value)
+        for value in self.footer["sources"]:
+            store.sources.code(value)
+        for template, (text, args) in self.footer["templates"].items():
+            store.templates.add(int(template), text, args)
+        store.first = self.footer["first"]
+        store.end = self.footer["end"]
+        store.chunk_base = store.first >> CHUNK_BITS
+        store.chunks = [self.chunk(i) for i in range(len(self.blocks))]
+        store.newest = max((block[4] for block in self.blocks), default=None)
+        if store.message_index is not None:
+            store.message_index.skip()
+
+    def chunk(self: Self, block: int) -> TraceChunk | CaptureChunk:
+        (_, _, rows, low, high, modules, tasks, sources, ordered) = self.blocks[block]
+        if rows == CHUNK_ROWS:
+            lazy = CaptureChunk(self, block, ChunkSummary(low, high, frozenset(modules),
+                                                          frozenset(tasks), frozenset(sources)))
+            lazy.ordered = ordered
+            return lazy
+        # The last chunk is read into memory, new rows are appended to it
+        mapped = self.decode(block)
+        chunk = TraceChunk()
+        chunk.offsets = array("I")
+        for column, _, _ in COLUMNS:
+            getattr(chunk, column).frombytes(getattr(mapped, column).cast("B"))
+        chunk.arena = bytearray(mapped.arena)
+        chunk.ordered = ordered
+        return chunk
+
+    def decode(self: Self, block: int) -> MappedChunk:
+        (offset, size, rows) = self.blocks[block][:3]
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(size)
+        return decode_block(data, rows)
+
+    def load(self: Self, block: int) -> MappedChunk:
+        return self.decoded.get(block, partial(self.decode, block))
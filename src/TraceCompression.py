@@ -0,0 +1,89 @@
+"""
+Full chunks of a TraceStore kept compressed in memory.
+
+Most of a long capture is never looked at again. Cold chunks, see TraceSegments,
+are compressed into a block each, encoded like the blocks of a capture file, and
+the store keeps a CompressedChunk in their place. A block is decompressed when
+rows in it are used, and the `cached` most recently used ones are kept
+decompressed, see BlockCache.
+"""
+
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Self
+
+from TraceCapture import decode_block, encode_block
+from TraceSegments import BlockCache, ColdChunks, ColdHistory, LazyChunk, MappedChunk
+from TraceStore import CHUNK_ROWS, TraceChunk
+
+
+@dataclass
+class CompressionStatistics:
+    # Bytes of the chunks compressed, and of their blocks
+    raw: int = 0
+    compressed: int = 0
+    # Reads of blocks served from decompressed blocks, and decompressions
+    hits: int = 0
+    misses: int = 0
+    decompress_seconds: float = 0.0
+
+    def ratio(self: Self) -> float:
+        return self.raw / self.compressed if self.compressed else 1.0
+
+    def hit_rate(self: Self) -> float:
+        reads = self.hits + self.misses
+        return self.hits / reads if reads else 1.0
+
+    def decompress_ms(self: Self) -> float:
+        """Milliseconds per block decompressed."""
+        return self.decompress_seconds * 1000 / self.misses if self.misses else 0.0
+
+    def __str__(self: Self) -> str:
+        return (f"compressed {self.ratio():.1f}x, {self.hit_rate():.0%} cache hits,"
+                f" {self.decompress_ms():.1f} ms per block")
+
+
+class CompressedChunk(LazyChunk):
+    """A full TraceChunk compressed into a block, decompressed while it is used."""
+    def __init__(self: Self, blocks: "CompressedChunks", data: bytes) -> None:
+        self.blocks = blocks
+        self.data = data
+
+    def mapped(self: Self) -> MappedChunk:
+        return self.blocks.load(self)
+
+    def nbytes(self: Self) -> int:
+        return len(self.data)
+
+
+class CompressedChunks(ColdChunks):
+    history = ColdHistory.COMPRESSED
+
+    def __init__(self: Self, hot: int = 8, cached: int = 16) -> None:
+        super().__init__(hot)
+        self.decoded = BlockCache(cached)
+        self.raw = 0
+        self.compressed = 0
+        self.decompress_seconds = 0.0
+
+    @property
+    def statistics(self: Self) -> CompressionStatistics:
+        return CompressionStatistics(self.raw, self.compressed, self.decoded.hits,
+                                     self.decoded.misses, self.decompress_seconds)
+
+    def write(self: Self, chunk: TraceChunk) -> CompressedChunk:
+        data = encode_block(chunk)
+        self.raw += chunk.nbytes()
+        self.compressed += len(data)
+        return CompressedChunk(self, data)
+
+    def load(self: Self, chunk: CompressedChunk) -> MappedChunk:
+        return self.decoded.get(chunk, partial(self.decompress, chunk))
+
+    def decompress(self: Self, chunk: CompressedChunk) -> MappedChunk:
+        start = time.perf_counter()
+        mapped = decode_block(chunk.data, CHUNK_ROWS)
+        # Added up without a lock, it is only shown
+        self.decompress_seconds += time.perf_counter() - start
+        return mapped
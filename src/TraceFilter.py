@@ -1,65 +1,504 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from functools import partial
 from typing import Any, Self
 
-from FilterDSL import FilterDSL
+import numpy as np
+from FilterDSL import FilterDSL, Node
+from FilterMask import MaskEvaluator, timestamps
+from FilterPool import MIN_POOL_ROWS, FilterPool
 from PySide6.QtCore import (
+    QAbstractListModel,
     QModelIndex,
     QPersistentModelIndex,
-    QSortFilterProxyModel,
     Qt,
+    QThread,
     Signal,
     Slot,
 )
-from TraceModel import TraceMessage, TraceModel
+from TraceFormat import LineFormat, RenderCache
+from TraceModel import TraceModel
+from TraceStore import CHUNK_BITS, CHUNK_ROWS, TraceStore
 
 
-class TraceFilter(QSortFilterProxyModel):
+class FilterJob(QThread):
+    """
+    Evaluates a filter over the rows of a store snapshot, one chunk at a time,
+    handing over the accepted rows of each chunk as soon as they are found.
+    Given rows, only those are evaluated. Given a pool, chunks are evaluated in
+    its worker processes.
+    """
+    # Generation, accepted store rows, and the store row evaluated up to
+    found = Signal(int, object, int)
+
+    def __init__(self: Self, generation: int, store: TraceStore,
+                 evaluator: MaskEvaluator | None, rows: np.ndarray | None = None,
+                 pool: FilterPool | None = None) -> None:
+        super(FilterJob, self).__init__()
+        self.generation = generation
+        self.store = store
+        self.evaluator = evaluator
+        self.rows = rows
+        self.pool = pool
+
+    def run(self: Self) -> None:
+        if self.rows is not None:
+            self.run_rows(self.rows)
+            return
+        if self.pool is not None and self.evaluator is not None:
+            self.run_pool(self.pool, self.evaluator)
+            return
+        row = self.store.first
+        while row < self.store.end and not self.isInterruptionRequested():
+            stop = min((row // CHUNK_ROWS + 1) * CHUNK_ROWS, self.store.end)
+            if self.evaluator is None:
+                accepted = np.arange(row, stop, dtype=np.int64)
+            else:
+                accepted = self.evaluator.accepted(row, stop).astype(np.int64)
+            self.found.emit(self.generation, accepted, stop)
+            row = stop
+
+    def run_pool(self: Self, pool: FilterPool, evaluator: MaskEvaluator) -> None:
+        results = pool.accepted(evaluator, self.isInterruptionRequested)
+        try:
+            for accepted, stop in results:
+                self.found.emit(self.generation, accepted, stop)
+        finally:
+            results.close()
+
+    def run_rows(self: Self, rows: np.ndarray) -> None:
+        bounds = np.flatnonzero(np.diff(rows >> CHUNK_BITS)) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(rows)], strict=True):
+            if self.isInterruptionRequested():
+                return
+            if lo == hi:
+                continue
+            accepted = rows[lo:hi]
+            if self.evaluator is not None:
+                accepted = self.evaluator.accepted_rows(accepted)
+            self.found.emit(self.generation, accepted, int(rows[hi - 1]) + 1)
+
+
+class FilterResults:
+    """
+    The rows accepted by recently used filters, keyed by filter expression and
+    model generation, with the store row each was evaluated up to.
+    """
+    def __init__(self: Self, size: int = 8, max_rows: int = 1 << 22) -> None:
+        self.size = size
+        self.max_rows = max_rows
+        self.results: OrderedDict[tuple[Node, int], tuple[np.ndarray, int]] = OrderedDict()
+
+    def get(self: Self, key: tuple[Node, int]) -> tuple[np.ndarray, int] | None:
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+        return result
+
+    def put(self: Self, key: tuple[Node, int], rows: np.ndarray, evaluated: int) -> None:
+        # Results of an older generation can never be used again
+        for stale in [k for k in self.results if k[1] != key[1]]:
+            del self.results[stale]
+        self.results[key] = (rows, evaluated)
+        self.results.move_to_end(key)
+        while len(self.results) > self.size or (
+                len(self.results) > 1 and self.rows() > self.max_rows):
+            self.results.popitem(last=False)
+
+    def rows(self: Self) -> int:
+        return sum(len(rows) for rows, _ in self.results.values())
+
+    def clear(self: Self) -> None:
+        self.results.clear()
+
+
+class AcceptedRows:
+    """
+    Ascending store rows accepted by a filter, starting at rows[head], with the
+    timestamp of each for looking rows up by time.
+    """
+    def __init__(self: Self, store: TraceStore, rows: np.ndarray | None = None) -> None:
+        self.store = store
+        self.rows = array("q")
+        self.timestamps = array("q")
+        self.head = 0
+        if rows is not None:
+            self.extend(rows)
+
+    def __len__(self: Self) -> int:
+        return len(self.rows) - self.head
+
+    def __getitem__(self: Self, row: int) -> int:
+        return self.rows[self.head + row]
+
+    def find(self: Self, store_row: int) -> int:
+        """The row of store_row, -1 if it is not one of the rows."""
+        row = bisect_left(self.rows, store_row, self.head)
+        if row == len(self.rows) or self.rows[row] != store_row:
+            return -1
+        return row - self.head
+
+    def before(self: Self, store_row: int) -> int:
+        """The number of rows before store_row."""
+        return bisect_left(self.rows, store_row, self.head) - self.head
+
+    def at_time(self: Self, timestamp: int) -> int:
+        """The last row at or before timestamp, or the first row."""
+        if self.store.ordered():
+            return max(bisect_right(self.timestamps, timestamp, self.head) - 1 - self.head, 0)
+        # The row before the first one past timestamp, as TraceStore.find_timestamp
+        timestamps = np.frombuffer(self.timestamps, dtype=np.int64)[self.head:]
+        past = np.flatnonzero(timestamps > timestamp)
+        return max((int(past[0]) if len(past) > 0 else len(self)) - 1, 0)
+
+    def extend(self: Self, rows: np.ndarray) -> None:
+        self.rows.frombytes(rows.tobytes())
+        self.timestamps.frombytes(timestamps(self.store, rows).tobytes())
+
+    def drop(self: Self, count: int) -> None:
+        """Forget the first count rows."""
+        self.head += count
+        # Compact once the dropped part outgrows the rows kept
+        if self.head > len(self.rows) // 2:
+            del self.rows[:self.head]
+            del self.timestamps[:self.head]
+            self.head = 0
+
+    def numpy(self: Self) -> np.ndarray:
+        return np.frombuffer(self.rows, dtype=np.int64)[self.head:].copy()
+
+
+class AllRows:
+    """
+    The store rows [first, end), for views without a filter, which so take no
+    memory per row.
+    """
+    def __init__(self: Self, store: TraceStore, first: int, end: int) -> None:
+        self.store = store
+        self.first = first
+        self.end = end
+
+    def __len__(self: Self) -> int:
+        return self.end - self.first
+
+    def __getitem__(self: Self, row: int) -> int:
+        return self.first + row
+
+    def find(self: Self, store_row: int) -> int:
+        return store_row - self.first if self.first <= store_row < self.end else -1
+
+    def before(self: Self, store_row: int) -> int:
+        return min(max(store_row - self.first, 0), len(self))
+
+    def at_time(self: Self, timestamp: int) -> int:
+        row = self.store.find_timestamp(timestamp, after=True) - 1 - self.first
+        return min(max(row, 0), len(self) - 1)
+
+    def extend(self: Self, rows: np.ndarray) -> None:
+        """Add rows, which must follow on from the rows there are."""
+        if len(rows) == 0:
+            return
+        if len(self) == 0:
+            self.first = int(rows[0])
+        self.end = int(rows[-1]) + 1
+
+    def drop(self: Self, count: int) -> None:
+        self.first += count
+
+    def numpy(self: Self) -> np.ndarray:
+        return np.arange(self.first, self.end, dtype=np.int64)
+
+
+class TraceFilter(QAbstractListModel):
+    """
+    Append only filter proxy for a TraceModel.
+
+    The accepted store rows are kept in one array, or as a range without a
+    filter. When the source model grows only the new rows are evaluated, and they
+    are appended with a single beginInsertRows, so the cost of a flush depends on
+    the number of new messages and not on the size of the model. Rows evicted
+    from the front of the source only move the start of the array.
+    """
     view_scroll_to_index = Signal(QModelIndex)
+    # Percentage of the rows evaluated by a refilter, 100 once done
+    progress = Signal(int)
 
     def __init__(self: Self, model: TraceModel) -> None:
         super(TraceFilter, self).__init__()
         self.filter: FilterDSL | None = None
+        self.evaluator: MaskEvaluator | None = None
         self.format: str = "[{timestamp}][{module:10}] : {message}"
-        self.setSourceModel(model)
-        self.setDynamicSortFilter(False)
+        self.source = model
+        self.line_format = LineFormat(model.store, self.format)
+        # Bumped by update_format, so lines rendered with an older format miss
+        self.format_generation = 0
+        self.render_cache = RenderCache()
+        # Store rows accepted by the filter, and the store row evaluation stopped at
+        self.rows: AcceptedRows | AllRows = AcceptedRows(model.store)
+        self.evaluated = 0
+        # The refilter running in the background, and the number of the latest one
+        self.job: FilterJob | None = None
+        self.jobs: list[FilterJob] = []
+        self.generation = 0
+        self.job_start = 0
+        self.job_end = 0
+        # Rows found by the job not shown yet. They are shown once they at least
+        # double the rows shown, so a refilter makes few inserts
+        self.pending: list[np.ndarray] = []
+        self.pending_rows = 0
+        # So switching back to a recent filter needs no evaluation
+        self.results = FilterResults()
+        # Hidden views skip new rows, and evaluate them in one go once shown again
+        self.suspended = False
+        model.rowsInserted.connect(self.source_rows_inserted)
+        model.rowsRemoved.connect(self.source_rows_removed)
+        model.modelReset.connect(self.refilter)
         model.global_time_updated.connect(self.global_time_updated)
+        self.refilter()
 
     def data(self: Self, index: QModelIndex, role: Qt.ItemDataRole | None = None) -> Any:
+        if not index.isValid():
+            return None
         if role == Qt.ItemDataRole.DisplayRole:
-            item : TraceMessage = super().data(index, Qt.ItemDataRole.UserRole)
-            try:
-                return self.format.format_map(item)
-            except ValueError as e:
-                return str(e)
-        return super().data(index, role)
+            row = self.store_row(index.row())
+            return self.render_cache.get(
+                (row, self.format_generation),
+                partial(self.line_format.render, row, self.source.message_at))
+        return self.source.data(self.mapToSource(index), role)
 
     def sourceModel(self: Self) -> TraceModel:  # noqa: N802
-        model = super().sourceModel()
-        if not isinstance(model, TraceModel):
-            raise TypeError("TraceFilter does not contain TraceModel as model")
-        return model
+        return self.source
+
+    def rowCount(  # noqa: N802
+        self: Self, parent: QModelIndex | QPersistentModelIndex | None = None
+    ) -> int:
+        return len(self.rows)
+
+    def store_row(self: Self, row: int) -> int:
+        return self.rows[row]
+
+    def mapToSource(self: Self, index: QModelIndex) -> QModelIndex:  # noqa: N802
+        if not index.isValid():
+            return QModelIndex()
+        return self.source.index(self.store_row(index.row()) - self.source.store.first, 0)
+
+    def mapFromSource(self: Self, source_index: QModelIndex) -> QModelIndex:  # noqa: N802
+        row = self.rows.find(self.source.store_row(source_index))
+        if row == -1:
+            return QModelIndex()
+        return self.index(row, 0)
+
+    def accepted(self: Self, start: int, stop: int) -> np.ndarray:
+        if self.evaluator is None:
+            return np.arange(start, stop, dtype=np.int64)
+        return self.source.filter_engine.accepted(self.evaluator, start, stop)
+
+    @Slot(QModelIndex, int, int)
+    def source_rows_inserted(self: Self, parent: QModelIndex, first: int, last: int) -> None:
+        if self.job is not None or self.suspended:
+            # Picked up once the refilter is done, to keep the rows in order, or
+            # once shown again
+            return
+        # Evaluate from what was seen so far rather than trusting first/last
+        store = self.source.store
+        if store.end <= self.evaluated:
+            return
+        # Rows may have been evicted while suspended
+        new_rows = self.accepted(max(self.evaluated, store.first), store.end)
+        self.evaluated = store.end
+        self.append_rows(new_rows)
+
+    def append_rows(self: Self, new_rows: np.ndarray) -> None:
+        if len(new_rows) == 0:
+            return
+        count = self.rowCount()
+        self.beginInsertRows(QModelIndex(), count, count + len(new_rows) - 1)
+        self.rows.extend(new_rows)
+        self.endInsertRows()
+
+    @Slot(QModelIndex, int, int)
+    def source_rows_removed(self: Self, parent: QModelIndex, first: int, last: int) -> None:
+        # The source only removes rows by evicting them from the front
+        evicted = self.rows.before(self.source.store.first)
+        if evicted == 0:
+            return
+        self.beginRemoveRows(QModelIndex(), 0, evicted - 1)
+        self.rows.drop(evicted)
+        self.endRemoveRows()
+
+    @Slot()
+    def refilter(self: Self) -> None:
+        """
+        Evaluate the filter over every row again, in the background. Rows show up
+        as they are found, and a refilter still running is cancelled.
+        """
+        store = self.source.store
+        if self.evaluator is None:
+            self.render_cache.clear()
+            self.restore(AllRows(store, store.first, store.end), store.end)
+            return
+        self.start_job(None, store.end)
+
+    def refine(self: Self) -> None:
+        """
+        Evaluate the filter over the rows accepted so far only, for a filter that
+        refines the one they were accepted by.
+        """
+        self.start_job(self.rows.numpy(), self.evaluated)
+
+    def start_job(self: Self, rows: np.ndarray | None, end: int) -> None:
+        """Evaluate rows, or every row when None, with rows up to end evaluated."""
+        self.cancel()
+        self.beginResetModel()
+        # Store rows are numbered from 0 again after a reset
+        self.render_cache.clear()
+        store = self.source.store
+        self.rows = AcceptedRows(store)
+        self.evaluated = store.first
+        self.endResetModel()
+
+        self.generation += 1
+        self.job_start = store.first
+        self.job_end = end
+        self.pending = []
+        self.pending_rows = 0
+        snapshot = store.snapshot()
+        evaluator = None if self.evaluator is None else MaskEvaluator(snapshot, self.evaluator.root)
+        pool = None
+        if self.source.filter_pool.workers > 1 and len(snapshot) >= MIN_POOL_ROWS:
+            pool = self.source.filter_pool
+        self.job = FilterJob(self.generation, snapshot, evaluator, rows, pool)
+        self.job.found.connect(self.job_found)
+        self.job.finished.connect(partial(self.job_finished, self.job))
+        self.jobs.append(self.job)
+        self.progress.emit(0)
+        self.job.start()
+
+    def restore(self: Self, rows: AcceptedRows | AllRows, evaluated: int) -> None:
+        """Show rows accepted earlier, evaluating only the rows added since."""
+        self.cancel()
+        store = self.source.store
+        rows.drop(rows.before(store.first))
+        self.beginResetModel()
+        self.rows = rows
+        self.evaluated = max(evaluated, store.first)
+        self.endResetModel()
+        self.generation += 1
+        self.source_rows_inserted(QModelIndex(), 0, 0)
+        self.follow()
+        self.progress.emit(100)
+
+    def remember(self: Self) -> None:
+        """Keep the rows accepted by the current filter, once it is done."""
+        if self.filter is None or self.job is not None:
+            return
+        self.results.put((self.filter.root, self.source.generation), self.rows.numpy(),
+                         self.evaluated)
+
+    def follow(self: Self) -> None:
+        """Have new rows evaluated together with the filters of the other views."""
+        if self.evaluator is not None and not self.suspended:
+            self.source.filter_engine.register(self, self.evaluator)
 
-    def filterAcceptsRow(self: Self, source_row: int,  # noqa: N802
-                         source_parent: QModelIndex | QPersistentModelIndex) -> bool:
-        if source_row >= len(self.sourceModel().logs):
-            return False
+    def busy(self: Self) -> bool:
+        """True while a refilter is running in the background."""
+        return self.job is not None
 
-        if self.filter is None:
-            return True
+    def suspend(self: Self, suspended: bool) -> None:
+        """
+        Stop evaluating new rows, e.g. while the views are hidden. Once resumed,
+        the rows added since are evaluated in one pass.
+        """
+        if suspended == self.suspended:
+            return
+        self.suspended = suspended
+        if suspended:
+            self.source.filter_engine.unregister(self)
+        elif self.job is None:
+            self.source_rows_inserted(QModelIndex(), 0, 0)
+            self.follow()
 
-        log = self.sourceModel().logs[source_row]
-        return self.filter.eval(log.__dict__)
+    def cancel(self: Self) -> None:
+        self.source.filter_engine.unregister(self)
+        if self.job is not None:
+            self.job.requestInterruption()
+            self.job = None
+
+    @Slot(int, object, int)
+    def job_found(self: Self, generation: int, rows: np.ndarray, stop: int) -> None:
+        if generation != self.generation or self.job is None:
+            return
+        self.pending.append(rows)
+        self.pending_rows += len(rows)
+        self.evaluated = stop
+        if self.pending_rows >= self.rowCount():
+            self.show_pending()
+        if self.job_end > self.job_start:
+            # 100 is left for job_finished, once every row is shown
+            done = 100 * (stop - self.job_start) // (self.job_end - self.job_start)
+            self.progress.emit(min(done, 99))
+
+    def show_pending(self: Self) -> None:
+        if not self.pending:
+            return
+        rows = np.concatenate(self.pending)
+        self.pending = []
+        self.pending_rows = 0
+        # Rows evicted since they were evaluated
+        self.append_rows(rows[rows >= self.source.store.first])
+
+    def job_finished(self: Self, job: FilterJob) -> None:
+        self.jobs.remove(job)
+        # Chunks evicted while the job ran may have been copied for its workers
+        self.source.filter_pool.shared.release(self.source.store.chunks)
+        if job is not self.job:
+            return
+        # Views scroll to the end once, when progress reaches 100
+        self.show_pending()
+        self.job = None
+        # Rows after the last one given to a refinement were rejected before
+        self.evaluated = max(self.evaluated, self.job_end)
+        # Catch up with the rows added while the job ran
+        self.source_rows_inserted(QModelIndex(), 0, 0)
+        self.follow()
+        self.progress.emit(100)
 
     def update_filter(self: Self, new_filter: str) -> None:
         new_model = None
+        evaluator = None
         if new_filter.strip() != "":
             new_model = FilterDSL(new_filter)
-            new_model.eval(self.sourceModel().logs[0].__dict__)
-        self.beginResetModel()
+            plan = new_model.plan(self.source.filter_statistics())
+            evaluator = MaskEvaluator(self.source.store, plan)
+        previous = self.filter
+        self.remember()
+        # A refinement is only evaluated over a complete previous result
+        refines = (previous is not None and new_model is not None and self.job is None
+                   and new_model.refines(previous))
         self.filter = new_model
-        self.endResetModel()
+        self.evaluator = evaluator
+
+        store = self.source.store
+        if new_model is None:
+            self.restore(AllRows(store, store.first, store.end), store.end)
+            return
+        result = self.results.get((new_model.root, self.source.generation))
+        if result is not None:
+            (rows, evaluated) = result
+            self.restore(AcceptedRows(store, rows[rows >= store.first]), evaluated)
+        elif refines:
+            self.refine()
+        else:
+            self.refilter()
 
     def update_format(self: Self, new_format:str) -> None:
         self.format = new_format
+        self.line_format = LineFormat(self.source.store, new_format)
+        self.format_generation += 1
+        self.render_cache.clear()
+        if self.rowCount() > 0:
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, 0))
 
     @Slot(QModelIndex)
     def scrolled_to_index(self: Self, index: QModelIndex) -> None:
@@ -68,19 +507,6 @@ class TraceFilter(QSortFilterProxyModel):
 
     @Slot(int)
     def global_time_updated(self: Self, timestamp: int) -> None:
-        left = 0
-        right = self.rowCount() - 1
-        while left <= right:
-            middle = (left+right) // 2
-            potential_match : TraceMessage = self.data(self.index(middle, 0), role = Qt.ItemDataRole.UserRole)
-            if timestamp == potential_match.timestamp:
-                break
-            elif timestamp < potential_match.timestamp:
-                right = middle - 1
-            else:
-                left = middle + 1
-        if right < 0:
-            right = 0
-        guess : TraceMessage = self.data(self.index(right, 0), role = Qt.ItemDataRole.UserRole)
-        if guess is not None:
-            self.view_scroll_to_index.emit(self.index(right, 0))
+        if self.rowCount() == 0:
+            return
+        self.view_scroll_to_index.emit(self.index(self.rows.at_time(timestamp), 0))
@@ -0,0 +1,78 @@
+"""
+Rendering of trace rows as lines of text, for the views.
+
+The line format is a format string over the fields of a message, e.g.
+"[{timestamp}][{module:10}] : {message}". LineFormat parses it once into a
+format string with positional fields and the store getter for each field, so
+rendering a row is one str.format call with no per row dict lookups.
+"""
+
+from collections import OrderedDict
+from string import Formatter
+from typing import Any, Callable, Self
+
+from TraceStore import TraceStore
+
+
+class LineFormat:
+    def __init__(self: Self, store: TraceStore, text: str) -> None:
+        self.store = store
+        self.text = text
+        self.getters: list[Callable[[int], Any]] = []
+        # Set when the format can not be compiled, rendered the slow way instead
+        self.fallback = False
+        self.compiled = ""
+        getters = store.getters()
+        parts = []
+        try:
+            for literal, name, spec, conversion in Formatter().parse(text):
+                parts.append(literal.replace("{", "{{").replace("}", "}}"))
+                if name is None:
+                    continue
+                if name not in getters or "{" in spec:
+                    self.fallback = True
+                    return
+                parts.append(f"{{{len(self.getters)}{'!' + conversion if conversion else ''}"
+                             f"{':' + spec if spec else ''}}}")
+                self.getters.append(getters[name])
+        except ValueError:
+            self.fallback = True
+            return
+        self.compiled = "".join(parts)
+
+    def render(self: Self, row: int, message: Callable[[int], Any]) -> str:
+        """
+        Render store row. message(row) builds the TraceMessage used by formats
+        that could not be compiled.
+        """
+        try:
+            if self.fallback:
+                return self.text.format_map(message(row))
+            return self.compiled.format(*[get(row) for get in self.getters])
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            return str(e)
+
+
+class RenderCache:
+    """The most recently rendered lines, keyed by store row and format generation."""
+    def __init__(self: Self, size: int = 4096) -> None:
+        self.size = size
+        self.lines: OrderedDict[tuple[int, int], str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self: Self, key: tuple[int, int], render: Callable[[], str]) -> str:
+        line = self.lines.get(key)
+        if line is not None:
+            self.hits += 1
+            self.lines.move_to_end(key)
+            return line
+        self.misses += 1
+        line = render()
+        self.lines[key] = line
+        if len(self.lines) > self.size:
+            self.lines.popitem(last=False)
+        return line
+
+    def clear(self: Self) -> None:
+        self.lines.clear()
@@ -0,0 +1,133 @@
+"""
+Trigram index over the message text of a TraceStore, for `contains` filters.
+
+For every chunk the index maps each 3 byte sequence of the message text to the
+rows it appears in. A `contains` needle of at least 3 bytes can only match rows
+that have all of its trigrams, so intersecting a few posting lists gives a small
+set of candidate rows, and only those are checked for the whole needle.
+
+The index is built incrementally. Each update indexes the rows appended since
+the last one into a new segment of the last chunk, and the segments of a chunk
+are merged into one when the chunk is full. Evicted chunks drop their index.
+"""
+
+from typing import Self
+
+import numpy as np
+
+from TraceStore import CHUNK_BITS, CHUNK_ROWS, TEXT, TraceChunk, TraceStore
+
+# Merge the segments of a chunk that is still growing beyond this many
+MAX_SEGMENTS = 8
+
+
+def trigrams(text: np.ndarray) -> np.ndarray:
+    """The trigram starting at every position of text, as 24 bit integers."""
+    text = text.astype(np.uint32)
+    return (text[:-2] << 16) | (text[1:-1] << 8) | text[2:]
+
+
+class Postings:
+    """The rows of each trigram in part of a chunk, sorted by trigram then row."""
+    def __init__(self: Self, keys: np.ndarray) -> None:
+        # keys are trigram << 16 | row, unique and sorted
+        (self.trigrams, self.starts) = np.unique(keys >> 16, return_index=True)
+        self.trigrams = self.trigrams.astype(np.uint32)
+        self.starts = np.append(self.starts, len(keys)).astype(np.uint32)
+        self.rows = (keys & 0xFFFF).astype(np.uint16)
+
+    @classmethod
+    def build(cls: type[Self], chunk: TraceChunk, lo: int, hi: int) -> Self:
+        # Copies of the new rows only, a view would keep the chunk from growing
+        offsets = np.frombuffer(chunk.offsets[lo:hi + 1], dtype=np.uint32).astype(np.int64)
+        text = np.frombuffer(chunk.arena[offsets[0]:offsets[-1]], dtype=np.uint8)
+        if len(text) < 3:
+            return cls(np.zeros(0, dtype=np.int64))
+        grams = trigrams(text).astype(np.int64)
+        # The row of every trigram position, dropping those running into the next row
+        rows = np.searchsorted(offsets, np.arange(len(grams)) + offsets[0], side="right") - 1
+        keep = np.arange(len(grams)) + offsets[0] + 3 <= offsets[rows + 1]
+        # Deferred messages hold packed arguments, not text
+        templates = np.frombuffer(chunk.templates[lo:hi], dtype=np.uint16)
+        keep &= templates[rows] == TEXT
+        return cls(np.unique((grams[keep] << 16) | (rows[keep] + lo)))
+
+    def keys(self: Self) -> np.ndarray:
+        counts = np.diff(self.starts.astype(np.int64))
+        return (np.repeat(self.trigrams.astype(np.int64), counts) << 16) | self.rows
+
+    def lookup(self: Self, trigram: int) -> np.ndarray:
+        i = np.searchsorted(self.trigrams, trigram)
+        if i == len(self.trigrams) or self.trigrams[i] != trigram:
+            return self.rows[:0]
+        return self.rows[self.starts[i]:self.starts[i + 1]]
+
+    def nbytes(self: Self) -> int:
+        return self.trigrams.nbytes + self.starts.nbytes + self.rows.nbytes
+
+
+class TrigramIndex:
+    def __init__(self: Self, store: TraceStore) -> None:
+        self.store = store
+        self.clear()
+
+    def clear(self: Self) -> None:
+        # Segments by chunk number
+        self.chunks: dict[int, list[Postings]] = {}
+        # Rows in [start, indexed) are indexed
+        self.start = self.store.first
+        self.indexed = self.store.first
+
+    def skip(self: Self) -> None:
+        """
+        Leave the rows kept now out of the index, e.g. those of an opened capture,
+        which would all have to be read.
+        """
+        self.clear()
+        self.start = self.indexed = self.store.end
+
+    def update(self: Self) -> None:
+        """Index the rows appended since the last update."""
+        store = self.store
+        for number in [n for n in self.chunks if n < store.chunk_base]:
+            del self.chunks[number]
+        row = max(self.indexed, store.first)
+        while row < store.end:
+            number = row >> CHUNK_BITS
+            chunk = store.chunk(row)
+            lo = row - (number << CHUNK_BITS)
+            hi = len(chunk)
+            segments = self.chunks.setdefault(number, [])
+            segments.append(Postings.build(chunk, lo, hi))
+            if hi == CHUNK_ROWS or len(segments) > MAX_SEGMENTS:
+                keys = np.sort(np.concatenate([s.keys() for s in segments]))
+                self.chunks[number] = [Postings(keys)]
+            row += hi - lo
+        self.indexed = store.end
+
+    def covers(self: Self, start: int, stop: int) -> bool:
+        return start >= max(self.start, self.store.first) and stop <= self.indexed
+
+    def candidates(self: Self, chunk: int, needle: bytes) -> np.ndarray | None:
+        """
+        Sorted rows within chunk number chunk that may contain needle, None if the
+        needle is too short to use the index.
+        """
+        if len(needle) < 3:
+            return None
+        wanted = np.unique(trigrams(np.frombuffer(needle, dtype=np.uint8)))
+        found = []
+        for segment in self.chunks.get(chunk, []):
+            lists = sorted((segment.lookup(g) for g in wanted.tolist()), key=len)
+            rows = lists[0]
+            for other in lists[1:]:
+                if len(rows) == 0:
+                    break
+                rows = np.intersect1d(rows, other, assume_unique=True)
+            found.append(rows)
+        if not found:
+            return np.zeros(0, dtype=np.uint16)
+        return np.concatenate(found)
+
+    def nbytes(self: Self) -> int:
+        return sum(s.nbytes() for segments in self.chunks.values() for s in segments)
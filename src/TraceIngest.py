@@ -0,0 +1,123 @@
+"""
+Hand over of trace messages from a reader thread to the GUI thread.
+
+The reader collects messages into batches and hands over whole batches. Each
+hand over is a single deque append, which is atomic, so there is no lock or
+cross thread signal per message. The GUI thread takes every pending batch when it
+flushes.
+
+When the GUI falls behind and more than `limit` messages are pending, the
+OverflowPolicy decides what happens to new batches.
+"""
+
+import pickle
+import tempfile
+import threading
+from collections import deque
+from enum import Enum
+from typing import Any, Callable, Self
+
+from TraceStore import TraceBatch
+
+
+class OverflowPolicy(Enum):
+    # Stall the reader until the GUI has caught up
+    BLOCK = "Block"
+    # Throw away the oldest pending batches, counted in `dropped`
+    DROP_OLDEST = "Drop oldest"
+    # Write new batches to a temporary file, and read them back in order later.
+    # Not supported by the ingest process, see TraceRing
+    SPILL = "Spill to disk"
+
+
+class IngestBuffer:
+    def __init__(self: Self, limit: int = 1000000,
+                 policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST) -> None:
+        self.limit = limit
+        self.policy = policy
+        self.batches: deque[TraceBatch] = deque()
+        # Each counter is only written by one thread
+        self.queued = 0
+        self.taken = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.drained = threading.Event()
+        self.spill_lock = threading.Lock()
+        self.spill_file: Any = None
+        self.spill_read = 0
+        self.spill_batches = 0
+
+    def put(self: Self, batch: TraceBatch, stopping: Callable[[], bool] | None = None) -> None:
+        """
+        Hand over a batch. Called from the reader thread, which stops waiting for
+        the GUI once stopping returns True, and hands the batch over anyway.
+        """
+        if self.spill_batches > 0:
+            # Keep the order, once spilling everything goes through the file
+            self.spill(batch)
+            return
+
+        if self.pending() + len(batch) > self.limit:
+            if self.policy == OverflowPolicy.BLOCK:
+                self.drained.clear()
+                while not self.drained.wait(0.05):
+                    if stopping is not None and stopping():
+                        break
+            elif self.policy == OverflowPolicy.SPILL:
+                self.spill(batch)
+                return
+            else:
+                while self.pending() + len(batch) > self.limit:
+                    try:
+                        oldest = self.batches.popleft()
+                    except IndexError:
+                        break
+                    self.dropped += len(oldest)
+
+        self.queued += len(batch)
+        self.batches.append(batch)
+
+    def pending(self: Self) -> int:
+        """Messages handed over but not taken yet, not counting spilled ones."""
+        return self.queued - self.dropped - self.taken
+
+    def spill(self: Self, batch: TraceBatch) -> None:
+        with self.spill_lock:
+            if self.spill_file is None:
+                self.spill_file = tempfile.TemporaryFile()
+            self.spill_file.seek(0, 2)
+            pickle.dump(batch, self.spill_file)
+            self.spill_batches += 1
+            self.spilled += len(batch)
+
+    def unspill(self: Self, count: int) -> list[TraceBatch]:
+        """Read back up to count spilled messages, oldest first."""
+        batches = []
+        with self.spill_lock:
+            self.spill_file.seek(self.spill_read)
+            while self.spill_batches > 0 and count > 0:
+                batch = pickle.load(self.spill_file)
+                batches.append(batch)
+                count -= len(batch)
+                self.spill_batches -= 1
+            self.spill_read = self.spill_file.tell()
+            if self.spill_batches == 0:
+                self.spill_file.close()
+                self.spill_file = None
+                self.spill_read = 0
+        return batches
+
+    def take(self: Self) -> list[TraceBatch]:
+        """Take every pending batch. Called from the GUI thread."""
+        batches = []
+        while True:
+            try:
+                batch = self.batches.popleft()
+            except IndexError:
+                break
+            self.taken += len(batch)
+            batches.append(batch)
+        if not batches and self.spill_batches > 0:
+            batches = self.unspill(self.limit)
+        self.drained.set()
+        return batches
@@ -0,0 +1,175 @@
+"""
+Several trace sources merged into one, in timestamp order.
+
+Traces are often captured from several devices at once. MergedSource reads each
+of its sources into a batch of its own, and moves their rows into the batch it is
+read into with a k-way merge: a heap holds the timestamp of the oldest pending row
+of each source, so taking the next row costs O(log N) for N sources. The rows of
+one source are expected in timestamp order, and are moved in runs up to the
+timestamp of the next source on the heap, so a burst from one device is copied
+as whole column slices rather than row by row.
+
+A row is merged once no source can still send an older one, because every other
+source has pending rows, has ended, or has already sent a row at least as new.
+Devices arrive with different latencies, so a row waits at most `skew` seconds for
+a slower source. Rows that arrive later than that are merged as they come, after
+newer rows of other sources.
+
+Each row gets the position of its source as source id, "0" for the first one.
+"""
+
+import heapq
+import math
+import time
+from bisect import bisect_right
+from collections import deque
+from typing import Self
+
+from loguru import logger
+
+from TraceSource import TraceSource, open_source
+from TraceStore import Interner, TraceBatch
+
+
+def recode(names: Interner, into: Interner, codes: list[int]) -> list[int]:
+    """Extend codes, the codes in into of the values of names, to every value of names."""
+    if len(codes) < len(names):
+        codes.extend(into.code(value) for value in names.values[len(codes):])
+    return codes
+
+
+class MergedSource(TraceSource):
+    """The messages of sources merged by timestamp, see the module docstring."""
+    def __init__(self: Self, sources: list[TraceSource], skew: float = 0.1) -> None:
+        self.sources = sources
+        self.skew = skew
+        self.running = [True] * len(sources)
+        # Rows read from each source, merged up to taken
+        self.pending = [TraceBatch() for _ in sources]
+        self.taken = [0] * len(sources)
+        # Rows in pending after each read from a source, and when it was read
+        self.arrived: list[deque[tuple[int, float]]] = [deque() for _ in sources]
+        # Timestamp of the newest row read from each source
+        self.latest: list[float] = [-math.inf] * len(sources)
+        # Timestamp of the oldest row not merged yet and its source, of each
+        # source with pending rows
+        self.heap: list[tuple[int, int]] = []
+        # Codes of the module, task and source names of each source in the batch
+        # read into, see recode
+        self.batch: TraceBatch | None = None
+        self.codes: list[tuple[list[int], list[int], list[int]]] = []
+
+    def read(self: Self, batch: TraceBatch, timeout: float) -> bool:
+        live = [i for i, running in enumerate(self.running) if running]
+        for i in live:
+            self.read_source(i, timeout / len(live))
+        self.merge(batch)
+        return any(self.running) or len(self.heap) > 0
+
+    def read_source(self: Self, i: int, timeout: float) -> None:
+        pending = self.pending[i]
+        count = len(pending)
+        try:
+            self.running[i] = self.sources[i].read(pending, timeout)
+        except OSError as e:
+            # The other sources keep going
+            logger.error(f"Trace source {i} failed: {e}")
+            self.running[i] = False
+        if len(pending) > count:
+            self.arrived[i].append((len(pending), time.monotonic()))
+            self.latest[i] = pending.timestamps[-1]
+            if count == self.taken[i]:
+                heapq.heappush(self.heap, (pending.timestamps[count], i))
+
+    def merge(self: Self, batch: TraceBatch) -> None:
+        """Move every row that can be merged into batch, in timestamp order."""
+        if batch is not self.batch:
+            self.batch = batch
+            self.codes = [([], [], []) for _ in self.sources]
+        cutoff = time.monotonic() - self.skew
+        # Rows that waited long enough to be merged without waiting for other sources
+        ripe = [self.ripe(i, cutoff) for i in range(len(self.sources))]
+        # Sources without pending rows can still send rows newer than the newest
+        # they sent
+        horizon = min((self.latest[i] for i, running in enumerate(self.running)
+                       if running and self.taken[i] == len(self.pending[i])), default=math.inf)
+        heap = self.heap
+        while heap:
+            (timestamp, i) = heap[0]
+            start = self.taken[i]
+            if timestamp > horizon and start >= ripe[i]:
+                break
+            heapq.heappop(heap)
+            after = heap[0][0] if heap else math.inf
+            timestamps = self.pending[i].timestamps
+            stop = bisect_right(timestamps, min(after, horizon), start)
+            if start < ripe[i]:
+                stop = max(stop, bisect_right(timestamps, after, start, ripe[i]))
+            self.move(batch, i, start, stop)
+            self.taken[i] = stop
+            if stop < len(timestamps):
+                heapq.heappush(heap, (timestamps[stop], i))
+            elif self.running[i]:
+                horizon = min(horizon, self.latest[i])
+        self.compact()
+
+    def ripe(self: Self, i: int, cutoff: float) -> int:
+        """The rows of pending[i] read at or before cutoff."""
+        rows = 0
+        for count, at in self.arrived[i]:
+            if at > cutoff:
+                break
+            rows = count
+        return rows
+
+    def move(self: Self, batch: TraceBatch, i: int, start: int, stop: int) -> None:
+        pending = self.pending[i]
+        (modules, tasks, sources) = self.codes[i]
+        recode(pending.module_names, batch.module_names, modules)
+        recode(pending.task_names, batch.task_names, tasks)
+        if len(sources) < len(pending.source_names):
+            source = batch.source_names.code(str(i))
+            sources.extend([source] * (len(pending.source_names) - len(sources)))
+        batch.extend_from(pending, start, stop, modules, tasks, sources)
+
+    def compact(self: Self) -> None:
+        """
+        Drop the rows merged from the pending batches, once they are at least half
+        of a batch, so each row is copied a bounded number of times on average.
+        """
+        for i, pending in enumerate(self.pending):
+            taken = self.taken[i]
+            if taken == 0 or taken < len(pending) - taken:
+                continue
+            rest = TraceBatch()
+            rest.module_names = pending.module_names
+            rest.task_names = pending.task_names
+            rest.source_names = pending.source_names
+            if taken < len(pending):
+                rest.extend_from(pending, taken, len(pending),
+                                 list(range(len(pending.module_names))),
+                                 list(range(len(pending.task_names))),
+                                 list(range(len(pending.source_names))))
+            self.pending[i] = rest
+            self.taken[i] = 0
+            self.arrived[i] = deque((count - taken, at) for count, at in self.arrived[i]
+                                    if count > taken)
+
+    def close(self: Self) -> None:
+        for source in self.sources:
+            source.close()
+
+
+def open_sources(addresses: list[str], skew: float = 0.1) -> TraceSource:
+    """Open a source for each address, see open_source, merged if there are several."""
+    if len(addresses) == 1:
+        return open_source(addresses[0])
+    sources: list[TraceSource] = []
+    try:
+        for address in addresses:
+            sources.append(open_source(address))
+    except (OSError, ValueError):
+        for source in sources:
+            source.close()
+        raise
+    return MergedSource(sources, skew)
@@ -1,8 +1,11 @@
-from queue import Empty, Queue
+import math
+import time
+from functools import cache
 from random import choice, randint
 from typing import Self, Type
 
 from essential_generators import DocumentGenerator
+from loguru import logger
 from PySide6.QtCore import (
     QAbstractListModel,
     QModelIndex,
@@ -15,18 +18,56 @@ from PySide6.QtCore import (
     Slot,
 )
 
-gen = DocumentGenerator()
+from FilterDSL import FilterStatistics
+from FilterEngine import FilterEngine
+from FilterPool import DEFAULT_WORKERS, FilterPool
+from TraceCapture import CaptureFile, is_capture, save_capture
+from TraceCompression import CompressedChunks, CompressionStatistics
+from TraceIndex import TrigramIndex
+from TraceIngest import IngestBuffer, OverflowPolicy
+from TraceMerge import open_sources
+from TraceRing import IngestProcess
+from TraceSegments import ColdHistory, SegmentFiles
+from TraceSource import TraceSource
+from TraceStore import (
+    CHUNK_BITS,
+    CHUNK_ROWS,
+    DEFAULT_SOURCE,
+    TraceBatch,
+    TraceChunk,
+    TraceStore,
+)
+
+# Milliseconds of one frame at 60 Hz
+FRAME_MS = 16
+# Flushes of new rows are spaced to take at most this share of the GUI thread
+FLUSH_SHARE = 0.25
+# Longest time between flushes, however long they take
+MAX_FLUSH_INTERVAL_MS = 1000
+
+# Made on first use, as filter worker processes import this module through the
+# main module
+@cache
+def generator() -> DocumentGenerator:
+    """The generator of made up messages, which takes a while and lots of memory."""
+    return DocumentGenerator()
+
+
+@cache
+def made_up_modules() -> list[str]:
+    return [generator().word() for i in range(5)]
 
-modules = [gen.word() for i in range(5)]
 
 current_time = 0
 
 class TraceMessage:
-    def __init__(self: Self, task_id: str, module: str, timestamp: int, message: str) -> None:
+    def __init__(self: Self, task_id: str, module: str, timestamp: int, message: str,
+                 source: str = DEFAULT_SOURCE) -> None:
         self.task_id: str = task_id
         self.module: str = module
         self.timestamp: int = timestamp
         self.message: str = message.replace("\n", "")
+        self.source: str = source
 
     @classmethod
     def generate(cls: Type[Self]) -> Self:
@@ -34,9 +75,9 @@ class TraceMessage:
         current_time += 1
         return TraceMessage(
             str(randint(2, 5)),
-            choice(modules),
+            choice(made_up_modules()),
             current_time,
-            gen.sentence(),
+            generator().sentence(),
         )
 
     def __str__(self: Self) -> str:
@@ -51,82 +92,313 @@ class TraceMessage:
 
         return f"<< Unknown key {key} >>"
 
+class GeneratorSource(TraceSource):
+    """Made up messages, for running without a device."""
+    def read(self: Self, batch: TraceBatch, timeout: float) -> bool:
+        QThread.msleep(randint(2, 20))
+        m = TraceMessage.generate()
+        batch.append(m.task_id, m.module, m.timestamp, m.message)
+        return True
+
+
 class TraceWorker(QThread):
-    more_data: Signal = Signal(list)
+    # Seconds the worker collects messages before handing them over as a batch
+    batch_interval = 0.02
+    # Hand over early when a batch gets this big
+    batch_rows = 65536
 
-    def __init__(self: Self, parent: QObject) -> None:
+    def __init__(self: Self, parent: QObject, buffer: IngestBuffer, source: TraceSource) -> None:
         super(TraceWorker, self).__init__()
+        self.buffer = buffer
+        self.source = source
 
     def run(self: Self) -> None:
         """Long-running task." that calls a separate class for computation"""
-        while True:
-            QThread.msleep(randint(2, 20))
-            self.more_data.emit([TraceMessage.generate()])
+        batch = TraceBatch()
+        handed_over = time.monotonic()
+        running = True
+        while running and not self.isInterruptionRequested():
+            try:
+                running = self.source.read(batch, self.batch_interval)
+            except OSError as e:
+                logger.error(f"Trace source failed: {e}")
+                running = False
+            if len(batch) > 0 and (not running or len(batch) >= self.batch_rows
+                                   or time.monotonic() - handed_over >= self.batch_interval):
+                self.buffer.put(batch, self.isInterruptionRequested)
+                batch = TraceBatch()
+                handed_over = time.monotonic()
+        self.source.close()
 
 
 class TraceModel(QAbstractListModel):
     global_time_updated = Signal(int)
+    # Total number of messages dropped because the GUI fell behind
+    messages_dropped = Signal(int)
 
     def __init__(self: Self) -> None:
         print("New trace model")
         super(TraceModel, self).__init__()
-        self.logs: list[TraceMessage] = []
-        for i in range(50000):
-            self.logs.append(TraceMessage.generate())
-        self.in_buffer: Queue = Queue()
-        self.thread = TraceWorker(self)
-        self.thread.more_data.connect(self.more_data)
+        self.store = TraceStore()
+        self.store.extend(TraceMessage.generate() for i in range(50000))
+        # Number of rows to keep, older rows are evicted. None keeps everything.
+        self.history_length: int | None = None
+        # Bumped by every reset, results for rows of an older generation are stale
+        self.generation = 0
+        # Processes refilters of large stores are split over, 1 filters in process
+        self.filter_pool = FilterPool(DEFAULT_WORKERS)
+        # Evaluates new rows for the filters of every view at once
+        self.filter_engine = FilterEngine(self.store)
+        # Full chunks further behind the newest row than this are cold, see
+        # set_cold_history
+        self.hot_rows = 500000
+        self.ingest: IngestBuffer | IngestProcess = IngestBuffer()
+        self.ingest_process = False
+        # Seconds rows from several addresses wait for slower ones, see TraceMerge
+        self.merge_skew = 0.1
+        self.dropped = 0
+        self.thread = TraceWorker(self, self.ingest, GeneratorSource())
         self.thread.start()
-        self.modules = modules
+        self.modules = made_up_modules()
 
+        # Shortest time in milliseconds between flushes of new rows
+        self.flush_interval = 50
         self.new_data_timer = QTimer(self)
-        self.new_data_timer.timeout.connect(self.update_data)
-        self.new_data_timer.start(50)
+        self.new_data_timer.setSingleShot(True)
+        self.new_data_timer.timeout.connect(self.flush)
+        self.new_data_timer.start(self.flush_interval)
 
         self.global_time = 0
-
+        # Selections within one frame are synced to the other tabs once
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.setInterval(FRAME_MS)
+        self.sync_timer.timeout.connect(self.sync_global_time)
+        self.syncing = False
+
+    def filter_statistics(self: Self) -> FilterStatistics:
+        """
+        Statistics of a sample of the rows in memory. Chunks kept compressed, on
+        disk or in a capture file are left out, reading them would take long.
+        """
+        store = self.store
+        ranges = []
+        for i, chunk in enumerate(store.chunks):
+            if isinstance(chunk, TraceChunk):
+                first = (store.chunk_base + i) << CHUNK_BITS
+                ranges.append(range(max(first, store.first), min(first + CHUNK_ROWS, store.end)))
+        step = max(1, sum(len(r) for r in ranges) // FilterStatistics.sample_size)
+        sample = [row for r in ranges for row in r[::step]]
+        return FilterStatistics.from_rows(sample, store.getters())
+
+    def store_row(self: Self, index: QModelIndex | QPersistentModelIndex) -> int:
+        """The store row number of a model index."""
+        return self.store.first + index.row()
 
     def timestamp_at_index(self: Self, index: QModelIndex) -> int:
-        return self.logs[index.row()].timestamp
+        return self.store.timestamp(self.store_row(index))
+
+    def message_at(self: Self, row: int) -> TraceMessage:
+        """The message at store row number row."""
+        store = self.store
+        return TraceMessage(store.task_id(row), store.module(row), store.timestamp(row),
+                            store.message(row), store.source(row))
 
     def data(self: Self, index: QModelIndex | QPersistentModelIndex, role: int = -1) -> TraceMessage | str | None:
         if not index.isValid():
             return None
 
         if role == Qt.ItemDataRole.DisplayRole:
-            log = self.logs[index.row()]
-            return str(log)
+            row = self.store_row(index)
+            return f"[{self.store.timestamp(row)}] {self.store.message(row)}"
 
         if role == Qt.ItemDataRole.UserRole:
-            return self.logs[index.row()]
+            return self.message_at(self.store_row(index))
 
         return None
 
-    @Slot(list)
-    def more_data(self: Self, data: list[TraceMessage]) -> None:
-        for d in data:
-            self.in_buffer.put(d)
-
     @Slot()
+    def flush(self: Self) -> None:
+        """
+        Add the buffered messages, and schedule the next flush. The slower the
+        flush, including the views updating, the longer until the next one, in
+        whole frames.
+        """
+        start = time.perf_counter()
+        self.update_data()
+        took = (time.perf_counter() - start) * 1000
+        frames = math.ceil(min(took / FLUSH_SHARE, MAX_FLUSH_INTERVAL_MS) / FRAME_MS)
+        self.new_data_timer.start(max(self.flush_interval, frames * FRAME_MS))
+
     def update_data(self: Self) -> None:
-        new_data = []
-        while True:
-            try:
-                new_data.append(self.in_buffer.get_nowait())
-            except Empty:
-                break
-        new_rows = len(new_data)
+        batches = self.ingest.take()
+        new_rows = sum(len(b) for b in batches)
+        if new_rows > 0:
+            first = len(self.store)
+            self.beginInsertRows(QModelIndex(), first, first + new_rows - 1)
+            for batch in batches:
+                self.store.extend_batch(batch)
+            if self.store.message_index is not None:
+                self.store.message_index.update()
+            if self.store.cold is not None:
+                # Chunks made cold may have been copied for filter workers
+                self.filter_pool.shared.release(self.store.chunks)
+            self.filter_pool.seal(self.store)
+            self.endInsertRows()
+            self.evict()
+
+        if self.ingest.dropped != self.dropped:
+            self.dropped = self.ingest.dropped
+            self.messages_dropped.emit(self.dropped)
+
+    def buffering_time(self: Self) -> float:
+        return self.flush_interval / 1000
+
+    def set_buffering_time(self: Self, seconds: float) -> None:
+        """Set how often at most buffered messages are added to the model."""
+        self.flush_interval = max(1, round(seconds * 1000))
+
+    def set_message_index(self: Self, enabled: bool) -> None:
+        """Keep a trigram index of the message text, to speed up contains filters."""
+        if not enabled:
+            self.store.message_index = None
+            return
+        if self.store.message_index is not None:
+            return
+        start = time.perf_counter()
+        self.store.message_index = TrigramIndex(self.store)
+        self.store.message_index.update()
+        logger.info(f"Indexed {len(self.store)} messages in {time.perf_counter() - start:.2f} s,"
+                    f" {self.store.message_index.nbytes()} bytes")
+
+    def cold_history(self: Self) -> ColdHistory:
+        cold = self.store.cold
+        return ColdHistory.MEMORY if cold is None else cold.history
+
+    def cold_statistics(self: Self) -> CompressionStatistics | None:
+        cold = self.store.cold
+        return cold.statistics if isinstance(cold, CompressedChunks) else None
+
+    def set_cold_history(self: Self, history: ColdHistory, hot_rows: int) -> None:
+        """
+        Keep full chunks more than hot_rows behind the newest row compressed in
+        memory or in segment files on disk, instead of as they are.
+        """
+        self.hot_rows = hot_rows
+        store = self.store
+        if history == ColdHistory.MEMORY:
+            # Chunks already cold stay cold
+            store.cold = None
+            return
+        if self.cold_history() != history:
+            store.cold = SegmentFiles() if history == ColdHistory.DISK else CompressedChunks()
+        store.cold.hot = -(-hot_rows // CHUNK_ROWS)
+        store.cold.spill(store)
+        self.filter_pool.shared.release(store.chunks)
+
+    def set_filter_workers(self: Self, workers: int) -> None:
+        if workers != self.filter_pool.workers:
+            self.filter_pool.resize(workers)
+            self.filter_pool.seal(self.store)
+
+    def load_templates(self: Self, path: str) -> None:
+        """Load the format strings of deferred messages, see TraceTemplates."""
+        # Rendered text changes, so filters on message have to run again
+        self.beginResetModel()
+        self.store.templates.load(path)
+        self.filter_engine.reset()
+        self.generation += 1
+        self.endResetModel()
+
+    def save_capture(self: Self, path: str) -> None:
+        """Save the messages kept to a capture file, see TraceCapture."""
+        start = time.perf_counter()
+        save_capture(self.store, path)
+        logger.info(f"Saved {len(self.store)} messages in {time.perf_counter() - start:.2f} s")
+
+    def open_capture(self: Self, path: str) -> None:
+        """
+        Show the messages of a capture file instead, read from the file as they
+        are needed. The current source is stopped.
+        """
+        capture = CaptureFile(path)
+        self.stop_source()
+        self.ingest.take()
+        self.beginResetModel()
+        capture.restore(self.store)
+        self.filter_pool.shared.release([])
+        self.filter_engine.reset()
+        self.generation += 1
+        self.endResetModel()
+        logger.info(f"Opened {len(self.store)} messages from {path}")
+
+    def stop_source(self: Self) -> None:
+        """Stop reading messages, those read already are still added."""
+        self.thread.requestInterruption()
+        self.thread.wait()
+        if isinstance(self.ingest, IngestProcess):
+            process = self.ingest
+            process.close()
+            self.ingest = IngestBuffer(policy=process.policy)
+            self.dropped = 0
+            for batch in process.take():
+                self.ingest.put(batch)
+
+    def set_source(self: Self, source: TraceSource) -> None:
+        """Read messages from source instead of the current one."""
+        self.stop_source()
+        self.thread = TraceWorker(self, self.ingest, source)
+        self.thread.start()
 
-        self.beginInsertRows(QModelIndex(), len(self.logs), len(self.logs) + new_rows)
-        self.logs.extend(new_data)
-        self.endInsertRows()
+    def open_addresses(self: Self, addresses: list[str]) -> None:
+        """
+        Read messages from addresses, see open_sources, instead of the current
+        source, merged by timestamp. With ingest_process set they are read in an
+        ingest process. A single capture file is opened as by open_capture.
+        """
+        captures = [address for address in addresses if is_capture(address)]
+        if captures:
+            if len(addresses) > 1:
+                raise ValueError(f"{captures[0]} is a capture file, it can not be merged")
+            self.open_capture(captures[0])
+            return
+        if not self.ingest_process:
+            self.set_source(open_sources(addresses, self.merge_skew))
+            return
+        process = IngestProcess(addresses, self.merge_skew, self.ingest.policy,
+                                TraceWorker.batch_interval, TraceWorker.batch_rows)
+        self.stop_source()
+        # Rows read by the thread are added before those of the process
+        self.update_data()
+        self.ingest = process
+
+    def set_ingest_process(self: Self, enabled: bool) -> None:
+        """Read from sources opened from now on in an ingest process, see TraceRing."""
+        self.ingest_process = enabled
+
+    def set_overflow_policy(self: Self, policy: OverflowPolicy) -> None:
+        self.ingest.policy = policy
+
+    def evict(self: Self) -> None:
+        """Drop the oldest rows beyond history_length."""
+        if self.history_length is None or len(self.store) <= self.history_length:
+            return
+        count = len(self.store) - self.history_length
+        self.beginRemoveRows(QModelIndex(), 0, count - 1)
+        self.store.evict(count)
+        self.filter_pool.shared.release(self.store.chunks)
+        self.endRemoveRows()
+
+    def set_history_length(self: Self, history_length: int | None) -> None:
+        self.history_length = history_length
+        self.evict()
 
     def rowCount(  # noqa: N802
         self: Self, parent: QModelIndex | QPersistentModelIndex | None = None
     ) -> int:
         if parent is None:
             parent = QModelIndex()
-        return len(self.logs)
+        return len(self.store)
 
     def parent(self: Self, index: QModelIndex) -> QModelIndex:
         return QModelIndex()
@@ -137,12 +409,15 @@ class TraceModel(QAbstractListModel):
         return 1
 
     def index(self: Self, row: int, column: int, parent: QModelIndex | None = None) -> QModelIndex:
-        return self.createIndex(row, column, self.logs[row])
+        return self.createIndex(row, column)
 
     def clear(self: Self) -> None:
-        self.beginRemoveRows(QModelIndex(), 0, len(self.logs))
-        self.logs = []
-        self.endRemoveRows()
+        self.beginResetModel()
+        self.store.clear()
+        self.filter_pool.shared.release([])
+        self.filter_engine.reset()
+        self.generation += 1
+        self.endResetModel()
 
     def pause_stream(self: Self) -> None:
         pass
@@ -151,5 +426,17 @@ class TraceModel(QAbstractListModel):
         pass
 
     def set_active(self: Self, index: QModelIndex) -> None:
-        self.global_time = self.logs[index.row()].timestamp
-        self.global_time_updated.emit(self.global_time)
+        # Selections made by the views following a sync are not synced back
+        if self.syncing:
+            return
+        self.global_time = self.timestamp_at_index(index)
+        if not self.sync_timer.isActive():
+            self.sync_timer.start()
+
+    @Slot()
+    def sync_global_time(self: Self) -> None:
+        self.syncing = True
+        try:
+            self.global_time_updated.emit(self.global_time)
+        finally:
+            self.syncing = False
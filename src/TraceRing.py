@@ -0,0 +1,342 @@
+"""
+Ingest in a separate process, handing rows over through a ring buffer in shared
+memory.
+
+Reading, decoding frames and interning module and task names run in an ingest
+process, so they do not compete with the GUI thread for the GIL. The process
+writes each batch as one record into the ring, and the GUI thread copies the
+columns of the records written since its last flush into the store, see
+TraceStore.extend_batch. There is one writer and one reader:
+
+    write    u64  bytes written, only stored by the ingest process
+    read     u64  bytes read, stored by the GUI thread, and by the ingest
+                  process when it drops the oldest records
+    dropped  u64  rows dropped because the ring was full
+    ended    u32  set when the ingest process has stopped
+    policy   u32  OverflowPolicy, set by the GUI thread
+    closed   u32  set when the GUI thread stops the ingest process
+
+Each cursor is only advanced after the bytes it covers are written, and is read
+before the bytes are. Cursors and flags are only read and written holding a lock
+shared by both processes, and taking and releasing it are memory barriers, so the
+bytes of a record are seen before the cursor covering them on any CPU, not only
+on those keeping stores in order like x86. The lock is taken once per record.
+The GUI thread copies a record holding the lock, so the ingest process never
+drops a record while it is copied. OverflowPolicy.SPILL is not supported. A
+record is:
+
+    size     u32  bytes of the record, a multiple of 16
+    rows     u32  rows, PADDING for the unused end of the ring
+    names    u32  bytes of the names
+    arena    u32  bytes of the message arena
+    the timestamps, modules, tasks, sources, templates and offsets columns
+    the module, task and source names interned since the record before, as JSON
+    the message arena
+
+A record never wraps around the end of the ring. The process codes names with
+interners of its own, the GUI thread translates them once per batch.
+"""
+
+import json
+import os
+import struct
+import time
+import weakref
+from array import array
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.synchronize import Lock
+from typing import Self
+
+from loguru import logger
+
+from FilterPool import start_worker
+from TraceIngest import OverflowPolicy
+from TraceMerge import open_sources
+from TraceSegments import COLUMNS, chunk_bytes, column_sizes
+from TraceStore import Interner, TraceBatch
+
+WRITE = 0
+READ = 64
+DROPPED = 128
+ENDED = 136
+POLICY = 192
+CLOSED = 196
+DATA = 256
+# Holds a few of the largest batches, which get up to an eighth of the ring plus
+# what one read of the frame decoder adds
+MIN_CAPACITY = 8 << 20
+RECORD = struct.Struct("<IIII")
+PADDING = 0xFFFFFFFF
+CURSOR = struct.Struct("<Q")
+FLAG = struct.Struct("<I")
+POLICIES = list(OverflowPolicy)
+SPILL_UNSUPPORTED = "the ingest process can not spill to disk, it drops or blocks"
+
+# The ingest process is forked from a server process without the threads of the GUI
+context = get_context("forkserver")
+
+
+def align(size: int) -> int:
+    return (size + 15) & ~15
+
+
+class Ring:
+    def __init__(self: Self, block: SharedMemory, lock: Lock) -> None:
+        self.block = block
+        self.lock = lock
+        self.buffer = block.buf
+        self.capacity = len(block.buf) - DATA
+
+    def load(self: Self, offset: int) -> int:
+        with self.lock:
+            return CURSOR.unpack_from(self.buffer, offset)[0]
+
+    def store(self: Self, offset: int, value: int) -> None:
+        with self.lock:
+            CURSOR.pack_into(self.buffer, offset, value)
+
+    def flag(self: Self, offset: int) -> int:
+        with self.lock:
+            return FLAG.unpack_from(self.buffer, offset)[0]
+
+    def set_flag(self: Self, offset: int, value: int) -> None:
+        with self.lock:
+            FLAG.pack_into(self.buffer, offset, value)
+
+
+class RingWriter(Ring):
+    """The ingest process end of a ring."""
+    def __init__(self: Self, name: str, lock: Lock) -> None:
+        super().__init__(SharedMemory(name), lock)
+        self.write = self.load(WRITE)
+        self.dropped = 0
+        # Names already sent, by the count of each interner
+        self.module_names = Interner()
+        self.task_names = Interner()
+        self.source_names = Interner()
+        self.sent = (0, 0, 0)
+
+    def batch(self: Self) -> TraceBatch:
+        """A new batch, coding names with the interners of the ring."""
+        batch = TraceBatch()
+        batch.module_names = self.module_names
+        batch.task_names = self.task_names
+        batch.source_names = self.source_names
+        return batch
+
+    def closed(self: Self) -> bool:
+        return self.flag(CLOSED) != 0
+
+    def names(self: Self) -> tuple[tuple[int, ...], bytes]:
+        """The count of each interner, and the names not sent yet as JSON."""
+        interners = (self.module_names, self.task_names, self.source_names)
+        counts = tuple(len(interner) for interner in interners)
+        if self.sent == counts:
+            return counts, b""
+        return counts, json.dumps([interner.values[sent:] for interner, sent
+                                   in zip(interners, self.sent, strict=True)]).encode()
+
+    def put(self: Self, batch: TraceBatch) -> None:
+        """
+        Write batch as a record. When the ring is full, wait for the GUI thread,
+        or drop the oldest records with OverflowPolicy.DROP_OLDEST.
+        """
+        parts = chunk_bytes(batch)
+        while True:
+            (counts, names) = self.names()
+            size = align(RECORD.size + sum(column_sizes(len(batch))) + len(names)
+                         + len(batch.arena))
+            if size > self.capacity // 2:
+                raise ValueError(f"a batch of {size} bytes does not fit the ring")
+            start = self.write % self.capacity
+            skip = self.capacity - start if self.capacity - start < size else 0
+            if self.capacity - (self.write - self.load(READ)) >= skip + size:
+                break
+            if self.closed():
+                return
+            if POLICIES[self.flag(POLICY)] == OverflowPolicy.DROP_OLDEST:
+                # Names may have to be sent again, so the size is worked out again
+                self.drop(skip + size)
+                continue
+            time.sleep(0.001)
+
+        if skip:
+            RECORD.pack_into(self.buffer, DATA + start, skip, PADDING, 0, 0)
+            start = 0
+        RECORD.pack_into(self.buffer, DATA + start, size, len(batch), len(names),
+                         len(batch.arena))
+        position = DATA + start + RECORD.size
+        for part in [*parts[:-1], names, parts[-1]]:
+            self.buffer[position:position + len(part)] = part
+            position += len(part)
+        self.sent = counts
+        self.write += skip + size
+        self.store(WRITE, self.write)
+
+    def drop(self: Self, size: int) -> None:
+        """Drop the oldest records the GUI thread has not taken until size bytes are free."""
+        with self.lock:
+            read = CURSOR.unpack_from(self.buffer, READ)[0]
+            end = read
+            while self.capacity - (self.write - end) < size:
+                (length, _, names, _) = RECORD.unpack_from(self.buffer, DATA + end % self.capacity)
+                if names:
+                    # The records after it may use its names, so they go too, and
+                    # every name is sent again with the next record
+                    end = self.write
+                    self.sent = (0, 0, 0)
+                    break
+                end += length
+            while read < end:
+                (length, rows, _, _) = RECORD.unpack_from(self.buffer, DATA + read % self.capacity)
+                if rows != PADDING:
+                    self.dropped += rows
+                read += length
+            CURSOR.pack_into(self.buffer, READ, read)
+            CURSOR.pack_into(self.buffer, DROPPED, self.dropped)
+
+    def close(self: Self) -> None:
+        self.set_flag(ENDED, 1)
+        self.buffer = None
+        self.block.close()
+
+
+def run_ingest(addresses: list[str], skew: float, name: str, lock: Lock,
+               connection: Connection, owner: int, batch_interval: float,
+               batch_rows: int) -> None:
+    """The ingest process, reading from addresses into the ring called name."""
+    try:
+        source = open_sources(addresses, skew)
+    except (OSError, ValueError) as e:
+        connection.send(str(e))
+        return
+    connection.send(None)
+    connection.close()
+    start_worker(owner)
+    writer = RingWriter(name, lock)
+    batch = writer.batch()
+    handed_over = time.monotonic()
+    running = True
+    try:
+        while running and not writer.closed():
+            try:
+                running = source.read(batch, batch_interval)
+            except OSError as e:
+                logger.error(f"Trace source failed: {e}")
+                running = False
+            # A read adds at most the receive buffer of the decoder to the arena
+            if len(batch) > 0 and (not running or len(batch) >= batch_rows
+                                   or len(batch.arena) >= writer.capacity // 8
+                                   or time.monotonic() - handed_over >= batch_interval):
+                writer.put(batch)
+                batch = writer.batch()
+                handed_over = time.monotonic()
+    finally:
+        source.close()
+        writer.close()
+
+
+class IngestProcess(Ring):
+    """
+    Reads messages from addresses, see open_sources, in an ingest process. Takes
+    the place of an IngestBuffer and a TraceWorker.
+    """
+    def __init__(self: Self, addresses: list[str], skew: float, policy: OverflowPolicy,
+                 batch_interval: float, batch_rows: int, capacity: int = 64 << 20) -> None:
+        if capacity < MIN_CAPACITY:
+            raise ValueError(f"a ring of {capacity} bytes is too small")
+        if policy == OverflowPolicy.SPILL:
+            raise ValueError(SPILL_UNSUPPORTED)
+        block = SharedMemory(create=True, size=DATA + align(capacity))
+        super().__init__(block, context.Lock())
+        weakref.finalize(self, IngestProcess.free, self.block)
+        self.policy = policy
+        self.module_names = Interner()
+        self.task_names = Interner()
+        self.source_names = Interner()
+        (connection, child) = context.Pipe()
+        self.process = context.Process(
+            target=run_ingest, daemon=True,
+            args=(addresses, skew, self.block.name, self.lock, child, os.getpid(),
+                  batch_interval, batch_rows))
+        self.process.start()
+        child.close()
+        error = connection.recv() if connection.poll(10) else "the ingest process did not start"
+        connection.close()
+        if error is not None:
+            self.close()
+            raise OSError(error)
+
+    @property
+    def policy(self: Self) -> OverflowPolicy:
+        return POLICIES[self.flag(POLICY)]
+
+    @policy.setter
+    def policy(self: Self, policy: OverflowPolicy) -> None:
+        if policy == OverflowPolicy.SPILL:
+            raise ValueError(SPILL_UNSUPPORTED)
+        self.set_flag(POLICY, POLICIES.index(policy))
+
+    @property
+    def dropped(self: Self) -> int:
+        return self.load(DROPPED)
+
+    def ended(self: Self) -> bool:
+        """True once the ingest process has stopped and every row has been taken."""
+        return self.flag(ENDED) != 0 and self.load(READ) == self.load(WRITE)
+
+    def take(self: Self) -> list[TraceBatch]:
+        """Take every record written so far, as batches."""
+        batches = []
+        write = self.load(WRITE)
+        while True:
+            # Holding the lock, so the ingest process does not drop the record
+            with self.lock:
+                read = CURSOR.unpack_from(self.buffer, READ)[0]
+                if read >= write:
+                    break
+                start = read % self.capacity
+                (size, rows, names, arena) = RECORD.unpack_from(self.buffer, DATA + start)
+                if rows != PADDING:
+                    batches.append(self.batch(DATA + start + RECORD.size, rows, names, arena))
+                CURSOR.pack_into(self.buffer, READ, read + size)
+        return batches
+
+    def batch(self: Self, position: int, rows: int, names: int, arena: int) -> TraceBatch:
+        """A copy of a record, the ring space is reused once it is read."""
+        batch = TraceBatch()
+        batch.offsets = array("I")
+        for (column, _, _), size in zip(COLUMNS, column_sizes(rows), strict=True):
+            getattr(batch, column).frombytes(self.buffer[position:position + size])
+            position += size
+        if names:
+            interners = (self.module_names, self.task_names, self.source_names)
+            values = json.loads(bytes(self.buffer[position:position + names]))
+            for interner, new in zip(interners, values, strict=True):
+                for value in new:
+                    interner.code(value)
+            position += names
+        batch.arena = bytearray(self.buffer[position:position + arena])
+        batch.module_names = self.module_names
+        batch.task_names = self.task_names
+        batch.source_names = self.source_names
+        return batch
+
+    def close(self: Self) -> None:
+        """Stop the ingest process, the rows it wrote can still be taken."""
+        self.set_flag(CLOSED, 1)
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+            # It may have been killed holding the lock
+            self.lock = context.Lock()
+
+    @staticmethod
+    def free(block: SharedMemory) -> None:
+        # Stops the ingest process if it was not
+        FLAG.pack_into(block.buf, CLOSED, 1)
+        block.close()
+        block.unlink()
@@ -0,0 +1,247 @@
+"""
+Full chunks of a TraceStore kept out of the way, for captures larger than
+memory.
+
+Chunks that are full and older than the `hot` most recent ones are cold. They
+are moved by a ColdChunks, which leaves a LazyChunk in their place in the store:
+compressed in memory, see TraceCompression, or in segment files on disk.
+
+SegmentFiles writes every cold chunk to a segment file. A segment holds the
+columns of its chunk in the layout of COLUMNS followed by the message arena, so
+the offsets column is the index of where each row's message starts.
+
+A SegmentChunk maps its file on first use, and a BlockCache keeps the most
+recently used segments mapped, so only the rows the views and filters touch take
+memory.
+"""
+
+import mmap
+import os
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import suppress
+from enum import Enum
+from functools import partial
+from tempfile import TemporaryDirectory
+from typing import Callable, Hashable, Self
+
+import numpy as np
+
+from TraceStore import CHUNK_ROWS, ChunkSummary, TraceChunk, TraceStore
+
+# The columns of a full chunk in the order they are laid out, with the number of
+# values each one holds beyond CHUNK_ROWS
+COLUMNS = (("timestamps", "q", 0), ("modules", "H", 0), ("tasks", "H", 0),
+           ("sources", "H", 0), ("templates", "H", 0), ("offsets", "I", 1))
+
+
+def column_sizes(rows: int = CHUNK_ROWS) -> list[int]:
+    return [(rows + extra) * np.dtype(code).itemsize for _, code, extra in COLUMNS]
+
+
+def chunk_bytes(chunk: TraceChunk) -> list[memoryview]:
+    """The bytes of a chunk, in the order they are laid out."""
+    columns = [memoryview(getattr(chunk, column)).cast("B") for column, _, _ in COLUMNS]
+    return [*columns, memoryview(chunk.arena)]
+
+
+class MappedChunk:
+    """A TraceChunk laid out in a buffer, read only."""
+    summary: ChunkSummary | None = None
+    ordered = True
+
+    def __init__(self: Self, buffer: memoryview, arena: int, rows: int = CHUNK_ROWS) -> None:
+        self.rows = rows
+        self.views: list[memoryview] = []
+        start = 0
+        for (column, code, _), size in zip(COLUMNS, column_sizes(rows), strict=True):
+            view = buffer[start:start + size].cast(code)
+            setattr(self, column, view)
+            self.views.append(view)
+            start += size
+        self.arena = buffer[start:start + arena]
+        self.views.append(self.arena)
+
+    def __len__(self: Self) -> int:
+        return self.rows
+
+    def message(self: Self, i: int) -> str:
+        return self.message_bytes(i).decode()
+
+    def message_bytes(self: Self, i: int) -> bytes:
+        return bytes(self.arena[self.offsets[i]:self.offsets[i + 1]])
+
+    def release(self: Self) -> None:
+        for view in self.views:
+            view.release()
+
+
+def map_segment(path: str) -> MappedChunk:
+    """The chunk in a segment file, unmapped once nothing uses it."""
+    with open(path, "rb") as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return MappedChunk(memoryview(mapping), len(mapping) - sum(column_sizes()))
+
+
+class BlockCache:
+    """
+    Chunks read from files or decompressed, by key. At most `size` are kept, the
+    least recently used ones are dropped once nothing reads from them anymore.
+    Filter jobs read chunks from their own threads.
+    """
+    def __init__(self: Self, size: int) -> None:
+        self.size = size
+        self.chunks: OrderedDict[Hashable, MappedChunk] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self: Self, key: Hashable, load: Callable[[], MappedChunk]) -> MappedChunk:
+        """The chunk kept for key, loaded with load if there is none."""
+        with self.lock:
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                self.hits += 1
+                self.chunks.move_to_end(key)
+                return chunk
+        chunk = load()
+        with self.lock:
+            self.misses += 1
+            self.chunks[key] = chunk
+            while len(self.chunks) > self.size:
+                self.chunks.popitem(last=False)
+        return chunk
+
+    def __len__(self: Self) -> int:
+        return len(self.chunks)
+
+    def discard(self: Self, key: Hashable) -> None:
+        with self.lock:
+            self.chunks.pop(key, None)
+
+
+class LazyChunk(ABC):
+    """A full TraceChunk read from a file while it is used."""
+    summary: ChunkSummary | None = None
+    ordered = True
+
+    def __len__(self: Self) -> int:
+        return CHUNK_ROWS
+
+    @abstractmethod
+    def mapped(self: Self) -> MappedChunk:
+        """The columns of the chunk, read from where it is kept."""
+
+    @property
+    def timestamps(self: Self) -> memoryview:
+        return self.mapped().timestamps
+
+    @property
+    def modules(self: Self) -> memoryview:
+        return self.mapped().modules
+
+    @property
+    def tasks(self: Self) -> memoryview:
+        return self.mapped().tasks
+
+    @property
+    def sources(self: Self) -> memoryview:
+        return self.mapped().sources
+
+    @property
+    def templates(self: Self) -> memoryview:
+        return self.mapped().templates
+
+    @property
+    def offsets(self: Self) -> memoryview:
+        return self.mapped().offsets
+
+    @property
+    def arena(self: Self) -> memoryview:
+        return self.mapped().arena
+
+    def message(self: Self, i: int) -> str:
+        return self.mapped().message(i)
+
+    def message_bytes(self: Self, i: int) -> bytes:
+        return self.mapped().message_bytes(i)
+
+    def nbytes(self: Self) -> int:
+        # Only the parts of the file that are read are in memory
+        return 0
+
+
+class SegmentChunk(LazyChunk):
+    """A full TraceChunk in a segment file, mapped while it is used."""
+    def __init__(self: Self, files: "SegmentFiles", path: str) -> None:
+        self.files = files
+        self.path = path
+        weakref.finalize(self, files.remove, path)
+
+    def mapped(self: Self) -> MappedChunk:
+        return self.files.map(self)
+
+
+class ColdHistory(Enum):
+    MEMORY = "Kept in memory"
+    COMPRESSED = "Compressed in memory"
+    DISK = "On disk"
+
+
+class ColdChunks(ABC):
+    """Where the full chunks of a store beyond the `hot` most recent ones go."""
+    history = ColdHistory.MEMORY
+
+    def __init__(self: Self, hot: int) -> None:
+        self.hot = hot
+
+    def spill(self: Self, store: TraceStore) -> None:
+        """Move the full chunks of store beyond the hot ones."""
+        full = len(store.chunks)
+        if full > 0 and len(store.chunks[-1]) < CHUNK_ROWS:
+            full -= 1
+        for i in range(full - self.hot - 1, -1, -1):
+            chunk = store.chunks[i]
+            # Chunks before are already cold, or read from a capture file
+            if not isinstance(chunk, TraceChunk):
+                break
+            cold = self.write(chunk)
+            cold.ordered = chunk.ordered
+            store.chunks[i] = cold
+
+    @abstractmethod
+    def write(self: Self, chunk: TraceChunk) -> LazyChunk:
+        """Move the rows of chunk to where cold chunks are kept."""
+
+
+class SegmentFiles(ColdChunks):
+    """The segment files of one store, in a temporary directory under directory."""
+    history = ColdHistory.DISK
+
+    def __init__(self: Self, directory: str | None = None, hot: int = 8,
+                 mapped: int = 16) -> None:
+        super().__init__(hot)
+        self.directory = TemporaryDirectory(prefix="trace-segments-", dir=directory)
+        self.count = 0
+        # Mapped segments by path
+        self.maps = BlockCache(mapped)
+
+    def write(self: Self, chunk: TraceChunk) -> SegmentChunk:
+        path = os.path.join(self.directory.name, f"{self.count}.seg")
+        self.count += 1
+        with open(path, "wb") as file:
+            for data in chunk_bytes(chunk):
+                file.write(data)
+        return SegmentChunk(self, path)
+
+    def map(self: Self, segment: SegmentChunk) -> MappedChunk:
+        return self.maps.get(segment.path, partial(map_segment, segment.path))
+
+    def remove(self: Self, path: str) -> None:
+        """Remove the segment file of a chunk evicted from the store."""
+        self.maps.discard(path)
+        # Left to the directory cleanup if still mapped, on Windows
+        with suppress(OSError):
+            os.remove(path)
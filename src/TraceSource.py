@@ -0,0 +1,192 @@
+"""
+Sources of trace messages for TraceWorker. Several sources are merged into one
+by TraceMerge.
+
+A source fills TraceBatch objects with whatever messages are available. Devices
+talk a compact binary framing, all little endian:
+
+    magic      u16  0x5254, "TR"
+    length     u16  payload length in bytes
+    timestamp  u64
+    module     u16  module id
+    task       u16  task id
+    template   u16  template id, 0xFFFF for a text message
+    payload    utf-8 message text, or the packed arguments of the template
+
+StreamSource decodes frames from any byte stream: a pty or serial device, a TCP
+socket or a file.
+"""
+
+import os
+import select
+import socket
+import struct
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Callable, Self
+
+from TraceStore import DEFAULT_SOURCE, TEXT, TraceBatch
+
+HEADER = struct.Struct("<HHQHHH")
+MAGIC = 0x5254
+MAGIC_BYTES = MAGIC.to_bytes(2, "little")
+
+
+def encode_frame(timestamp: int, module: int, task: int, payload: bytes,
+                 template: int = TEXT) -> bytes:
+    return HEADER.pack(MAGIC, len(payload), timestamp, module, task, template) + payload
+
+
+class TraceSource(ABC):
+    """Where TraceWorker reads its messages from."""
+    @abstractmethod
+    def read(self: Self, batch: TraceBatch, timeout: float) -> bool:
+        """
+        Add the messages available within timeout seconds to batch.
+
+        Returns False once the source has ended.
+        """
+
+    def close(self: Self) -> None:  # noqa: B027, sources holding nothing open need not close
+        pass
+
+
+class FrameDecoder:
+    """
+    Splits a byte stream into frames.
+
+    Bytes are received into one reusable bytearray, and frames are parsed from
+    memoryview slices of it. The only copy of a payload is the one into the batch.
+    """
+    def __init__(self: Self, buffer_size: int = 1 << 20) -> None:
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        # Bytes skipped to find the start of a frame again
+        self.skipped = 0
+        self.module_names: dict[int, str] = {}
+        self.task_names: dict[int, str] = {}
+
+    def receive_view(self: Self) -> memoryview:
+        """The free part of the buffer, to receive into."""
+        if self.start > 0:
+            # Move the incomplete frame at the end to the front
+            remaining = self.end - self.start
+            self.buffer[:remaining] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = remaining
+        if self.end == len(self.buffer):
+            # A frame is at most 64 KiB, so this only happens for tiny buffers
+            self.view.release()
+            self.buffer.extend(bytes(len(self.buffer)))
+            self.view = memoryview(self.buffer)
+        return self.view[self.end:]
+
+    def received(self: Self, count: int) -> None:
+        self.end += count
+
+    def module_name(self: Self, module: int) -> str:
+        if module not in self.module_names:
+            self.module_names[module] = str(module)
+        return self.module_names[module]
+
+    def task_name(self: Self, task: int) -> str:
+        if task not in self.task_names:
+            self.task_names[task] = str(task)
+        return self.task_names[task]
+
+    def decode(self: Self, batch: TraceBatch) -> int:
+        """Decode every complete frame received so far into batch."""
+        buffer = self.buffer
+        view = self.view
+        unpack = HEADER.unpack_from
+        header_size = HEADER.size
+        modules: dict[int, int] = {}
+        tasks: dict[int, int] = {}
+        timestamps = batch.timestamps
+        module_codes = batch.modules
+        task_codes = batch.tasks
+        source_codes = batch.sources
+        source = batch.source_names.code(DEFAULT_SOURCE)
+        templates = batch.templates
+        offsets = batch.offsets
+        arena = batch.arena
+        start = self.start
+        end = self.end
+        decoded = 0
+        while end - start >= header_size:
+            (magic, length, timestamp, module, task, template) = unpack(buffer, start)
+            if magic != MAGIC:
+                found = buffer.find(MAGIC_BYTES, start + 1, end)
+                next_start = end - 1 if found == -1 else found
+                self.skipped += next_start - start
+                start = next_start
+                continue
+            payload_end = start + header_size + length
+            if payload_end > end:
+                break
+
+            module_code = modules.get(module)
+            if module_code is None:
+                module_code = modules[module] = batch.module_names.code(self.module_name(module))
+            task_code = tasks.get(task)
+            if task_code is None:
+                task_code = tasks[task] = batch.task_names.code(self.task_name(task))
+            timestamps.append(timestamp)
+            module_codes.append(module_code)
+            task_codes.append(task_code)
+            source_codes.append(source)
+            templates.append(template)
+            arena += view[start + header_size:payload_end]
+            offsets.append(len(arena))
+            start = payload_end
+            decoded += 1
+        self.start = start
+        return decoded
+
+
+class StreamSource(TraceSource):
+    """Frames read from a file descriptor, a socket or any binary file object."""
+    def __init__(self: Self, stream: socket.socket | BinaryIO,
+                 readinto: Callable[[memoryview], int | None]) -> None:
+        self.stream = stream
+        self.readinto = readinto
+        self.decoder = FrameDecoder()
+
+    def read(self: Self, batch: TraceBatch, timeout: float) -> bool:
+        try:
+            ready, _, _ = select.select([self.stream], [], [], timeout)
+        except (ValueError, OSError):
+            # Not selectable, e.g. an in memory file, just read
+            ready = [self.stream]
+        if not ready:
+            return True
+        count = self.readinto(self.decoder.receive_view())
+        if not count:
+            # End of stream
+            return False
+        self.decoder.received(count)
+        self.decoder.decode(batch)
+        return True
+
+    def close(self: Self) -> None:
+        self.stream.close()
+
+
+def open_source(address: str) -> StreamSource:
+    """
+    Open a source from an address:
+    - tcp://host:port connects to a TCP socket
+    - anything else is opened as a file, e.g. a recorded stream, a pty or a serial
+      device
+    """
+    if address.startswith("tcp://"):
+        host, port = address.removeprefix("tcp://").rsplit(":", 1)
+        connection = socket.create_connection((host, int(port)))
+        return StreamSource(connection, connection.recv_into)
+
+    stream = open(address, "rb", buffering=0)  # noqa: SIM115
+    if os.isatty(stream.fileno()):
+        import tty
+        tty.setraw(stream.fileno())
+    return StreamSource(stream, stream.readinto)
@@ -0,0 +1,363 @@
+"""
+Column oriented storage for trace messages.
+
+Rows are kept in fixed size chunks, each holding one array per field:
+- timestamps as 64 bit integers
+- module, task_id and source as 16 bit codes into an Interner, source being the
+  device a row was read from when several are merged, see TraceMerge
+- message text as utf-8 in one bytearray, with an offset array marking where each
+  message starts
+- the template id of deferred messages, whose packed arguments are kept in place
+  of the text and only rendered when the message is asked for
+
+Nothing is stored per row as a Python object, rows are only materialized as
+TraceMessage when asked for. Older full chunks can be kept compressed or on disk,
+see TraceSegments, and a store can be saved to and read back from a capture file,
+see TraceCapture.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from copy import copy
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Self
+
+import numpy as np
+
+from TraceTemplates import TemplateDictionary
+
+if TYPE_CHECKING:
+    from TraceIndex import TrigramIndex
+    from TraceSegments import ColdChunks
+
+CHUNK_BITS = 16
+CHUNK_ROWS = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_ROWS - 1
+# Template id of messages stored as text
+TEXT = 0xFFFF
+# Source id of rows read from a single source
+DEFAULT_SOURCE = "0"
+# Slices of at most this many rows are copied row by row, numpy costs more than it
+# saves on them
+SHORT_SLICE = 16
+
+
+def column_bytes(values: array | memoryview, start: int, stop: int) -> memoryview:
+    """The bytes of values [start, stop) of a column."""
+    view = memoryview(values)
+    return view.cast("B")[start * view.itemsize:stop * view.itemsize]
+
+
+def translate(codes: list[int], values: memoryview) -> bytes | memoryview:
+    """16 bit codes values translated through codes."""
+    if all(code == i for i, code in enumerate(codes)):
+        return values
+    return np.array(codes, dtype=np.uint16)[np.frombuffer(values, dtype=np.uint16)].tobytes()
+
+
+class Interner:
+    """Maps values to small integer codes and back."""
+    def __init__(self: Self) -> None:
+        self.values: list[str] = []
+        self.codes: dict[str, int] = {}
+
+    def code(self: Self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def __len__(self: Self) -> int:
+        return len(self.values)
+
+    def items(self: Self) -> list[tuple[str, int]]:
+        """The values and their codes, safe to iterate while values are added."""
+        return list(self.codes.items())
+
+
+@dataclass(frozen=True)
+class ChunkSummary:
+    """What the rows of a chunk hold, for filters to skip chunks none of which match."""
+    min_timestamp: int
+    max_timestamp: int
+    # Codes of the modules, tasks and sources of the rows
+    modules: frozenset[int]
+    tasks: frozenset[int]
+    sources: frozenset[int]
+
+
+class TraceChunk:
+    """Up to CHUNK_ROWS rows, stored column by column."""
+    # Only known for chunks read from a capture file, see TraceCapture
+    summary: ChunkSummary | None = None
+    # False once a row older than a row appended before it was appended, see
+    # TraceStore.ordered
+    ordered = True
+
+    def __init__(self: Self) -> None:
+        self.timestamps = array("q")
+        self.modules = array("H")
+        self.tasks = array("H")
+        self.sources = array("H")
+        self.templates = array("H")
+        self.offsets = array("I", [0])
+        self.arena = bytearray()
+
+    def __len__(self: Self) -> int:
+        return len(self.timestamps)
+
+    def message(self: Self, i: int) -> str:
+        return self.arena[self.offsets[i]:self.offsets[i + 1]].decode()
+
+    def message_bytes(self: Self, i: int) -> bytes:
+        return self.arena[self.offsets[i]:self.offsets[i + 1]]
+
+    def nbytes(self: Self) -> int:
+        columns = (self.timestamps, self.modules, self.tasks, self.sources, self.templates,
+                   self.offsets)
+        return sum(c.itemsize * len(c) for c in columns) + len(self.arena)
+
+    def extend_from(self: Self, chunk: "TraceChunk", start: int, stop: int, modules: list[int],
+                    tasks: list[int], sources: list[int]) -> None:
+        """
+        Append rows [start, stop) of chunk, copying whole column slices rather than
+        row by row. Its codes are translated through modules, tasks and sources. The
+        columns of chunk can be any buffers, e.g. views of shared memory.
+        """
+        shift = len(self.arena) - chunk.offsets[start]
+        if stop - start <= SHORT_SLICE:
+            for i in range(start, stop):
+                self.timestamps.append(chunk.timestamps[i])
+                self.modules.append(modules[chunk.modules[i]])
+                self.tasks.append(tasks[chunk.tasks[i]])
+                self.sources.append(sources[chunk.sources[i]])
+                self.templates.append(chunk.templates[i])
+                self.offsets.append(chunk.offsets[i + 1] + shift)
+            self.arena += chunk.arena[chunk.offsets[start]:chunk.offsets[stop]]
+            return
+        self.timestamps.frombytes(column_bytes(chunk.timestamps, start, stop))
+        self.modules.frombytes(translate(modules, column_bytes(chunk.modules, start, stop)))
+        self.tasks.frombytes(translate(tasks, column_bytes(chunk.tasks, start, stop)))
+        self.sources.frombytes(translate(sources, column_bytes(chunk.sources, start, stop)))
+        self.templates.frombytes(column_bytes(chunk.templates, start, stop))
+        self.arena += memoryview(chunk.arena)[chunk.offsets[start]:chunk.offsets[stop]]
+        offsets = np.frombuffer(column_bytes(chunk.offsets, start + 1, stop + 1), dtype=np.uint32)
+        self.offsets.frombytes((offsets + np.uint32(shift & 0xFFFFFFFF)).tobytes())
+
+
+class TraceBatch(TraceChunk):
+    """
+    Messages on their way into a TraceStore, built by a reader thread.
+
+    Module, task and source codes are local to the batch, the store translates them
+    to its own codes once per batch.
+    """
+    def __init__(self: Self) -> None:
+        super().__init__()
+        self.module_names = Interner()
+        self.task_names = Interner()
+        self.source_names = Interner()
+
+    def append(self: Self, task_id: str, module: str, timestamp: int, message: str,
+               source: str = DEFAULT_SOURCE) -> None:
+        self.timestamps.append(timestamp)
+        self.modules.append(self.module_names.code(module))
+        self.tasks.append(self.task_names.code(task_id))
+        self.sources.append(self.source_names.code(source))
+        self.templates.append(TEXT)
+        self.arena += message.encode()
+        self.offsets.append(len(self.arena))
+
+    def append_template(self: Self, task_id: str, module: str, timestamp: int, template: int,
+                        args: bytes, source: str = DEFAULT_SOURCE) -> None:
+        self.timestamps.append(timestamp)
+        self.modules.append(self.module_names.code(module))
+        self.tasks.append(self.task_names.code(task_id))
+        self.sources.append(self.source_names.code(source))
+        self.templates.append(template)
+        self.arena += args
+        self.offsets.append(len(self.arena))
+
+
+class TraceStore:
+    """
+    Rows are numbered from the first row ever appended, and keep their number when
+    older rows are evicted. The rows kept are [first, end).
+    """
+    def __init__(self: Self) -> None:
+        self.templates = TemplateDictionary()
+        # Optional index of the message text, kept up to date by the owner
+        self.message_index: TrigramIndex | None = None
+        # Optional place older full chunks are moved to
+        self.cold: ColdChunks | None = None
+        self.clear()
+
+    def clear(self: Self) -> None:
+        self.chunks: list[TraceChunk] = []
+        self.modules = Interner()
+        self.tasks = Interner()
+        self.sources = Interner()
+        self.first = 0
+        self.end = 0
+        # Newest timestamp appended, rows older than it make their chunk unordered
+        self.newest: int | None = None
+        # Chunk number of chunks[0]
+        self.chunk_base = 0
+        if self.message_index is not None:
+            self.message_index.clear()
+
+    def __len__(self: Self) -> int:
+        return self.end - self.first
+
+    def snapshot(self: Self) -> Self:
+        """
+        The rows kept now, for reading from another thread while this store keeps
+        growing and evicting. Chunks and interners are shared, not copied.
+        """
+        snapshot = copy(self)
+        snapshot.chunks = list(self.chunks)
+        return snapshot
+
+    def new_chunk(self: Self) -> None:
+        self.chunks.append(TraceChunk())
+        if self.cold is not None:
+            self.cold.spill(self)
+
+    def append(self: Self, task_id: str, module: str, timestamp: int, message: str,
+               source: str = DEFAULT_SOURCE) -> None:
+        if self.end & CHUNK_MASK == 0:
+            self.new_chunk()
+        chunk = self.chunks[-1]
+        if self.newest is None or timestamp >= self.newest:
+            self.newest = timestamp
+        else:
+            chunk.ordered = False
+        chunk.timestamps.append(timestamp)
+        chunk.modules.append(self.modules.code(module))
+        chunk.tasks.append(self.tasks.code(task_id))
+        chunk.sources.append(self.sources.code(source))
+        chunk.templates.append(TEXT)
+        chunk.arena += message.encode()
+        chunk.offsets.append(len(chunk.arena))
+        self.end += 1
+
+    def extend(self: Self, messages: Iterable[Any]) -> None:
+        for m in messages:
+            self.append(m.task_id, m.module, m.timestamp, m.message, m.source)
+
+    def extend_batch(self: Self, batch: TraceBatch) -> None:
+        """Append a batch, see TraceChunk.extend_from."""
+        modules = [self.modules.code(m) for m in batch.module_names.values]
+        tasks = [self.tasks.code(t) for t in batch.task_names.values]
+        sources = [self.sources.code(s) for s in batch.source_names.values]
+        done = 0
+        while done < len(batch):
+            if self.end & CHUNK_MASK == 0:
+                self.new_chunk()
+            chunk = self.chunks[-1]
+            count = min(len(batch) - done, CHUNK_ROWS - len(chunk))
+            stop = done + count
+            self.check_order(chunk, batch, done, stop)
+            chunk.extend_from(batch, done, stop, modules, tasks, sources)
+            self.end += count
+            done = stop
+
+    def check_order(self: Self, chunk: TraceChunk, batch: TraceBatch, start: int,
+                    stop: int) -> None:
+        """Mark chunk unordered if rows [start, stop) of batch are out of order."""
+        timestamps = np.frombuffer(column_bytes(batch.timestamps, start, stop), dtype=np.int64)
+        if self.newest is not None and timestamps[0] < self.newest:
+            chunk.ordered = False
+        elif len(timestamps) > 1 and (timestamps[1:] < timestamps[:-1]).any():
+            chunk.ordered = False
+        newest = int(timestamps.max())
+        if self.newest is None or newest > self.newest:
+            self.newest = newest
+
+    def evict(self: Self, count: int) -> None:
+        """
+        Forget the oldest count rows.
+
+        Only whole chunks are freed, so eviction costs the same no matter how many
+        rows are kept.
+        """
+        self.first = min(self.first + count, self.end)
+        drop = (self.first >> CHUNK_BITS) - self.chunk_base
+        if drop > 0:
+            del self.chunks[:drop]
+            self.chunk_base += drop
+
+    def chunk(self: Self, row: int) -> TraceChunk:
+        return self.chunks[(row >> CHUNK_BITS) - self.chunk_base]
+
+    def timestamp(self: Self, row: int) -> int:
+        return self.chunk(row).timestamps[row & CHUNK_MASK]
+
+    def find_timestamp(self: Self, timestamp: int, after: bool = False) -> int:
+        """
+        The first row with a timestamp at or, if after, past timestamp, the end if
+        there is none. Bisects if the rows are ordered, otherwise scans them.
+        """
+        if not self.ordered():
+            return self.scan_timestamp(timestamp, after)
+        bisect = bisect_right if after else bisect_left
+        return self.first + bisect(range(self.first, self.end), timestamp, key=self.timestamp)
+
+    def scan_timestamp(self: Self, timestamp: int, after: bool) -> int:
+        for i, chunk in enumerate(self.chunks):
+            base = (self.chunk_base + i) << CHUNK_BITS
+            start = max(self.first - base, 0)
+            values = column_bytes(chunk.timestamps, start, len(chunk))
+            if chunk is self.chunks[-1]:
+                # The last chunk can still grow, its column is not held on to
+                values = bytes(values)
+            timestamps = np.frombuffer(values, dtype=np.int64)
+            found = np.flatnonzero(timestamps > timestamp if after else timestamps >= timestamp)
+            if len(found) > 0:
+                return base + start + int(found[0])
+        return self.end
+
+    def ordered(self: Self) -> bool:
+        """
+        Whether the rows kept are in timestamp order. Rows of merged sources that
+        arrive too late to be merged in order are not, see TraceMerge.
+        """
+        return all(chunk.ordered for chunk in self.chunks)
+
+    def module(self: Self, row: int) -> str:
+        return self.modules.values[self.chunk(row).modules[row & CHUNK_MASK]]
+
+    def task_id(self: Self, row: int) -> str:
+        return self.tasks.values[self.chunk(row).tasks[row & CHUNK_MASK]]
+
+    def source(self: Self, row: int) -> str:
+        return self.sources.values[self.chunk(row).sources[row & CHUNK_MASK]]
+
+    def template(self: Self, row: int) -> int:
+        """The template id of the message at row, TEXT if it is stored as text."""
+        return self.chunk(row).templates[row & CHUNK_MASK]
+
+    def message(self: Self, row: int) -> str:
+        return self.render(self.chunk(row), row & CHUNK_MASK)
+
+    def render(self: Self, chunk: TraceChunk, i: int) -> str:
+        template = chunk.templates[i]
+        if template == TEXT:
+            return chunk.message(i)
+        return self.templates.render(template, chunk.message_bytes(i))
+
+    def getters(self: Self) -> dict[str, Callable[[int], Any]]:
+        """Field getters taking a row number, for FilterDSL.compile."""
+        return {
+            "task_id": self.task_id,
+            "module": self.module,
+            "timestamp": self.timestamp,
+            "message": self.message,
+            "template": self.template,
+            "source": self.source,
+        }
+
+    def nbytes(self: Self) -> int:
+        return sum(c.nbytes() for c in self.chunks)
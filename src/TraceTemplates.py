@@ -0,0 +1,78 @@
+"""
+Format strings for deferred formatting.
+
+Like defmt or Trice, a device can log a template id and its packed arguments
+instead of the rendered text. The format strings live here, read from a JSON
+dictionary produced when building the firmware:
+
+    {
+        "17": {"format": "ADC {} read {} mV", "args": "<BH"},
+        "18": {"format": "Connected to {}", "args": "<*"}
+    }
+
+`args` is a struct format of the packed arguments. A trailing `*` takes the rest
+of the arguments as one utf-8 string.
+"""
+
+import json
+import struct
+from dataclasses import dataclass, field
+from string import Formatter
+from typing import Self
+
+
+@dataclass
+class Template:
+    format: str
+    args: str = ""
+    packed: struct.Struct = field(init=False)
+    tail: bool = field(init=False)
+    # The text between the replacement fields
+    literals: tuple[str, ...] = field(init=False)
+
+    def __post_init__(self: Self) -> None:
+        self.tail = self.args.endswith("*")
+        self.packed = struct.Struct(self.args.removesuffix("*"))
+        self.literals = tuple(literal for literal, _, _, _ in Formatter().parse(self.format)
+                              if literal)
+
+    def render(self: Self, args: bytes) -> str:
+        values = self.packed.unpack_from(args)
+        if self.tail:
+            values += (bytes(args[self.packed.size:]).decode(errors="replace"),)
+        return self.format.format(*values)
+
+    def constant(self: Self) -> bool:
+        """True if the template renders the same text whatever the arguments."""
+        return len(self.literals) == 1 and self.literals[0] == self.format
+
+
+class TemplateDictionary:
+    def __init__(self: Self) -> None:
+        self.templates: dict[int, Template] = {}
+
+    def __len__(self: Self) -> int:
+        return len(self.templates)
+
+    def get(self: Self, template: int) -> Template | None:
+        return self.templates.get(template)
+
+    def clear(self: Self) -> None:
+        self.templates.clear()
+
+    def add(self: Self, template: int, text: str, args: str = "") -> None:
+        self.templates[template] = Template(text, args)
+
+    def load(self: Self, path: str) -> None:
+        with open(path) as f:
+            for template, entry in json.load(f).items():
+                self.add(int(template), entry["format"], entry.get("args", ""))
+
+    def render(self: Self, template: int, args: bytes) -> str:
+        entry = self.templates.get(template)
+        if entry is None:
+            return f"<< Unknown template {template} >>"
+        try:
+            return entry.render(args)
+        except (struct.error, IndexError, KeyError, ValueError) as e:
+            return f"<< Template {template}: {e} >>"
@@ -1,3 +1,4 @@
+import re
 from typing import Self
 
 from FilterDSL import UnknownIdent
@@ -8,34 +9,47 @@ from PySide6.QtCore import (
     QItemSelection,
     QModelIndex,
     Qt,
+    QTimer,
     Signal,
     Slot,
 )
-from PySide6.QtGui import QKeyEvent, QKeySequence
+from PySide6.QtGui import QHideEvent, QKeyEvent, QKeySequence, QShowEvent
 from PySide6.QtWidgets import (
     QAbstractItemView,
     QApplication,
     QHBoxLayout,
+    QHeaderView,
     QLabel,
     QLineEdit,
-    QListView,
+    QProgressBar,
     QSizePolicy,
+    QTableView,
     QVBoxLayout,
     QWidget,
 )
 from TabContainer import TabContainer
 from TraceFilter import TraceFilter
-from TraceModel import TraceModel
+from TraceModel import FRAME_MS, TraceModel
 
 
-class TraceListWidget(QListView):
+class TraceListWidget(QTableView):
+    """
+    A list of trace lines. A QListView lays out every row on each insert, asking
+    the model for each of them, so this is a table of one column with fixed row
+    heights, which only looks at the rows shown.
+    """
     toggle_search_bar = Signal()
 
     def __init__(self: Self, model:QAbstractItemModel) -> None:
         super().__init__()
         self.setModel(model)
 
-        self.setUniformItemSizes(True)
+        self.horizontalHeader().hide()
+        self.horizontalHeader().setStretchLastSection(True)
+        self.verticalHeader().hide()
+        self.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.setShowGrid(False)
+        self.setWordWrap(False)
 
         self.verticalScrollBar().valueChanged.connect(self.user_scroll)
         model.rowsInserted.connect(self.scroll_update)
@@ -43,8 +57,17 @@ class TraceListWidget(QListView):
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
 
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.setStyleSheet("font-family: monospace;")
+        self.ensurePolished()
+        self.verticalHeader().setMinimumSectionSize(1)
+        self.verticalHeader().setDefaultSectionSize(self.fontMetrics().height())
         self.scroll_follow = True
+        # Inserts within one frame scroll to the end once
+        self.scroll_timer = QTimer(self)
+        self.scroll_timer.setSingleShot(True)
+        self.scroll_timer.setInterval(FRAME_MS)
+        self.scroll_timer.timeout.connect(self.scroll_to_end)
 
     def keyPressEvent(self: Self, event: QKeyEvent) -> None:  # noqa: N802
         super().keyPressEvent(event)
@@ -74,7 +97,14 @@ class TraceListWidget(QListView):
 
     @Slot(QModelIndex, int, int)
     def scroll_update(self, parent: QModelIndex, first:int, last:int) -> None:
-        if self.scroll_follow:
+        # A refilter only scrolls once it is done, and hidden views once shown again
+        if self.scroll_follow and not self.model().busy() and self.isVisible():
+            if not self.scroll_timer.isActive():
+                self.scroll_timer.start()
+
+    @Slot()
+    def scroll_to_end(self: Self) -> None:
+        if self.scroll_follow and self.isVisible():
             self.scrollToBottom()
 
 
@@ -99,8 +129,18 @@ class TraceWidget(QWidget):
         self.filter_input_widget = QLineEdit()
         self.filter_input_widget.editingFinished.connect(self.update_filter)
         self.filter_error_message = QLabel()
+        self.filter_progress = QProgressBar()
+        self.filter_progress.setRange(0, 100)
+        self.filter_progress.setMaximumHeight(self.filter_error_message.sizeHint().height())
+        self.filter_progress.hide()
+        self.trace_filtered_model.progress.connect(self.filter_progressed)
+        self.filter_status = QWidget()
+        self.filter_status.setLayout(QHBoxLayout())
+        self.filter_status.layout().setContentsMargins(0, 0, 0, 0)
+        self.filter_status.layout().addWidget(self.filter_error_message)
+        self.filter_status.layout().addWidget(self.filter_progress)
         self.filter_input_widget_container.layout().addWidget(self.filter_input_widget)
-        self.filter_input_widget_container.layout().addWidget(self.filter_error_message)
+        self.filter_input_widget_container.layout().addWidget(self.filter_status)
         self.top.layout().addWidget(self.filter_input_widget_container)
 
         # Format widget
@@ -113,6 +153,19 @@ class TraceWidget(QWidget):
         self.log_view_widget = TraceListWidget(self.trace_filtered_model)
 
         self.layout().addWidget(self.log_view_widget, stretch=2)
+        # Until shown, e.g. when added behind the current tab
+        self.trace_filtered_model.suspend(True)
+
+    def showEvent(self: Self, event: QShowEvent) -> None:  # noqa: N802
+        super().showEvent(event)
+        self.trace_filtered_model.suspend(False)
+        if self.log_view_widget.scroll_follow:
+            self.log_view_widget.scrollToBottom()
+
+    def hideEvent(self: Self, event: QHideEvent) -> None:  # noqa: N802
+        super().hideEvent(event)
+        # Hidden tabs, and tabs of a minimized window, do no work for new rows
+        self.trace_filtered_model.suspend(True)
 
     @Slot()
     def update_format(self: Self) -> None:
@@ -127,7 +180,18 @@ class TraceWidget(QWidget):
             self.filter_error_message.setText(e.get_context(self.filter_input_widget.text()))
         except UnknownIdent as e:
             self.filter_error_message.setText(f"Unknown identifier {e.ident}")
+        except TypeError as e:
+            self.filter_error_message.setText(str(e))
+        except re.error as e:
+            self.filter_error_message.setText(f"Invalid pattern: {e}")
+
 
+    @Slot(int)
+    def filter_progressed(self: Self, percent: int) -> None:
+        self.filter_progress.setValue(percent)
+        self.filter_progress.setVisible(percent < 100)
+        if percent == 100 and self.log_view_widget.scroll_follow and self.isVisible():
+            self.log_view_widget.scrollToBottom()
 
     @Slot(QModelIndex)
     def scoll_to_item(self: Self, index: QModelIndex) -> None:
@@ -0,0 +1,651 @@
+"""
+Micro benchmarks for the hot paths of the trace viewer.
+
+Run with e.g. `python src/benchmark.py filter --rows 1000000`.
+"""
+
+import argparse
+import io
+import os
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from functools import partial
+from itertools import combinations, islice
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from random import choice, randint, seed
+from struct import pack
+from typing import Any, Callable, Iterable, Iterator
+
+import numpy as np
+from lark import Transformer
+from lark.tree import Tree
+from loguru import logger
+from PySide6.QtCore import QCoreApplication, Qt, QTimer
+
+from FilterDSL import FilterDSL, FilterStatistics, UnknownIdent, compile_node
+from FilterEngine import FilterEngine
+from FilterMask import MaskEvaluator
+from FilterPool import FilterPool
+from TraceCapture import CaptureFile, save_capture
+from TraceFilter import TraceFilter
+from TraceFormat import LineFormat, RenderCache
+from TraceIndex import TrigramIndex
+from TraceMerge import MergedSource
+from TraceModel import TraceMessage, TraceModel, generator, made_up_modules
+from TraceSegments import ColdHistory
+from TraceSource import FrameDecoder, StreamSource, encode_frame, open_source
+from TraceStore import TraceBatch, TraceStore
+
+FILTERS = [
+    'module eq "{module}"',
+    'task_id in ["2", "3"]',
+    'message contains "the"',
+    'not (module eq "{module}" or task_id eq "4") and message contains "a"',
+    'message contains "the" and module eq "{module}"',
+    'message contains "e" or task_id in ["2", "3"] or module eq "{module}"',
+]
+
+
+class BaselineEvaluator(Transformer):
+    """
+    The evaluator FilterDSL.eval used before filters were compiled, walking the
+    parse tree of the filter for every row. Kept to measure bench_filter against.
+    """
+    def __init__(self, data: dict) -> None:
+        self.data = data
+
+    def start(self, exprs: list[Tree]) -> bool:
+        return bool(exprs[0])
+
+    def name(self, exprs: list[Tree]) -> str | int:
+        if exprs[0] not in self.data:
+            raise UnknownIdent(str(exprs[0]))
+        return self.data[exprs[0]]
+
+    def eq(self, exprs: list[Tree]) -> bool:
+        (a, b) = exprs
+        return a == b
+
+    def contains(self, exprs: list[Tree]) -> bool:
+        (a, b) = exprs
+        return b in a
+
+    def is_in(self, exprs: list[Tree]) -> bool:
+        (a, b) = exprs
+        return a in b
+
+    def invert(self, exprs: list[Tree]) -> bool:
+        return not exprs[0]
+
+    def combine_and(self, exprs: list[Tree]) -> bool:
+        return exprs[0] and exprs[1]
+
+    def combine_or(self, exprs: list[Tree]) -> bool:
+        return exprs[0] or exprs[1]
+
+    def STRING(self, s: str) -> str:  # noqa: N802
+        return s[1:-1]
+
+    SIGNED_NUMBER = int
+    list = list
+
+
+def baseline_eval(tree: Tree, data: dict) -> bool:
+    return BaselineEvaluator(data).transform(tree)
+
+
+def make_messages(count: int) -> Iterator[TraceMessage]:
+    seed(1234)
+    sentences = [generator().sentence() for _ in range(1000)]
+    modules = made_up_modules()
+    for i in range(count):
+        yield TraceMessage(str(randint(2, 5)), choice(modules), i, f"{choice(sentences)} {i}")
+
+
+def make_store(count: int) -> TraceStore:
+    store = TraceStore()
+    store.extend(make_messages(count))
+    return store
+
+
+def scan(predicate: Callable[[Any], bool], rows: Iterable[Any]) -> list[bool]:
+    return [predicate(r) for r in rows]
+
+
+def rate(count: int, fn: Callable[[], object], repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+
+def bench_filter(count: int) -> None:
+    rows = list(make_messages(count))
+    store = TraceStore()
+    store.extend(rows)
+    getters = store.getters()
+    statistics = FilterStatistics.from_rows(range(len(store)), getters)
+    for template in FILTERS:
+        expr = template.format(module=made_up_modules()[0])
+        dsl = FilterDSL(expr)
+        written = compile_node(dsl.root, getters)
+        planned = dsl.compile(getters, statistics)
+        dicts = [r.__dict__ for r in rows]
+        per_dict = rate(len(rows), partial(scan, partial(baseline_eval, dsl.tree), dicts))
+        per_row = rate(len(rows), partial(scan, written, range(len(store))))
+        per_plan = rate(len(rows), partial(scan, planned, range(len(store))))
+        logger.info(f"{expr:75} baseline: {per_dict:12,.0f} rows/s"
+                    f"  as written: {per_row:12,.0f} rows/s  planned: {per_plan:12,.0f} rows/s")
+
+
+def bench_mask(count: int) -> None:
+    store = make_store(count)
+    statistics = FilterStatistics.from_rows(range(len(store)), store.getters())
+    for template in FILTERS:
+        expr = template.format(module=made_up_modules()[0])
+        evaluator = MaskEvaluator(store, FilterDSL(expr).plan(statistics))
+        per_mask = rate(len(store), partial(evaluator.accepted, 0, len(store)))
+        logger.info(f"{expr:75} mask: {per_mask:14,.0f} rows/s"
+                    f"  {len(store) / per_mask * 1000:8.1f} ms for {len(store):,} rows")
+
+
+def bench_render(count: int) -> None:
+    """Render the visible rows of a view scrolling through count rows."""
+    store = make_store(count)
+    text = "[{timestamp}][{module:10}] : {message}"
+
+    def message_at(row: int) -> TraceMessage:
+        return TraceMessage(store.task_id(row), store.module(row), store.timestamp(row),
+                            store.message(row))
+
+    def format_map(row: int) -> str:
+        return text.format_map(message_at(row))
+
+    line_format = LineFormat(store, text)
+    cache = RenderCache()
+
+    def cached(row: int) -> str:
+        return cache.get((row, 0), partial(line_format.render, row, message_at))
+
+    # Qt asks for every visible row again on each repaint, a view of 50 rows
+    # scrolled one row per repaint asks for each row 50 times
+    visible = 50
+    repaints = [r for top in range(0, count - visible) for r in range(top, top + visible)]
+    for name, render in (("format_map", format_map),
+                         ("compiled", partial(line_format.render, message=message_at)),
+                         ("cached", cached)):
+        per_row = rate(len(repaints), partial(scan, render, repaints), repeat=1)
+        logger.info(f"{name:12} {per_row:12,.0f} lines/s")
+    logger.info(f"cache hit rate {cache.hits / (cache.hits + cache.misses):.1%}")
+
+
+def data_lookup(proxy: TraceFilter, timestamp: int) -> int:
+    """Look up a row by time through data(), like the proxies used to."""
+    left = 0
+    right = proxy.rowCount() - 1
+    while left <= right:
+        middle = (left + right) // 2
+        found = proxy.data(proxy.index(middle, 0), Qt.ItemDataRole.UserRole).timestamp
+        if timestamp == found:
+            break
+        if timestamp < found:
+            right = middle - 1
+        else:
+            left = middle + 1
+    return max(right, 0)
+
+
+def bench_sync(count: int) -> None:
+    """Sync the selected time across 10 tabs with different filters."""
+    app = QCoreApplication.instance() or QCoreApplication([])  # noqa: F841, needed by QTimer
+    model = TraceModel()
+    model.thread.requestInterruption()
+    model.new_data_timer.stop()
+    model.clear()
+    model.store.extend(make_messages(count))
+    proxies = [TraceFilter(model) for _ in range(10)]
+    for proxy, template in zip(proxies, FILTERS + ["", "", "", ""], strict=True):
+        proxy.update_filter(template.format(module=made_up_modules()[0]))
+    times = [randint(0, count) for _ in range(1000)]
+
+    def sync_all(lookup: Callable[[TraceFilter, int], object]) -> None:
+        for timestamp in times:
+            for proxy in proxies:
+                lookup(proxy, timestamp)
+
+    for name, lookup in (("data()", data_lookup), ("index", TraceFilter.global_time_updated)):
+        per_sync = rate(len(times), partial(sync_all, lookup), repeat=1)
+        logger.info(f"{name:8} {per_sync:10,.0f} syncs/s of 10 tabs,"
+                    f" {1e6 / per_sync:8.1f} us per sync")
+
+
+def bench_index(count: int) -> None:
+    """Build the trigram index, and contains filters with and without it."""
+    store = make_store(count)
+    text = sum(len(c.arena) for c in store.chunks)
+    start = time.perf_counter()
+    index = TrigramIndex(store)
+    index.update()
+    elapsed = time.perf_counter() - start
+    logger.info(f"build: {count / elapsed:12,.0f} rows/s {text / elapsed / 1e6:6.1f} MB/s,"
+                f" {index.nbytes() / count:.1f} bytes/row for {text / count:.1f} bytes/row of text")
+
+    # Incremental updates of 1000 rows, like flushes of the model
+    store = TraceStore()
+    index = TrigramIndex(store)
+    messages = make_messages(count)
+    elapsed = 0.0
+    for _ in range(count // 1000):
+        store.extend(islice(messages, 1000))
+        start = time.perf_counter()
+        index.update()
+        elapsed += time.perf_counter() - start
+    logger.info(f"incremental: {count / elapsed:12,.0f} rows/s in updates of 1000 rows")
+
+    for needle in ("the", "tion", f"{count // 2}", "xyzzy"):
+        evaluator = MaskEvaluator(store, FilterDSL(f'message contains "{needle}"').root)
+        store.message_index = None
+        scanned = rate(count, partial(evaluator.accepted, 0, count))
+        store.message_index = index
+        indexed = rate(count, partial(evaluator.accepted, 0, count))
+        logger.info(f"contains {needle!r:10} {len(evaluator.accepted(0, count)):9,} rows"
+                    f"  scanned: {count / scanned * 1000:8.2f} ms"
+                    f"  indexed: {count / indexed * 1000:8.2f} ms")
+
+
+def bench_regex(count: int) -> None:
+    """matches filters, per row without the literal pre-check, and with it."""
+    store = make_store(count)
+    for pattern in (r"the \w+ \d+5$", rf"^\w+ .* {count // 2}\d?$", r"\d{7}"):
+        node = FilterDSL(f'message matches "{pattern}"').root
+        compiled = node.value.compiled
+        per_row = rate(count, partial(scan, lambda r, c=compiled: c.search(store.message(r)),
+                                      range(count)), repeat=1)
+        evaluator = MaskEvaluator(store, node)
+        masked = rate(count, partial(evaluator.accepted, 0, count))
+        logger.info(f"{pattern:22} required {node.value.required!s:16}"
+                    f"  per row: {count / per_row * 1000:8.1f} ms"
+                    f"  pre-checked: {count / masked * 1000:8.1f} ms")
+
+
+def bench_pool(count: int) -> None:
+    """A refilter over count rows in process and split over worker processes."""
+    store = make_store(count)
+    queries = ('message contains "qu"', 'message matches "e \\w+ \\w+ \\d*7$"')
+    for workers in (1, 2, 4, 8, 16):
+        pool = FilterPool(workers)
+        for query in queries:
+            evaluator = MaskEvaluator(store, FilterDSL(query).plan())
+            if workers == 1:
+                took = rate(count, partial(evaluator.accepted, 0, count), repeat=1)
+            else:
+                # The first run starts the workers and exports the chunks
+                list(pool.accepted(evaluator, lambda: False))
+                took = rate(count, lambda p=pool, e=evaluator: list(p.accepted(e, lambda: False)),
+                            repeat=1)
+            logger.info(f"{query:36} {workers:2} workers on {os.cpu_count()} cores:"
+                        f" {count / took * 1000:8.1f} ms")
+        pool.resize(1)
+
+
+def bench_refine(count: int) -> None:
+    """Filters narrowing a previous one, over every row and over its result only."""
+    store = make_store(count)
+    previous = 'message matches "e \\w+ \\w+ \\d*7$"'
+    accepted = MaskEvaluator(store, FilterDSL(previous).plan()).accepted(0, count)
+    module = made_up_modules()[0]
+    for extra in (f'module eq "{module}"', 'message contains "a"', 'not task_id eq "3"'):
+        node = FilterDSL(f"{previous} and {extra}").plan()
+        evaluator = MaskEvaluator(store, node)
+        full = rate(count, partial(evaluator.accepted, 0, count))
+        refined = rate(count, partial(evaluator.accepted_rows, accepted))
+        logger.info(f"and {extra:24} of {len(accepted)} rows"
+                    f"  every row: {count / full * 1000:8.1f} ms"
+                    f"  refined: {count / refined * 1000:8.1f} ms")
+
+
+def bench_engine(count: int) -> None:
+    """
+    Flushes of 1000 rows filtered for tabs combining 2 or 3 of 5 predicates, one
+    tab at a time and by the engine.
+    """
+    store = make_store(count)
+    statistics = FilterStatistics.from_rows(range(len(store)), store.getters())
+    predicates = (f'module eq "{made_up_modules()[0]}"', 'task_id in ["2", "3"]',
+                  'message contains "the"', 'not task_id eq "4"',
+                  'message matches "e \\w+ \\d*7$"')
+    filters = [" and ".join(c) for n in (2, 3) for c in combinations(predicates, n)]
+    batches = range(0, count, 1000)
+    for tabs in (1, 5, 10, 20):
+        evaluators = [MaskEvaluator(store, FilterDSL(f).plan(statistics)) for f in filters[:tabs]]
+        engine = FilterEngine(store)
+
+        def each_tab(evaluators: list[MaskEvaluator] = evaluators) -> None:
+            for start in batches:
+                for evaluator in evaluators:
+                    evaluator.accepted(start, start + 1000)
+
+        def shared(evaluators: list[MaskEvaluator] = evaluators,
+                   engine: FilterEngine = engine) -> None:
+            for start in batches:
+                engine.evaluate(evaluators, start, start + 1000)
+
+        separate = rate(len(batches), each_tab, repeat=1)
+        together = rate(len(batches), shared, repeat=1)
+        logger.info(f"{tabs:2} tabs  each tab: {1000 / separate:7.2f} ms per flush"
+                    f"  engine: {1000 / together:7.2f} ms per flush")
+
+
+def bench_window(count: int) -> None:
+    """A time window of 1% of the rows, answered by binary search and by scanning."""
+    store = make_store(count)
+    low = count // 2
+    expr = f'timestamp between {low} {low + count // 100} and module eq "{made_up_modules()[0]}"'
+    windowed = MaskEvaluator(store, FilterDSL(expr).root)
+    scanned = MaskEvaluator(store, FilterDSL(expr).root)
+    (scanned.window, scanned.rest) = ([], scanned.root)
+    assert np.array_equal(windowed.accepted(0, count), scanned.accepted(0, count))
+    for name, evaluator in (("scanned", scanned), ("windowed", windowed)):
+        per_mask = rate(count, partial(evaluator.accepted, 0, count))
+        logger.info(f"{name:9} {count / per_mask * 1000:8.2f} ms for {count:,} rows")
+
+
+def bench_ring(count: int) -> None:
+    """Ingest count rows into a store holding at most count // 10 rows."""
+    capacity = count // 10
+    store = TraceStore()
+    batch = []
+    start = time.perf_counter()
+    for i, message in enumerate(make_messages(count), 1):
+        batch.append(message)
+        if len(batch) == 1000:
+            store.extend(batch)
+            store.evict(max(0, len(store) - capacity))
+            batch = []
+        if i % (count // 5) == 0:
+            logger.info(f"{i:12,} rows ingested, {len(store):10,} kept, {store.nbytes():14,} bytes")
+    logger.info(f"{count / (time.perf_counter() - start):,.0f} rows/s")
+
+
+def bench_decode(count: int) -> None:
+    """Decode count frames sent over a loopback TCP connection into a store."""
+    modules = made_up_modules()
+    frames = b"".join(
+        encode_frame(m.timestamp, modules.index(m.module), int(m.task_id), m.message.encode())
+        for m in make_messages(count))
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def send() -> None:
+        connection, _ = server.accept()
+        connection.sendall(frames)
+        connection.close()
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    source = open_source(f"tcp://127.0.0.1:{server.getsockname()[1]}")
+    store = TraceStore()
+    start = time.perf_counter()
+    while True:
+        batch = TraceBatch()
+        running = source.read(batch, 1)
+        store.extend_batch(batch)
+        if not running:
+            break
+    elapsed = time.perf_counter() - start
+    sender.join()
+    source.close()
+    server.close()
+    logger.info(f"{len(store):,} frames, {len(frames) / len(store):.1f} bytes/frame,"
+                f" {len(store) / elapsed:,.0f} frames/s, {len(frames) / elapsed / 1e6:.1f} MB/s")
+
+
+def decode_all(frames: bytes) -> TraceStore:
+    decoder = FrameDecoder(len(frames))
+    decoder.receive_view()[:len(frames)] = frames
+    decoder.received(len(frames))
+    batch = TraceBatch()
+    decoder.decode(batch)
+    store = TraceStore()
+    store.extend_batch(batch)
+    return store
+
+
+def bench_templates(count: int) -> None:
+    """The same messages sent as rendered text and as template id plus arguments."""
+    seed(1234)
+    sentences = [generator().sentence() for _ in range(1000)]
+    messages = [(i, randint(0, 999)) for i in range(count)]
+    text = b"".join(encode_frame(i, 0, 0, f"{sentences[s]} {i}".encode()) for i, s in messages)
+    deferred = b"".join(encode_frame(i, 0, 0, pack("<I", i), s) for i, s in messages)
+    for name, frames in (("text", text), ("deferred", deferred)):
+        store = decode_all(frames)
+        for s, sentence in enumerate(sentences):
+            store.templates.add(s, sentence.replace("{", "{{").replace("}", "}}") + " {}", "<I")
+        ingest = rate(count, partial(decode_all, frames))
+        expr = "template eq 7" if name == "deferred" else f'message eq "{sentences[7]} 7"'
+        evaluator = MaskEvaluator(store, FilterDSL(expr).root)
+        per_filter = rate(count, partial(evaluator.accepted, 0, count))
+        per_render = rate(50, partial(scan, store.message, range(count // 2, count // 2 + 50)))
+        logger.info(f"{name:8} {store.nbytes() / count:6.1f} bytes/row"
+                    f"  ingest: {ingest:12,.0f} rows/s  {expr[:16]:16}: {per_filter:14,.0f} rows/s"
+                    f"  render: {per_render:10,.0f} rows/s")
+
+
+def bench_memory(count: int) -> None:
+    rows = list(make_messages(count))
+    sentences = [r.message for r in rows]
+    modules = made_up_modules()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [TraceMessage(str(randint(2, 5)), choice(modules), i, s.encode().decode())
+               for i, s in enumerate(sentences)]
+    per_object = (tracemalloc.get_traced_memory()[0] - before) / len(objects)
+    del objects
+
+    before = tracemalloc.get_traced_memory()[0]
+    store = TraceStore()
+    store.extend(rows)
+    per_column = (tracemalloc.get_traced_memory()[0] - before) / len(store)
+    tracemalloc.stop()
+    message = sum(len(s) for s in sentences) / len(sentences)
+    logger.info(f"mean message length {message:.1f} chars")
+    logger.info(f"list[TraceMessage]: {per_object:.1f} bytes/row")
+    logger.info(f"TraceStore:         {per_column:.1f} bytes/row")
+
+
+def resident() -> int:
+    """Resident memory of this process in bytes, on Linux."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def bench_cold(count: int) -> None:
+    """
+    Resident memory while count rows go through a model and an unfiltered view,
+    for each place older rows can be kept, and after a filter over them all.
+    """
+    app = QCoreApplication.instance() or QCoreApplication([])  # noqa: F841, needed by QTimer
+    batch = TraceBatch()
+    for m in make_messages(50000):
+        batch.append(m.task_id, m.module, m.timestamp, m.message)
+    # Most frugal first, memory freed is not always given back to the system
+    for history in reversed(ColdHistory):
+        model = TraceModel()
+        model.thread.requestInterruption()
+        model.new_data_timer.stop()
+        model.clear()
+        model.set_cold_history(history, model.hot_rows)
+        view = TraceFilter(model)
+        for i in range(1, count // len(batch) + 1):
+            model.ingest.put(batch)
+            model.update_data()
+            if i % (count // len(batch) // 4) == 0:
+                logger.info(f"{history.name:10} {len(model.store):12,} rows"
+                            f"  resident {resident() / 2**20:8.0f} MB")
+        evaluator = MaskEvaluator(model.store, FilterDSL('message contains "quux"').plan())
+        took = rate(len(model.store), partial(evaluator.accepted, 0, model.store.end), repeat=1)
+        logger.info(f"{history.name:10} filtered {took:12,.0f} rows/s"
+                    f"  resident {resident() / 2**20:8.0f} MB, {view.rowCount():,} rows shown")
+        if model.cold_statistics() is not None:
+            logger.info(f"{history.name:10} {model.cold_statistics()}")
+        model.thread.wait()
+        del model, view, evaluator
+
+
+def bench_capture(count: int) -> None:
+    """
+    Save count rows to a capture file, open it again and show and filter it. A
+    module only logging at the end shows filters skipping blocks.
+    """
+    store = TraceStore()
+    batch = TraceBatch()
+    for m in make_messages(50000):
+        batch.append(m.task_id, m.module, m.timestamp, m.message)
+    timestamps = np.frombuffer(batch.timestamps, dtype=np.int64).copy()
+    while len(store) < count:
+        batch.timestamps = array("q", (timestamps + len(store)).tobytes())
+        store.extend_batch(batch)
+    for i in range(1000):
+        store.append("2", "late", store.end, f"late message {i}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.tcap")
+        start = time.perf_counter()
+        save_capture(store, path)
+        took = time.perf_counter() - start
+        logger.info(f"saved {len(store):,} rows in {took:.2f} s, {store.nbytes() / 2**20:.0f} MB"
+                    f" in memory, {os.path.getsize(path) / 2**20:.0f} MB on disk")
+
+        opened = TraceStore()
+        start = time.perf_counter()
+        CaptureFile(path).restore(opened)
+        logger.info(f"opened in {(time.perf_counter() - start) * 1000:.1f} ms")
+        start = time.perf_counter()
+        lines = [opened.message(row) for row in range(opened.end - 50, opened.end)]
+        lines += [opened.message(row) for row in range(opened.first, opened.first + 50)]
+        logger.info(f"first and last screen in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        for expr in ['module eq "late"', f'timestamp lt 1000 or timestamp gt {store.end - 1000}',
+                     'message contains "quux"']:
+            for name, rows in (("memory", store), ("capture", opened)):
+                evaluator = MaskEvaluator(rows, FilterDSL(expr).plan())
+                took = rate(len(rows), partial(evaluator.accepted, rows.first, rows.end), repeat=1)
+                skipped = sum(evaluator.skips(chunk) for chunk in rows.chunks)
+                logger.info(f"{expr!r:45} {name:8} {took:14,.0f} rows/s,"
+                            f" {skipped}/{len(rows.chunks)} chunks skipped")
+
+
+def serve_frames(frames: bytes, connection: Connection) -> None:
+    """Send frames to the first client, from a process of its own."""
+    server = socket.create_server(("127.0.0.1", 0))
+    connection.send(server.getsockname()[1])
+    client, _ = server.accept()
+    client.sendall(frames)
+    client.close()
+    server.close()
+
+
+def bench_ingest(count: int) -> None:
+    """
+    How late a 5 ms GUI timer fires while count frames are read from a TCP
+    connection, with a filtered and an unfiltered view, decoding in a thread and
+    in an ingest process.
+    """
+    app = QCoreApplication.instance() or QCoreApplication([])
+    modules = made_up_modules()
+    frames = b"".join(
+        encode_frame(m.timestamp, modules.index(m.module), int(m.task_id), m.message.encode())
+        for m in make_messages(count))
+    for process in (False, True):
+        model = TraceModel()
+        model.stop_source()
+        model.update_data()
+        model.clear()
+        views = [TraceFilter(model), TraceFilter(model)]
+        views[1].update_filter('message contains "the"')
+        (connection, child) = get_context("forkserver").Pipe()
+        sender = get_context("forkserver").Process(target=serve_frames, args=(frames, child))
+        sender.start()
+        model.set_ingest_process(process)
+        model.open_addresses([f"tcp://127.0.0.1:{connection.recv()}"])
+
+        ticks = [time.perf_counter()]
+        timer = QTimer()
+        timer.setTimerType(Qt.TimerType.PreciseTimer)
+        timer.timeout.connect(partial(lambda ticks: ticks.append(time.perf_counter()), ticks))
+        timer.start(5)
+        start = time.perf_counter()
+        while len(model.store) < count and time.perf_counter() - start < 120:
+            app.processEvents()
+        elapsed = time.perf_counter() - start
+        timer.stop()
+        late = np.diff(ticks) * 1000 - 5
+        logger.info(f"{'process' if process else 'thread ':8} {len(model.store) / elapsed:12,.0f}"
+                    f" rows/s, timer late p50 {np.percentile(late, 50):5.1f} ms"
+                    f" p99 {np.percentile(late, 99):6.1f} ms max {late.max():6.1f} ms,"
+                    f" {np.count_nonzero(late > 50)} stalls over 50 ms")
+        model.stop_source()
+        sender.join()
+        del model, views
+
+
+def bench_merge(count: int) -> None:
+    """
+    Merge count frames spread over N sources, each read from memory, with rows of
+    the sources interleaved one by one and in bursts of 1000.
+    """
+    messages = list(make_messages(count))
+    for sources in (1, 2, 4, 16):
+        for burst in (1, 1000):
+            streams = [bytearray() for _ in range(sources)]
+            for i, m in enumerate(messages):
+                streams[i // burst % sources] += encode_frame(i, 0, 1, m.message.encode())
+            merged = MergedSource([StreamSource(stream, stream.readinto) for stream
+                                   in (io.BytesIO(bytes(s)) for s in streams)])
+            store = TraceStore()
+            start = time.perf_counter()
+            running = True
+            while running:
+                batch = TraceBatch()
+                running = merged.read(batch, 0)
+                store.extend_batch(batch)
+            elapsed = time.perf_counter() - start
+            assert len(store) == count
+            logger.info(f"{sources:3} sources, bursts of {burst:5}:"
+                        f" {count / elapsed:12,.0f} rows/s")
+
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "cold": bench_cold,
+    "capture": bench_capture,
+    "engine": bench_engine,
+    "filter": bench_filter,
+    "index": bench_index,
+    "ingest": bench_ingest,
+    "render": bench_render,
+    "mask": bench_mask,
+    "memory": bench_memory,
+    "merge": bench_merge,
+    "pool": bench_pool,
+    "refine": bench_refine,
+    "regex": bench_regex,
+    "ring": bench_ring,
+    "sync": bench_sync,
+    "templates": bench_templates,
+    "window": bench_window,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.rows)
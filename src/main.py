@@ -6,7 +6,15 @@ import qtawesome as qta
 from loguru import logger
 from PySide6.QtCore import QSize, Qt, Slot
 from PySide6.QtGui import QAction
-from PySide6.QtWidgets import QApplication, QMainWindow
+from PySide6.QtWidgets import (
+    QApplication,
+    QDialog,
+    QFileDialog,
+    QInputDialog,
+    QMainWindow,
+    QMessageBox,
+)
+from settings_windows import SettingsDialog
 from TraceWidget import TraceTab
 
 
@@ -29,6 +37,18 @@ class MainWindow(QMainWindow):
         connect_action.triggered.connect(self.open_connect_dialog)
         self.toolbar.addAction(connect_action)
 
+        templates_action = QAction(qta.icon("fa5s.book"), "Load format strings", self)
+        templates_action.triggered.connect(self.load_templates)
+        self.toolbar.addAction(templates_action)
+
+        save_capture_action = QAction(qta.icon("fa5s.save"), "Save capture", self)
+        save_capture_action.triggered.connect(self.save_capture)
+        self.toolbar.addAction(save_capture_action)
+
+        open_capture_action = QAction(qta.icon("fa5s.folder-open"), "Open capture", self)
+        open_capture_action.triggered.connect(self.open_capture)
+        self.toolbar.addAction(open_capture_action)
+
         start_stream_action = QAction(qta.icon("fa5s.play"), "Start connection", self)
         start_stream_action.triggered.connect(self.start_stream)
         self.toolbar.addAction(start_stream_action)
@@ -46,9 +66,54 @@ class MainWindow(QMainWindow):
 
         self.toolbar.setMovable(False)
 
+        self.trace_tab.trace_model.messages_dropped.connect(self.messages_dropped)
+
     @Slot(bool)
     def open_connect_dialog(self: Self) -> None:
         logger.info("open_connect_dialog")
+        text, ok = QInputDialog.getText(
+            self, "Setup connection",
+            "Device, recorded stream or tcp://host:port, several separated by ;")
+        addresses = [address.strip() for address in text.split(";") if address.strip()]
+        if not ok or not addresses:
+            return
+        try:
+            self.trace_tab.trace_model.open_addresses(addresses)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, "Setup connection", f"Could not open {text}: {e}")
+
+    @Slot(bool)
+    def load_templates(self: Self) -> None:
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Load format strings", "", "Format strings (*.json)")
+        if not path:
+            return
+        try:
+            self.trace_tab.trace_model.load_templates(path)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, "Load format strings", f"Could not load {path}: {e}")
+
+    @Slot(bool)
+    def save_capture(self: Self) -> None:
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save capture", "", "Captures (*.tcap)")
+        if not path:
+            return
+        try:
+            self.trace_tab.trace_model.save_capture(path)
+        except OSError as e:
+            QMessageBox.warning(self, "Save capture", f"Could not save {path}: {e}")
+
+    @Slot(bool)
+    def open_capture(self: Self) -> None:
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Open capture", "", "Captures (*.tcap)")
+        if not path:
+            return
+        try:
+            self.trace_tab.trace_model.open_capture(path)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, "Open capture", f"Could not open {path}: {e}")
 
     @Slot(bool)
     def start_stream(self: Self) -> None:
@@ -66,9 +131,33 @@ class MainWindow(QMainWindow):
     def add_tab(self: Self) -> None:
         self.trace_tab.addTab()
 
+    @Slot(int)
+    def messages_dropped(self: Self, dropped: int) -> None:
+        self.statusBar().showMessage(f"{dropped} messages dropped, the display fell behind")
+
     @Slot(bool)
     def open_settings(self: Self) -> None:
         logger.info("Open settings")
+        model = self.trace_tab.trace_model
+        dialog = SettingsDialog(self)
+        dialog.set_log_history_length(model.history_length)
+        dialog.set_buffering_time(model.buffering_time())
+        dialog.set_overflow_policy(model.ingest.policy)
+        dialog.set_ingest_process(model.ingest_process)
+        dialog.set_message_index(model.store.message_index is not None)
+        dialog.set_cold_history(model.cold_history(), model.hot_rows, model.cold_statistics())
+        dialog.set_filter_workers(model.filter_pool.workers)
+        if dialog.exec() == QDialog.DialogCode.Accepted:
+            model.set_history_length(dialog.get_log_history_length())
+            model.set_buffering_time(dialog.get_buffering_time())
+            try:
+                model.set_overflow_policy(dialog.get_overflow_policy())
+            except ValueError as e:
+                QMessageBox.warning(self, "Settings", f"Could not change the overflow policy: {e}")
+            model.set_ingest_process(dialog.get_ingest_process())
+            model.set_message_index(dialog.get_message_index())
+            model.set_cold_history(dialog.get_cold_history(), dialog.get_hot_rows())
+            model.set_filter_workers(dialog.get_filter_workers())
 
 def excepthook(cls, exception, tb):
     logger.error(f"Exception: {exception}")
@@ -1,13 +1,26 @@
+import os
+from typing import Self
+
 from PySide6.QtCore import Qt
 from PySide6.QtGui import QPalette
-from PySide6.QtWidgets import (
+from PySide6.QtWidgets import (  # noqa: F401, used by create_widget
+    QCheckBox,
     QColorDialog,
+    QComboBox,
     QDialog,
     QDialogButtonBox,
+    QDoubleSpinBox,
     QFontDialog,
+    QLabel,
+    QPushButton,
+    QSpinBox,
     QVBoxLayout,
 )
 
+from TraceCompression import CompressionStatistics
+from TraceIngest import OverflowPolicy
+from TraceSegments import ColdHistory
+
 
 class SettingsDialog(QDialog):
     def __init__(self, parent=None):
@@ -29,14 +42,42 @@ class SettingsDialog(QDialog):
         )
         self.background_color_label = self.create_label("Background Color")
 
-        # Create widgets for log history length
-        self.log_history_spinbox = self.create_spinbox(1, 1000, 10)
-        self.log_history_label = self.create_label("Log History Length")
+        # Create widgets for log history length, in thousands of lines
+        self.log_history_spinbox = self.create_spinbox(0, 1000000, 100)
+        self.log_history_spinbox.setSpecialValueText("Unlimited")
+        self.log_history_label = self.create_label("Log History Length (k lines)")
 
         # Create widgets for buffering time
-        self.buffering_time_spinbox = self.create_double_spinbox(0.0, 10.0, 0.1, 1.0)
+        self.buffering_time_spinbox = self.create_double_spinbox(0.0, 10.0, 0.01, 0.05)
+        self.buffering_time_spinbox.setDecimals(2)
         self.buffering_time_label = self.create_label("Buffering Time (s)")
 
+        # Create widgets for what to do when the display falls behind
+        self.overflow_policy_combobox = self.create_widget("QComboBox")
+        for policy in OverflowPolicy:
+            self.overflow_policy_combobox.addItem(policy.value, policy)
+        self.overflow_policy_label = self.create_label("When Display Falls Behind")
+        # Create widgets for reading connections in a separate process
+        self.ingest_process_checkbox = self.create_widget("QCheckBox")
+        self.ingest_process_checkbox.setText("Decode messages in a separate process")
+
+        # Create widgets for the message index
+        self.message_index_checkbox = self.create_widget("QCheckBox")
+        self.message_index_checkbox.setText("Index message text (faster contains, more memory)")
+
+        # Create widgets for where older messages are kept
+        self.cold_history_combobox = self.create_widget("QComboBox")
+        for history in ColdHistory:
+            self.cold_history_combobox.addItem(history.value, history)
+        self.cold_history_label = self.create_label("Older Messages")
+        self.hot_rows_spinbox = self.create_spinbox(0, 1000000, 100)
+        self.hot_rows_label = self.create_label("Recent Messages Kept As Is (k lines)")
+        self.cold_statistics_label = self.create_label("")
+
+        # Create widgets for the number of filter processes
+        self.filter_workers_spinbox = self.create_spinbox(1, os.cpu_count() or 1, 1)
+        self.filter_workers_label = self.create_label("Filter Worker Processes")
+
         # Create layout and add widgets
         layout = QVBoxLayout()
         layout.addWidget(self.font_label)
@@ -50,6 +91,17 @@ class SettingsDialog(QDialog):
         layout.addWidget(self.log_history_spinbox)
         layout.addWidget(self.buffering_time_label)
         layout.addWidget(self.buffering_time_spinbox)
+        layout.addWidget(self.overflow_policy_label)
+        layout.addWidget(self.overflow_policy_combobox)
+        layout.addWidget(self.ingest_process_checkbox)
+        layout.addWidget(self.message_index_checkbox)
+        layout.addWidget(self.cold_history_label)
+        layout.addWidget(self.cold_history_combobox)
+        layout.addWidget(self.hot_rows_label)
+        layout.addWidget(self.hot_rows_spinbox)
+        layout.addWidget(self.cold_statistics_label)
+        layout.addWidget(self.filter_workers_label)
+        layout.addWidget(self.filter_workers_spinbox)
 
         # Add standard OK and Cancel buttons
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
@@ -91,7 +143,8 @@ class SettingsDialog(QDialog):
 
     def create_widget(self, widget_type):
         widget = eval(widget_type)()
-        widget.setAlignment(Qt.AlignCenter)
+        if hasattr(widget, "setAlignment"):
+            widget.setAlignment(Qt.AlignCenter)
         return widget
 
     def change_font(self):
@@ -122,8 +175,57 @@ class SettingsDialog(QDialog):
             palette.setColor(QPalette.Window, color)
             self.setPalette(palette)
 
-    def get_log_history_length(self):
-        return self.log_history_spinbox.value()
+    def get_log_history_length(self: Self) -> int | None:
+        """History length in lines, None when unlimited."""
+        if self.log_history_spinbox.value() == 0:
+            return None
+        return self.log_history_spinbox.value() * 1000
 
-    def get_buffering_time(self):
+    def set_log_history_length(self: Self, history_length: int | None) -> None:
+        self.log_history_spinbox.setValue(0 if history_length is None else history_length // 1000)
+
+    def get_buffering_time(self: Self) -> float:
         return self.buffering_time_spinbox.value()
+
+    def set_buffering_time(self: Self, seconds: float) -> None:
+        self.buffering_time_spinbox.setValue(seconds)
+
+    def get_overflow_policy(self: Self) -> OverflowPolicy:
+        return self.overflow_policy_combobox.currentData()
+
+    def set_overflow_policy(self: Self, policy: OverflowPolicy) -> None:
+        self.overflow_policy_combobox.setCurrentIndex(
+            self.overflow_policy_combobox.findData(policy)
+        )
+
+    def get_ingest_process(self: Self) -> bool:
+        return self.ingest_process_checkbox.isChecked()
+
+    def set_ingest_process(self: Self, enabled: bool) -> None:
+        self.ingest_process_checkbox.setChecked(enabled)
+
+    def get_message_index(self: Self) -> bool:
+        return self.message_index_checkbox.isChecked()
+
+    def set_message_index(self: Self, enabled: bool) -> None:
+        self.message_index_checkbox.setChecked(enabled)
+
+    def get_cold_history(self: Self) -> ColdHistory:
+        return self.cold_history_combobox.currentData()
+
+    def get_hot_rows(self: Self) -> int:
+        return self.hot_rows_spinbox.value() * 1000
+
+    def set_cold_history(self: Self, history: ColdHistory, hot_rows: int,
+                         statistics: CompressionStatistics | None = None) -> None:
+        self.cold_history_combobox.setCurrentIndex(
+            self.cold_history_combobox.findData(history)
+        )
+        self.hot_rows_spinbox.setValue(hot_rows // 1000)
+        self.cold_statistics_label.setText("" if statistics is None else str(statistics))
+
+    def get_filter_workers(self: Self) -> int:
+        return self.filter_workers_spinbox.value()
+
+    def set_filter_workers(self: Self, workers: int) -> None:
+        self.filter_workers_spinbox.setValue(workers)
@@ -0,0 +1,59 @@
+"""Fixtures shared by the tests of the models."""
+
+import os
+import time
+from typing import Callable, Iterator
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtCore import QCoreApplication  # noqa: E402
+
+from TraceModel import TraceModel  # noqa: E402
+from TraceStore import TraceBatch  # noqa: E402
+
+Wait = Callable[[Callable[[], bool]], None]
+
+
+@pytest.fixture(scope="session")
+def app() -> QCoreApplication:
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+@pytest.fixture
+def wait(app: QCoreApplication) -> Wait:
+    """Process events until a condition holds."""
+    def wait(condition: Callable[[], bool], timeout: float = 20) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "timed out"
+            app.processEvents()
+            time.sleep(0.001)
+    return wait
+
+
+@pytest.fixture
+def model(app: QCoreApplication) -> Iterator[TraceModel]:
+    """A model without rows, whose source is stopped, see add_rows."""
+    model = TraceModel()
+    model.new_data_timer.stop()
+    model.stop_source()
+    model.update_data()
+    model.clear()
+    yield model
+    model.stop_source()
+
+
+def flush_rows(model: TraceModel, start: int, count: int) -> None:
+    """Flush rows with timestamps start, start + 1, ... into model, module radio every third."""
+    batch = TraceBatch()
+    for i in range(start, start + count):
+        batch.append(str(i % 4), ("radio", "gps", "power")[i % 3], i, f"message {i}")
+    model.ingest.put(batch)
+    model.update_data()
+
+
+@pytest.fixture
+def add_rows() -> Callable[[TraceModel, int, int], None]:
+    return flush_rows
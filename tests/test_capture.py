@@ -0,0 +1,78 @@
+"""A store saved to a capture file and opened again holds the same rows."""
+
+import os
+from pathlib import Path
+
+import pytest
+
+from FilterDSL import FilterDSL
+from FilterMask import MaskEvaluator
+from TraceCapture import CaptureChunk, CaptureFile, is_capture, save_capture
+from TraceStore import CHUNK_ROWS, TraceBatch, TraceStore
+
+
+def make_store() -> TraceStore:
+    store = TraceStore()
+    store.templates.add(3, "ADC {} read {} mV", "<BH")
+    batch = TraceBatch()
+    for i in range(2 * CHUNK_ROWS + 123):
+        if i % 5 == 0:
+            batch.append_template(str(i % 4), f"module{i % 6}", i, 3,
+                                  bytes([i % 8]) + (i % 3300).to_bytes(2, "little"), str(i % 2))
+        else:
+            batch.append(str(i % 4), f"module{i % 6}", i, f"message {i} ünïcode", str(i % 2))
+    store.extend_batch(batch)
+    store.evict(100)
+    return store
+
+
+def rows(store: TraceStore) -> list[tuple]:
+    return [(row, store.timestamp(row), store.module(row), store.task_id(row),
+             store.source(row), store.template(row), store.message(row))
+            for row in range(store.first, store.end)]
+
+
+def test_round_trip(tmp_path: Path) -> None:
+    store = make_store()
+    path = str(tmp_path / "trace.tcap")
+    save_capture(store, path)
+    assert is_capture(path)
+
+    opened = TraceStore()
+    opened.templates.add(99, "left over from before")
+    CaptureFile(path).restore(opened)
+    assert (opened.first, opened.end) == (store.first, store.end)
+    assert rows(opened) == rows(store)
+    assert opened.templates.get(99) is None
+    assert isinstance(opened.chunks[0], CaptureChunk)
+    assert opened.ordered()
+
+    # Filters skip or read the blocks, and new rows go after the restored ones
+    evaluator = MaskEvaluator(opened, FilterDSL('module eq "module2" and timestamp lt 70000').root)
+    assert evaluator.accepted(opened.first, opened.end).tolist() == \
+        [row for row in range(100, 70000) if row % 6 == 2]
+    opened.append("0", "late", 5, "arrived late")
+    assert opened.message(opened.end - 1) == "arrived late"
+    assert not opened.ordered()
+
+
+def test_not_a_capture(tmp_path: Path) -> None:
+    path = tmp_path / "frames.bin"
+    path.write_bytes(b"\x00" * 32)
+    assert not is_capture(str(path))
+    with pytest.raises(ValueError, match="not a capture file"):
+        CaptureFile(str(path))
+
+
+def test_devices_are_not_opened(tmp_path: Path) -> None:
+    (master, slave) = os.openpty()
+    try:
+        os.write(master, b"TRACECAP\n")
+        # Neither blocks nor takes the bytes waiting on the device
+        assert not is_capture(os.ttyname(slave))
+        assert os.read(slave, 9) == b"TRACECAP\n"
+    finally:
+        os.close(master)
+        os.close(slave)
+    assert not is_capture(str(tmp_path))
+    assert not is_capture(str(tmp_path / "missing.tcap"))
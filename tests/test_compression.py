@@ -0,0 +1,56 @@
+"""Cold chunks compressed in memory and decompressed while they are used."""
+
+import numpy as np
+
+from FilterDSL import FilterDSL
+from FilterMask import MaskEvaluator
+from TraceCompression import CompressedChunk, CompressedChunks, CompressionStatistics
+from TraceStore import CHUNK_ROWS, TraceBatch, TraceStore
+
+ROWS = 4 * CHUNK_ROWS + 100
+
+
+def fill(store: TraceStore) -> TraceStore:
+    store.templates.add(3, "ADC {} read {} mV", "<BH")
+    batch = TraceBatch()
+    for i in range(ROWS):
+        if i % 5 == 0:
+            batch.append_template(str(i % 4), "adc", i, 3,
+                                  bytes([i % 8]) + (i % 3300).to_bytes(2, "little"))
+        else:
+            batch.append(str(i % 7), ("radio", "gps", "power")[i % 3], i, f"message {i}")
+    store.extend_batch(batch)
+    return store
+
+
+def test_compressed_chunks_read_like_chunks_in_memory() -> None:
+    store = TraceStore()
+    store.cold = CompressedChunks(hot=1, cached=1)
+    fill(store)
+    plain = fill(TraceStore())
+    assert [isinstance(chunk, CompressedChunk) for chunk in store.chunks] == \
+        [True, True, True, False, False]
+    assert sum(chunk.nbytes() for chunk in store.chunks[:3]) < \
+        sum(chunk.nbytes() for chunk in plain.chunks[:3]) // 2
+    for row in (0, 1, CHUNK_ROWS + 5, 2 * CHUNK_ROWS + 7, ROWS - 1):
+        assert (store.task_id(row), store.module(row), store.timestamp(row), store.template(row),
+                store.message(row)) == (plain.task_id(row), plain.module(row),
+                                        plain.timestamp(row), plain.template(row),
+                                        plain.message(row))
+    root = FilterDSL('message contains "read 7" or timestamp between 70000 70100').plan()
+    assert np.array_equal(MaskEvaluator(store, root).accepted(0, ROWS),
+                          MaskEvaluator(plain, root).accepted(0, ROWS))
+
+
+def test_statistics() -> None:
+    store = TraceStore()
+    store.cold = CompressedChunks(hot=1, cached=2)
+    fill(store)
+    # Two blocks are kept decompressed, the least recently used is dropped
+    for row in (0, 1, CHUNK_ROWS, 2, 2 * CHUNK_ROWS, 3, CHUNK_ROWS + 1):
+        store.message(row)
+    statistics = store.cold.statistics
+    assert statistics.raw > 3 * statistics.compressed > 0
+    assert statistics.misses == 4 and statistics.hits > 0
+    assert str(statistics).startswith(f"compressed {statistics.ratio():.1f}x, ")
+    assert CompressionStatistics().ratio() == 1.0 and CompressionStatistics().hit_rate() == 1.0
@@ -0,0 +1,75 @@
+"""New rows evaluated once for the filters of every view of a store."""
+
+import numpy as np
+
+from FilterDSL import FilterDSL
+from FilterEngine import FilterEngine
+from FilterMask import MaskEvaluator
+from TraceStore import CHUNK_ROWS, TraceBatch, TraceStore
+
+EXPRESSIONS = [
+    'module eq "gps"',
+    'module eq "gps" and message contains "7"',
+    'message contains "7" or task_id eq "3"',
+    'timestamp ge 70000 and module eq "radio"',
+    "timestamp lt 10",
+]
+
+
+class View:
+    """Views are only weakly referenced keys of the engine."""
+
+
+def make_store(count: int) -> TraceStore:
+    store = TraceStore()
+    batch = TraceBatch()
+    for i in range(count):
+        batch.append(str(i % 5), ("radio", "gps", "power")[i % 3], i, f"message {i}")
+    store.extend_batch(batch)
+    return store
+
+
+def evaluators(store: TraceStore) -> list[MaskEvaluator]:
+    return [MaskEvaluator(store, FilterDSL(expr).plan()) for expr in EXPRESSIONS]
+
+
+def test_every_view_gets_its_own_rows() -> None:
+    store = make_store(CHUNK_ROWS + 10_000)
+    engine = FilterEngine(store)
+    views = [View() for _ in EXPRESSIONS]
+    for view, evaluator in zip(views, evaluators(store), strict=True):
+        engine.register(view, evaluator)
+    # The same filter twice is evaluated once
+    twin = View()
+    engine.register(twin, MaskEvaluator(store, FilterDSL(EXPRESSIONS[1]).plan()))
+    (start, stop) = (1000, store.end)
+    for evaluator in engine.views.values():
+        assert np.array_equal(engine.accepted(evaluator, start, stop),
+                              evaluator.accepted(start, stop))
+    assert engine.range == (start, stop) and len(engine.results) == len(EXPRESSIONS)
+
+
+def test_filter_registered_after_the_rows_were_evaluated() -> None:
+    store = make_store(5000)
+    engine = FilterEngine(store)
+    (first, later) = evaluators(store)[:2]
+    views = (View(), View())
+    engine.register(views[0], first)
+    engine.accepted(first, 100, 5000)
+    engine.register(views[1], later)
+    assert np.array_equal(engine.accepted(later, 100, 5000), later.accepted(100, 5000))
+    assert np.array_equal(engine.accepted(first, 100, 5000), first.accepted(100, 5000))
+
+
+def test_unregistered_filters_are_evaluated_alone() -> None:
+    store = make_store(5000)
+    engine = FilterEngine(store)
+    (first, other) = evaluators(store)[:2]
+    view = View()
+    engine.register(view, first)
+    assert np.array_equal(engine.accepted(other, 0, 5000), other.accepted(0, 5000))
+    assert engine.range == (0, 0)
+    engine.unregister(view)
+    del view
+    engine.accepted(first, 0, 100)
+    assert not engine.results
@@ -0,0 +1,149 @@
+"""Parsing, compiling and planning of FilterDSL expressions."""
+
+import re
+from operator import itemgetter
+from typing import Callable
+
+import pytest
+
+from FilterDSL import (
+    And,
+    Compare,
+    FilterDSL,
+    FilterStatistics,
+    Or,
+    UnknownIdent,
+    compile_node,
+    required_literals,
+)
+
+ROWS = [
+    {"module": "radio", "task_id": "1", "timestamp": 10, "message": "boot ok"},
+    {"module": "gps", "task_id": "2", "timestamp": 20, "message": "fix lost"},
+    {"module": "radio", "task_id": "3", "timestamp": 30, "message": "tx done"},
+    {"module": "power", "task_id": "2", "timestamp": 40, "message": "battery low"},
+]
+
+
+def accepted(expr: str) -> list[int]:
+    dsl = FilterDSL(expr)
+    return [row["timestamp"] for row in ROWS if dsl.eval(row)]
+
+
+@pytest.mark.parametrize(("expr", "expected"), [
+    ('module eq "radio"', [10, 30]),
+    ("timestamp eq 20", [20]),
+    ('task_id in ["2", "3"]', [20, 30, 40]),
+    ('message contains "o"', [10, 20, 30, 40]),
+    ('message contains "lo"', [20, 40]),
+    ('not module eq "radio"', [20, 40]),
+    ('module eq "radio" and task_id eq "3"', [30]),
+    ('module eq "gps" or module eq "power"', [20, 40]),
+    ('not (module eq "radio" or task_id eq "2") and message contains "o"', []),
+    ('(module eq "radio" or module eq "gps") and not message contains "lost"', [10, 30]),
+    ("timestamp lt 20", [10]),
+    ("timestamp le 20", [10, 20]),
+    ("timestamp gt 20", [30, 40]),
+    ("timestamp ge 20", [20, 30, 40]),
+    ("timestamp between 20 30", [20, 30]),
+    ('module lt "q"', [20, 40]),
+    ('task_id ge "2" and timestamp between 0 35', [20, 30]),
+    ('message matches "^b.*k$"', [10]),
+    ('message matches "o[a-z]"', [10, 20, 30, 40]),
+    ('message matches "lo(st|w)" and not module eq "gps"', [40]),
+])
+def test_eval(expr: str, expected: list[int]) -> None:
+    assert accepted(expr) == expected
+
+
+@pytest.mark.parametrize(("pattern", "literals"), [
+    ("b[aeiou]+t", ("b", "t")),
+    ("^the .*ok$", ("the ", "ok")),
+    (r"sensor read (\d+) ok", ("sensor read ", " ok")),
+    ("ab(?:cd)ef", ("abcdef",)),
+    ("abc*d", ("ab", "d")),
+    # Alternations and ignored case require nothing
+    ("fail|xyz", ()),
+    ("(?i)boot", ()),
+])
+def test_required_literals(pattern: str, literals: tuple[str, ...]) -> None:
+    assert required_literals(re.compile(pattern)) == literals
+
+
+def test_bad_pattern_is_rejected_when_parsing() -> None:
+    with pytest.raises(re.error):
+        FilterDSL('message matches "("')
+
+
+def test_refines() -> None:
+    base = FilterDSL('module eq "radio" or task_id eq "1"')
+    assert FilterDSL('(module eq "radio" or task_id eq "1") and timestamp gt 3').refines(base)
+    assert not FilterDSL('module eq "radio"').refines(base)
+    narrow = FilterDSL('module eq "radio" and timestamp gt 3 and message contains "a"')
+    assert narrow.refines(FilterDSL('message contains "a" and module eq "radio"'))
+
+
+def getter(field: str) -> Callable[[int], object]:
+    return lambda row: ROWS[row][field]
+
+
+def test_compile_reads_fields_through_getters() -> None:
+    rows = list(range(len(ROWS)))
+    getters = {field: getter(field) for field in ROWS[0]}
+    predicate = FilterDSL('module eq "radio" and timestamp eq 30').compile(getters)
+    assert [row for row in rows if predicate(row)] == [2]
+
+
+def test_unknown_ident() -> None:
+    with pytest.raises(UnknownIdent):
+        FilterDSL('colour eq "red"').eval(ROWS[0])
+    with pytest.raises(UnknownIdent):
+        FilterDSL('colour eq "red"').compile({"module": lambda row: row})
+
+
+def test_and_or_chains_are_flattened() -> None:
+    root = FilterDSL('module eq "a" and task_id eq "1" and (timestamp eq 3 and task_id eq "")').root
+    assert isinstance(root, And) and len(root.operands) == 4
+    root = FilterDSL('module eq "a" or (task_id eq "1" or timestamp eq 3)').root
+    assert isinstance(root, Or) and len(root.operands) == 3
+
+
+def test_operands_stop_at_the_first_deciding_one() -> None:
+    reads: list[str] = []
+
+    def read(field: str) -> Callable[[int], object]:
+        def get(row: int) -> object:
+            reads.append(field)
+            return ROWS[row][field]
+        return get
+
+    getters = {field: read(field) for field in ROWS[0]}
+    predicate = compile_node(FilterDSL('module eq "gps" and message contains "o"').root, getters)
+    assert not predicate(0)
+    assert reads == ["module"]
+    reads.clear()
+    predicate = compile_node(FilterDSL('module eq "radio" or message contains "o"').root, getters)
+    assert predicate(0)
+    assert reads == ["module"]
+
+
+def test_plan_puts_cheap_selective_operands_first() -> None:
+    dsl = FilterDSL('message contains "o" and module eq "gps"')
+    assert [n.op for n in dsl.plan().operands] == ["eq", "contains"]
+    # With statistics, the operand rejecting the most rows goes first
+    rows = [{"module": "radio", "task_id": str(i % 100)} for i in range(1000)]
+    statistics = FilterStatistics.from_rows(rows, {f: itemgetter(f) for f in rows[0]})
+    dsl = FilterDSL('module eq "radio" and task_id eq "7"')
+    assert dsl.plan(statistics).operands[0] == Compare("eq", "task_id", "7")
+    dsl = FilterDSL('task_id eq "7" or module eq "radio"')
+    assert dsl.plan(statistics).operands[0] == Compare("eq", "module", "radio")
+
+
+def test_planning_keeps_the_result() -> None:
+    rows = list(range(len(ROWS)))
+    getters = {field: getter(field) for field in ROWS[0]}
+    expr = 'message contains "o" and (task_id in ["2", "3"] or module eq "radio")'
+    dsl = FilterDSL(expr)
+    statistics = FilterStatistics.from_rows(rows, getters)
+    planned = dsl.compile(getters, statistics)
+    assert [row for row in rows if planned(row)] == [r for r in rows if dsl.eval(ROWS[r])]
@@ -0,0 +1,114 @@
+"""Filters evaluated row by row with compile_node and as masks with MaskEvaluator agree."""
+
+from random import Random
+
+import numpy as np
+import pytest
+
+from FilterDSL import FilterDSL, UnknownIdent, compile_node
+from FilterMask import MaskEvaluator
+from TraceStore import CHUNK_ROWS, TraceBatch, TraceStore
+
+MODULES = ["radio", "gps", "power", "modem", "ui"]
+WORDS = ["boot", "bat", "the", "sensor", "read", "ok", "fail", "a", "xyz"]
+
+EXPRESSIONS = [
+    'module eq "radio"',
+    'task_id in ["1", "2"]',
+    'message contains "boot"',
+    'message contains "sensor read"',
+    "timestamp eq 4242",
+    'timestamp eq 4242 or module eq "gps"',
+    'not (module eq "radio" or task_id eq "4") and message contains "o"',
+    'message contains "the" and module eq "power"',
+    'message contains "e" or task_id in ["2", "3"] or module eq "gps"',
+    "timestamp between 1000 50000",
+    "timestamp ge 120000",
+    'timestamp lt 9000 or module eq "gps"',
+    'timestamp gt 3000 and timestamp le 3100 and message contains "a"',
+    'module lt "n"',
+    'task_id ge "3"',
+    'message matches "b[aeiou]+t"',
+    'message matches "^the .*ok$"',
+    'timestamp between 20000 90000 and not message matches "fail|xyz"',
+    "template eq 7",
+    'template eq 7 and message contains "read 1"',
+    'source eq "1"',
+    'timestamp gt 70000 and source eq "1"',
+]
+
+
+def make_store(ordered: bool) -> TraceStore:
+    """Rows over two chunks, the oldest evicted, and rows arriving late unless ordered."""
+    rng = Random(1234)
+    store = TraceStore()
+    store.templates.add(7, "Sensor read {} ok", "<H")
+    batch = TraceBatch()
+    for i in range(CHUNK_ROWS + 5000):
+        timestamp = i * 2
+        if not ordered and i % 1000 == 999:
+            timestamp = rng.randint(0, timestamp)
+        task = str(rng.randint(0, 5))
+        module = rng.choice(MODULES)
+        source = str(i % 3)
+        if i % 17 == 0:
+            args = rng.randint(0, 999).to_bytes(2, "little")
+            batch.append_template(task, module, timestamp, 7, args, source)
+        else:
+            message = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 6)))
+            batch.append(task, module, timestamp, message, source)
+    store.extend_batch(batch)
+    store.evict(1000)
+    return store
+
+
+@pytest.fixture(scope="module", params=[True, False], ids=["ordered", "late rows"])
+def store(request: pytest.FixtureRequest) -> TraceStore:
+    return make_store(request.param)
+
+
+@pytest.mark.parametrize("expr", EXPRESSIONS)
+def test_mask_matches_compiled(store: TraceStore, expr: str) -> None:
+    dsl = FilterDSL(expr)
+    predicate = compile_node(dsl.root, store.getters())
+    expected = [row for row in range(store.first, store.end) if predicate(row)]
+    for root in (dsl.root, dsl.plan()):
+        evaluator = MaskEvaluator(store, root)
+        assert evaluator.accepted(store.first, store.end).tolist() == expected
+        assert evaluator.accepted(store.first + 10, store.first + 100).tolist() == \
+            [row for row in expected if store.first + 10 <= row < store.first + 100]
+
+
+def test_accepted_rows_checks_only_the_rows_given(store: TraceStore) -> None:
+    dsl = FilterDSL('message contains "o" and module eq "radio"')
+    predicate = compile_node(dsl.root, store.getters())
+    rows = np.arange(store.first - 5, store.end, 7)
+    evaluator = MaskEvaluator(store, dsl.root)
+    assert evaluator.accepted_rows(rows).tolist() == \
+        [row for row in rows.tolist() if row >= store.first and predicate(row)]
+
+
+def test_unknown_field_is_rejected_before_evaluating(store: TraceStore) -> None:
+    with pytest.raises(UnknownIdent):
+        MaskEvaluator(store, FilterDSL('colour eq "red"').root)
+
+
+def test_message_has_no_order(store: TraceStore) -> None:
+    with pytest.raises(TypeError):
+        MaskEvaluator(store, FilterDSL('message lt "b"').root)
+
+
+@pytest.mark.parametrize("timestamp", [0, 4242, 4243, 99999, 10**9])
+def test_find_timestamp(store: TraceStore, timestamp: int) -> None:
+    rows = range(store.first, store.end)
+    at = next((row for row in rows if store.timestamp(row) >= timestamp), store.end)
+    past = next((row for row in rows if store.timestamp(row) > timestamp), store.end)
+    assert store.find_timestamp(timestamp) == at
+    assert store.find_timestamp(timestamp, after=True) == past
+
+
+def test_late_rows_mark_their_chunk() -> None:
+    assert make_store(ordered=True).ordered()
+    store = make_store(ordered=False)
+    assert not store.ordered()
+    assert not all(chunk.ordered for chunk in store.chunks)
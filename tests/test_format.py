@@ -0,0 +1,59 @@
+"""Lines rendered from a compiled line format, and the cache of rendered lines."""
+
+from typing import Any
+
+from TraceFormat import LineFormat, RenderCache
+from TraceStore import TraceStore
+
+
+def make_store() -> TraceStore:
+    store = TraceStore()
+    store.append("1", "radio", 10, "boot ok")
+    store.append("2", "gps", 20, "fix {lost}")
+    return store
+
+
+def fields(store: TraceStore, row: int) -> dict[str, Any]:
+    return {name: get(row) for name, get in store.getters().items()}
+
+
+def test_compiled_format() -> None:
+    store = make_store()
+    line = LineFormat(store, "[{timestamp:>4}][{module:6}] {{{task_id}}} : {message!r}")
+    assert not line.fallback
+    assert line.render(0, lambda row: {}) == "[  10][radio ] {1} : 'boot ok'"
+    # Braces in the message are text, not fields
+    assert line.render(1, lambda row: {}) == "[  20][gps   ] {2} : 'fix {lost}'"
+
+
+def test_formats_that_can_not_be_compiled() -> None:
+    store = make_store()
+    for text in ("{timestamp:{width}}", "{colour} {message}", "{0}"):
+        line = LineFormat(store, text)
+        assert line.fallback
+    line = LineFormat(store, "{message} at {timestamp:{width}}")
+    assert line.render(0, lambda row: fields(store, row) | {"width": 4}) == "boot ok at   10"
+    # Errors are rendered in place of the line
+    line = LineFormat(store, "{colour}")
+    assert line.render(0, lambda row: fields(store, row)) == "'colour'"
+    line = LineFormat(store, "{timestamp:q}")
+    assert line.render(0, lambda row: {}).startswith("Unknown format code 'q'")
+
+
+def test_cache_keeps_the_most_recent_lines() -> None:
+    cache = RenderCache(size=2)
+    renders: list[int] = []
+
+    def render(row: int) -> str:
+        renders.append(row)
+        return f"line {row}"
+
+    for row in (1, 2, 1, 3, 1, 2):
+        assert cache.get((row, 0), lambda row=row: render(row)) == f"line {row}"
+    assert renders == [1, 2, 3, 2]
+    assert (cache.hits, cache.misses) == (2, 4)
+    # Another format generation is another line
+    cache.get((1, 1), lambda: render(1))
+    assert renders[-1] == 1
+    cache.clear()
+    assert not cache.lines
@@ -0,0 +1,84 @@
+"""The trigram index narrowing `contains` filters to candidate rows."""
+
+from random import Random
+
+import numpy as np
+
+from FilterDSL import FilterDSL, compile_node
+from FilterMask import MaskEvaluator
+from TraceIndex import TrigramIndex
+from TraceStore import CHUNK_BITS, CHUNK_ROWS, TraceBatch, TraceStore
+
+WORDS = ["boot", "bat", "the", "sensor", "read", "ok", "fail", "a", "xyz", "ünï"]
+NEEDLES = ["sensor", "bat the", "xyz", "ünï", "ok", "missing", "ead o"]
+
+
+def add_rows(store: TraceStore, rng: Random, count: int) -> None:
+    batch = TraceBatch()
+    for i in range(count):
+        if i % 13 == 0:
+            batch.append_template("1", "radio", i, 7, b"sensor")
+        else:
+            batch.append("1", "radio", i, " ".join(rng.choice(WORDS) for _ in range(4)))
+    store.extend_batch(batch)
+
+
+def test_candidates_hold_every_match() -> None:
+    rng = Random(99)
+    store = TraceStore()
+    store.templates.add(7, "{}", "<*")
+    index = TrigramIndex(store)
+    # Updates in pieces, into segments that are merged once there are many
+    for count in (1000, 30_000, 7, 1, 40_000, *[500] * 12):
+        add_rows(store, rng, count)
+        index.update()
+    assert store.end > CHUNK_ROWS and len(index.chunks[1]) > 1
+    assert len(index.chunks[0]) == 1
+    for needle in NEEDLES:
+        encoded = needle.encode()
+        for number in (0, 1):
+            base = number << CHUNK_BITS
+            candidates = index.candidates(number, encoded)
+            if len(encoded) < 3:
+                assert candidates is None
+                continue
+            found = {base + int(row) for row in candidates}
+            for row in range(base, min(base + CHUNK_ROWS, store.end)):
+                if store.template(row) == 7:
+                    # Packed arguments are not text, so never candidates
+                    assert row not in found
+                elif needle in store.message(row):
+                    assert row in found
+
+
+def test_indexed_masks_match_compiled() -> None:
+    rng = Random(5)
+    store = TraceStore()
+    store.templates.add(7, "{}", "<*")
+    add_rows(store, rng, CHUNK_ROWS + 3000)
+    store.message_index = TrigramIndex(store)
+    store.message_index.update()
+    store.evict(2000)
+    store.message_index.update()
+    add_rows(store, rng, 100)
+    for needle in NEEDLES:
+        dsl = FilterDSL(f'message contains "{needle}"')
+        predicate = compile_node(dsl.root, store.getters())
+        expected = [row for row in range(store.first, store.end) if predicate(row)]
+        # The rows appended since the update are scanned
+        assert MaskEvaluator(store, dsl.root).accepted(store.first, store.end).tolist() == expected
+
+
+def test_eviction_and_skip() -> None:
+    store = TraceStore()
+    add_rows(store, Random(1), 2 * CHUNK_ROWS)
+    index = TrigramIndex(store)
+    index.update()
+    assert index.covers(0, 2 * CHUNK_ROWS)
+    store.evict(CHUNK_ROWS)
+    index.update()
+    assert list(index.chunks) == [1]
+    assert not index.covers(0, 10) and index.covers(CHUNK_ROWS, 2 * CHUNK_ROWS)
+    index.skip()
+    assert index.nbytes() == 0 and not index.covers(CHUNK_ROWS, CHUNK_ROWS + 1)
+    assert np.array_equal(index.candidates(1, b"boot"), np.zeros(0, dtype=np.uint16))
@@ -0,0 +1,75 @@
+"""Batches handed from a reader thread to the GUI thread through an IngestBuffer."""
+
+import threading
+import time
+
+from TraceIngest import IngestBuffer, OverflowPolicy
+from TraceStore import TraceBatch
+
+
+def batch(start: int, count: int) -> TraceBatch:
+    batch = TraceBatch()
+    for i in range(start, start + count):
+        batch.append("1", "radio", i, f"message {i}")
+    return batch
+
+
+def timestamps(batches: list[TraceBatch]) -> list[int]:
+    return [t for b in batches for t in b.timestamps]
+
+
+def test_batches_are_taken_in_order() -> None:
+    buffer = IngestBuffer(limit=100)
+    buffer.put(batch(0, 10))
+    buffer.put(batch(10, 10))
+    assert timestamps(buffer.take()) == list(range(20))
+    assert buffer.take() == []
+    assert buffer.pending() == 0
+
+
+def test_drop_oldest() -> None:
+    buffer = IngestBuffer(limit=25, policy=OverflowPolicy.DROP_OLDEST)
+    for start in range(0, 50, 10):
+        buffer.put(batch(start, 10))
+    assert buffer.dropped == 30
+    assert timestamps(buffer.take()) == list(range(30, 50))
+
+
+def test_spill_keeps_every_row_in_order() -> None:
+    buffer = IngestBuffer(limit=25, policy=OverflowPolicy.SPILL)
+    for start in range(0, 100, 10):
+        buffer.put(batch(start, 10))
+    taken = []
+    while len(taken) < 100:
+        batches = buffer.take()
+        assert batches
+        taken += timestamps(batches)
+    assert taken == list(range(100))
+    assert buffer.dropped == 0 and buffer.spill_file is None
+
+
+def test_block_waits_for_the_gui() -> None:
+    buffer = IngestBuffer(limit=15, policy=OverflowPolicy.BLOCK)
+    buffer.put(batch(0, 10))
+    reader = threading.Thread(target=buffer.put, args=(batch(10, 10),))
+    reader.start()
+    reader.join(0.2)
+    assert reader.is_alive()
+    assert timestamps(buffer.take()) == list(range(10))
+    reader.join(5)
+    assert not reader.is_alive()
+    assert timestamps(buffer.take()) == list(range(10, 20))
+
+
+def test_block_gives_up_when_stopping() -> None:
+    buffer = IngestBuffer(limit=15, policy=OverflowPolicy.BLOCK)
+    buffer.put(batch(0, 10))
+    stop = threading.Event()
+    reader = threading.Thread(target=buffer.put, args=(batch(10, 10), stop.is_set))
+    reader.start()
+    time.sleep(0.1)
+    stop.set()
+    reader.join(5)
+    assert not reader.is_alive()
+    assert buffer.dropped == 0
+    assert timestamps(buffer.take()) == list(range(20))
@@ -0,0 +1,75 @@
+"""Rows of several sources come out of MergedSource in timestamp order."""
+
+from pathlib import Path
+from typing import Self
+
+from TraceMerge import MergedSource, open_sources
+from TraceSource import TraceSource, encode_frame
+from TraceStore import TraceBatch, TraceStore
+
+
+class ListSource(TraceSource):
+    """Hands out rows (timestamp, message) a few reads at a time."""
+    def __init__(self: Self, rows: list[tuple[int, str]], per_read: int, module: str) -> None:
+        self.rows = rows
+        self.per_read = per_read
+        self.module = module
+        self.reads = 0
+
+    def read(self: Self, batch: TraceBatch, timeout: float) -> bool:
+        start = self.reads * self.per_read
+        for timestamp, message in self.rows[start:start + self.per_read]:
+            batch.append("1", self.module, timestamp, message)
+        self.reads += 1
+        return start + self.per_read < len(self.rows)
+
+
+def merge(source: TraceSource) -> TraceStore:
+    store = TraceStore()
+    running = True
+    while running:
+        batch = TraceBatch()
+        running = source.read(batch, 0)
+        store.extend_batch(batch)
+    source.close()
+    return store
+
+
+def test_interleaved_sources() -> None:
+    rows = [[(t, f"{k} {t}") for t in range(k, 30_000, 3)] for k in range(3)]
+    # Different read sizes, so each read hands the merge a different mix of sources
+    sources = [ListSource(r, per_read, f"module{k}")
+               for k, (r, per_read) in enumerate(zip(rows, [1000, 37, 4096], strict=True))]
+    store = merge(MergedSource(sources, skew=60))
+    assert [store.timestamp(row) for row in range(len(store))] == list(range(30_000))
+    assert store.ordered()
+    for row in range(0, len(store), 997):
+        k = store.timestamp(row) % 3
+        assert store.source(row) == str(k)
+        assert store.module(row) == f"module{k}"
+        assert store.message(row) == f"{k} {store.timestamp(row)}"
+
+
+def test_bursts_and_ended_sources() -> None:
+    # One source sends a burst long after the other has ended
+    early = [(t, "early") for t in range(0, 1000)]
+    late = [(t, "late") for t in range(500, 5000, 2)]
+    store = merge(MergedSource([ListSource(early, 100, "a"), ListSource(late, 10, "b")],
+                               skew=60))
+    timestamps = [store.timestamp(row) for row in range(len(store))]
+    assert len(timestamps) == len(early) + len(late)
+    assert timestamps == sorted(timestamps)
+
+
+def test_open_sources_merges_files(tmp_path: Path) -> None:
+    paths = []
+    for k in range(3):
+        path = tmp_path / f"{k}.bin"
+        path.write_bytes(b"".join(encode_frame(i * 3 + k, k, 1, f"dev{k} {i}".encode())
+                                  for i in range(20_000)))
+        paths.append(str(path))
+    source = open_sources(paths, 0.05)
+    assert isinstance(source, MergedSource)
+    store = merge(source)
+    assert [store.timestamp(row) for row in range(len(store))] == list(range(60_000))
+    assert [store.source(row) for row in range(6)] == ["0", "1", "2", "0", "1", "2"]
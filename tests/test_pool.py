@@ -0,0 +1,59 @@
+"""Refilters split over worker processes, with full chunks shared once."""
+
+from typing import Iterator
+
+import numpy as np
+import pytest
+
+from FilterDSL import FilterDSL
+from FilterMask import MaskEvaluator
+from FilterPool import DEFAULT_WORKERS, FilterPool, SharedChunks
+from TraceStore import CHUNK_ROWS, TraceBatch, TraceStore
+
+
+def make_store() -> TraceStore:
+    store = TraceStore()
+    batch = TraceBatch()
+    for i in range(2 * CHUNK_ROWS + 100):
+        batch.append(str(i % 7), ("radio", "gps")[i % 2], i, f"message {i}")
+    store.extend_batch(batch)
+    return store
+
+
+@pytest.fixture
+def pool() -> Iterator[FilterPool]:
+    pool = FilterPool(2)
+    yield pool
+    pool.resize(1)
+
+
+def test_off_by_default() -> None:
+    assert DEFAULT_WORKERS == 1
+
+
+def test_full_chunks_are_copied_once() -> None:
+    store = make_store()
+    shared = SharedChunks()
+    shared.seal(store.chunks)
+    # The growing chunk is not sealed
+    assert len(shared.blocks) == 2
+    names = [shared.export(chunk) for chunk in store.chunks[:2]]
+    shared.seal(store.chunks)
+    assert [shared.export(chunk) for chunk in store.chunks[:2]] == names
+    store.evict(CHUNK_ROWS)
+    shared.release(store.chunks)
+    assert list(shared.blocks) == [id(store.chunks[0])]
+    shared.release([])
+    assert not shared.blocks
+
+
+def test_workers_accept_the_same_rows(pool: FilterPool) -> None:
+    store = make_store()
+    pool.seal(store)
+    evaluator = MaskEvaluator(store, FilterDSL('module eq "gps" and message contains "7"').plan())
+    results = list(pool.accepted(evaluator, lambda: False))
+    assert [stop for _, stop in results] == [CHUNK_ROWS, 2 * CHUNK_ROWS, store.end]
+    assert np.array_equal(np.concatenate([rows for rows, _ in results]),
+                          evaluator.accepted(store.first, store.end))
+    # Cancelled before the first chunk, nothing is evaluated
+    assert list(pool.accepted(evaluator, lambda: True)) == []
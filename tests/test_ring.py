@@ -0,0 +1,103 @@
+"""Rows read in an ingest process arrive through the ring as read in process."""
+
+import time
+from pathlib import Path
+
+import pytest
+
+from TraceIngest import OverflowPolicy
+from TraceRing import ENDED, MIN_CAPACITY, IngestProcess
+from TraceSource import FrameDecoder, encode_frame
+from TraceStore import TraceBatch, TraceStore
+
+ROWS = 500_000
+
+
+@pytest.fixture(scope="module")
+def frames(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """Enough frames to fill the smallest ring three times over."""
+    path = tmp_path_factory.mktemp("ring") / "frames.bin"
+    with open(path, "wb") as file:
+        for i in range(ROWS):
+            if i % 5 == 0:
+                file.write(encode_frame(i, i % 7, i % 3, i.to_bytes(4, "little"), 17))
+            else:
+                file.write(encode_frame(i, i % 7, i % 3, f"message {i} {'x' * (i % 50)}".encode()))
+    return path
+
+
+def decoded(path: Path) -> TraceStore:
+    data = path.read_bytes()
+    decoder = FrameDecoder(len(data))
+    decoder.receive_view()[:len(data)] = data
+    decoder.received(len(data))
+    batch = TraceBatch()
+    decoder.decode(batch)
+    store = TraceStore()
+    store.extend_batch(batch)
+    return store
+
+
+def rows(store: TraceStore) -> list[tuple]:
+    return [(store.timestamp(row), store.module(row), store.task_id(row), store.template(row),
+             store.chunk(row).message_bytes(row & 0xFFFF)) for row in range(store.first, store.end)]
+
+
+def take_all(process: IngestProcess, store: TraceStore) -> None:
+    deadline = time.monotonic() + 60
+    while not process.ended():
+        assert time.monotonic() < deadline
+        for batch in process.take():
+            store.extend_batch(batch)
+        time.sleep(0.002)
+
+
+def test_block_keeps_every_row(frames: Path) -> None:
+    process = IngestProcess([str(frames)], 0.1, OverflowPolicy.BLOCK, 0.02, 65536,
+                            capacity=MIN_CAPACITY)
+    store = TraceStore()
+    # Names interned before the ingest process started get other codes
+    store.modules.code("earlier")
+    try:
+        take_all(process, store)
+    finally:
+        process.close()
+    assert process.dropped == 0
+    assert rows(store) == rows(decoded(frames))
+
+
+def test_drop_oldest_counts_dropped_rows(frames: Path) -> None:
+    process = IngestProcess([str(frames)], 0.1, OverflowPolicy.DROP_OLDEST, 0.02, 65536,
+                            capacity=MIN_CAPACITY)
+    try:
+        # Nothing is taken until the process has written every row
+        deadline = time.monotonic() + 60
+        while process.flag(ENDED) == 0:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        store = TraceStore()
+        take_all(process, store)
+    finally:
+        process.close()
+    # More than the ring holds was dropped, and the newest rows are kept
+    assert process.dropped > len(store) > 0
+    assert len(store) + process.dropped == ROWS
+    assert rows(store) == rows(decoded(frames))[-len(store):]
+
+
+def test_spill_is_rejected(frames: Path) -> None:
+    with pytest.raises(ValueError, match="can not spill"):
+        IngestProcess([str(frames)], 0.1, OverflowPolicy.SPILL, 0.02, 65536)
+    process = IngestProcess([str(frames)], 0.1, OverflowPolicy.BLOCK, 0.02, 65536,
+                            capacity=MIN_CAPACITY)
+    try:
+        with pytest.raises(ValueError, match="can not spill"):
+            process.policy = OverflowPolicy.SPILL
+        assert process.policy == OverflowPolicy.BLOCK
+    finally:
+        process.close()
+
+
+def test_missing_address(tmp_path: Path) -> None:
+    with pytest.raises(OSError):
+        IngestProcess([str(tmp_path / "missing")], 0.1, OverflowPolicy.BLOCK, 0.02, 65536)
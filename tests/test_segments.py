@@ -0,0 +1,72 @@
+"""Cold chunks moved to segment files and read back while they are used."""
+
+import gc
+import os
+from pathlib import Path
+
+import numpy as np
+
+from FilterDSL import FilterDSL
+from FilterMask import MaskEvaluator
+from TraceSegments import BlockCache, MappedChunk, SegmentChunk, SegmentFiles
+from TraceStore import CHUNK_ROWS, TraceBatch, TraceStore
+
+ROWS = 4 * CHUNK_ROWS + 100
+
+
+def fill(store: TraceStore) -> TraceStore:
+    for start in range(0, ROWS, 50_000):
+        batch = TraceBatch()
+        for i in range(start, min(start + 50_000, ROWS)):
+            batch.append(str(i % 7), ("radio", "gps", "power")[i % 3], i, f"message {i}")
+        store.extend_batch(batch)
+    return store
+
+
+def test_cold_chunks_read_like_chunks_in_memory(tmp_path: Path) -> None:
+    store = TraceStore()
+    store.cold = SegmentFiles(str(tmp_path), hot=1, mapped=2)
+    fill(store)
+    plain = fill(TraceStore())
+    # The growing chunk and the newest full one stay in memory
+    assert [isinstance(chunk, SegmentChunk) for chunk in store.chunks] == \
+        [True, True, True, False, False]
+    for row in (0, 1, CHUNK_ROWS - 1, CHUNK_ROWS, 2 * CHUNK_ROWS + 7, ROWS - 1):
+        assert (store.task_id(row), store.module(row), store.timestamp(row),
+                store.message(row)) == (plain.task_id(row), plain.module(row),
+                                        plain.timestamp(row), plain.message(row))
+    for expr in ('module eq "gps" and message contains "77"', "timestamp between 1000 200000"):
+        root = FilterDSL(expr).plan()
+        assert np.array_equal(MaskEvaluator(store, root).accepted(0, ROWS),
+                              MaskEvaluator(plain, root).accepted(0, ROWS))
+    assert len(store.cold.maps) == 2
+
+
+def test_evicted_segments_are_removed(tmp_path: Path) -> None:
+    store = TraceStore()
+    store.cold = SegmentFiles(str(tmp_path), hot=1)
+    fill(store)
+    path = store.chunks[0].path
+    store.message(0)
+    assert os.path.exists(path)
+    store.evict(CHUNK_ROWS)
+    gc.collect()
+    assert not os.path.exists(path)
+    assert store.message(CHUNK_ROWS) == f"message {CHUNK_ROWS}"
+
+
+def test_block_cache_keeps_the_most_recent() -> None:
+    cache = BlockCache(2)
+    chunks = {key: MappedChunk(memoryview(bytearray(1 << 20)), 0, rows=10) for key in "abc"}
+    loads: list[str] = []
+
+    def load(key: str) -> MappedChunk:
+        loads.append(key)
+        return chunks[key]
+
+    for key in "abacb":
+        assert cache.get(key, lambda key=key: load(key)) is chunks[key]
+    assert loads == ["a", "b", "c", "b"]
+    assert (cache.hits, cache.misses, len(cache)) == (1, 4, 2)
+    cache.discard("c")
+    assert list(cache.chunks) == ["b"]
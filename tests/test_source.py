@@ -0,0 +1,87 @@
+"""Frames decoded from byte streams, whole or in pieces, with garbage in between."""
+
+import io
+import socket
+
+from TraceSource import FrameDecoder, StreamSource, encode_frame, open_source
+from TraceStore import TEXT, TraceBatch, TraceStore
+
+FRAMES = [encode_frame(i, i % 3, 7, f"message {i}".encode()) for i in range(100)]
+
+
+def decode(chunks: list[bytes], buffer_size: int = 1 << 20) -> tuple[TraceStore, FrameDecoder]:
+    """Feed chunks to a decoder one by one, decoding after each."""
+    decoder = FrameDecoder(buffer_size)
+    batch = TraceBatch()
+    for chunk in chunks:
+        while chunk:
+            with decoder.receive_view() as view:
+                count = min(len(view), len(chunk))
+                view[:count] = chunk[:count]
+            decoder.received(count)
+            decoder.decode(batch)
+            chunk = chunk[count:]
+    store = TraceStore()
+    store.extend_batch(batch)
+    return store, decoder
+
+
+def messages(store: TraceStore) -> list[tuple]:
+    return [(store.timestamp(row), store.module(row), store.task_id(row), store.message(row))
+            for row in range(len(store))]
+
+
+EXPECTED = [(i, str(i % 3), "7", f"message {i}") for i in range(100)]
+
+
+def test_frames_split_anywhere() -> None:
+    data = b"".join(FRAMES)
+    for size in (1, 3, 7, 30, len(data)):
+        (store, decoder) = decode([data[i:i + size] for i in range(0, len(data), size)])
+        assert messages(store) == EXPECTED
+        assert decoder.skipped == 0
+
+
+def test_resync_after_garbage() -> None:
+    garbage = b"\x00\x01\x54junk\x52"
+    data = garbage + b"".join(frame + garbage for frame in FRAMES)
+    (store, decoder) = decode([data[i:i + 50] for i in range(0, len(data), 50)])
+    assert messages(store) == EXPECTED
+    # The garbage after the last frame may yet start one, so it is kept
+    assert decoder.skipped == len(garbage) * 100
+
+
+def test_small_buffer_grows_for_large_frames() -> None:
+    frame = encode_frame(1, 0, 0, b"x" * 5000)
+    (store, _) = decode([frame[i:i + 100] for i in range(0, len(frame), 100)], buffer_size=64)
+    assert store.message(0) == "x" * 5000
+
+
+def test_template_frames_keep_their_arguments() -> None:
+    data = encode_frame(5, 1, 2, b"\x01\x02\x03", 17) + FRAMES[0]
+    (store, _) = decode([data])
+    assert (store.template(0), store.template(1)) == (17, TEXT)
+    assert bytes(store.chunk(0).message_bytes(0)) == b"\x01\x02\x03"
+
+
+def test_stream_source_reads_until_the_end() -> None:
+    data = b"".join(FRAMES)
+    source = StreamSource(io.BytesIO(data), io.BytesIO(data).readinto)
+    batch = TraceBatch()
+    while source.read(batch, 0.01):
+        pass
+    assert len(batch) == 100
+
+
+def test_open_source_over_tcp() -> None:
+    server = socket.create_server(("127.0.0.1", 0))
+    source = open_source(f"tcp://127.0.0.1:{server.getsockname()[1]}")
+    (connection, _) = server.accept()
+    connection.sendall(b"".join(FRAMES))
+    connection.close()
+    batch = TraceBatch()
+    while source.read(batch, 1):
+        pass
+    source.close()
+    server.close()
+    assert len(batch) == 100
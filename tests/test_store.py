@@ -0,0 +1,72 @@
+"""Rows kept column by column in the chunks of a TraceStore."""
+
+from TraceStore import CHUNK_ROWS, TEXT, TraceBatch, TraceStore
+
+
+def make_batch(start: int, count: int) -> TraceBatch:
+    batch = TraceBatch()
+    for i in range(start, start + count):
+        batch.append(str(i % 4), f"module{i % 3}", i, f"message {i}")
+    return batch
+
+
+def test_append_and_read_back() -> None:
+    store = TraceStore()
+    store.append("1", "radio", 10, "boot ok")
+    store.append("2", "gps", 20, "fix lost ünïcode", source="1")
+    assert len(store) == 2
+    assert [store.task_id(0), store.module(0), store.timestamp(0), store.message(0)] == \
+        ["1", "radio", 10, "boot ok"]
+    assert store.message(1) == "fix lost ünïcode"
+    assert (store.source(0), store.source(1)) == ("0", "1")
+    assert store.template(0) == TEXT
+    assert store.getters()["module"](1) == "gps"
+
+
+def test_names_are_interned() -> None:
+    store = TraceStore()
+    for i in range(1000):
+        store.append("1", "radio" if i % 2 else "gps", i, "")
+    assert store.modules.values == ["gps", "radio"]
+    assert len(store.tasks) == 1
+
+
+def test_batches_span_chunks() -> None:
+    store = TraceStore()
+    store.append("7", "first", -1, "before the batches")
+    # The codes of each batch are translated to those of the store
+    for start in range(0, 2 * CHUNK_ROWS + 10, 50_000):
+        store.extend_batch(make_batch(start, min(50_000, 2 * CHUNK_ROWS + 10 - start)))
+    assert len(store) == 2 * CHUNK_ROWS + 11
+    assert len(store.chunks) == 3
+    for row in (0, 1, CHUNK_ROWS - 1, CHUNK_ROWS, CHUNK_ROWS + 1, len(store) - 1):
+        i = row - 1
+        if row == 0:
+            assert store.message(row) == "before the batches"
+            continue
+        assert (store.task_id(row), store.module(row), store.timestamp(row),
+                store.message(row)) == (str(i % 4), f"module{i % 3}", i, f"message {i}")
+
+
+def test_snapshot_keeps_its_rows() -> None:
+    store = TraceStore()
+    store.extend_batch(make_batch(0, 100))
+    snapshot = store.snapshot()
+    store.extend_batch(make_batch(100, CHUNK_ROWS))
+    assert (len(snapshot), len(store)) == (100, CHUNK_ROWS + 100)
+    assert snapshot.message(99) == "message 99"
+
+
+def test_evict_keeps_row_numbers() -> None:
+    store = TraceStore()
+    store.extend_batch(make_batch(0, 3 * CHUNK_ROWS))
+    store.evict(CHUNK_ROWS + 10)
+    assert (store.first, store.end, len(store)) == (CHUNK_ROWS + 10, 3 * CHUNK_ROWS,
+                                                    2 * CHUNK_ROWS - 10)
+    # Only whole chunks are freed
+    assert len(store.chunks) == 2
+    assert store.message(CHUNK_ROWS + 10) == f"message {CHUNK_ROWS + 10}"
+    store.extend_batch(make_batch(3 * CHUNK_ROWS, 5))
+    assert store.message(3 * CHUNK_ROWS + 4) == f"message {3 * CHUNK_ROWS + 4}"
+    store.evict(len(store) + 100)
+    assert len(store) == 0 and store.first == store.end
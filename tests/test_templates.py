@@ -0,0 +1,48 @@
+"""Messages rendered from a template id and packed arguments."""
+
+import json
+from pathlib import Path
+
+from TraceTemplates import Template, TemplateDictionary
+
+
+def test_render_packed_arguments() -> None:
+    templates = TemplateDictionary()
+    templates.add(17, "ADC {} read {} mV", "<BH")
+    assert templates.render(17, bytes([3]) + (1234).to_bytes(2, "little")) == "ADC 3 read 1234 mV"
+
+
+def test_tail_takes_the_rest_as_text() -> None:
+    templates = TemplateDictionary()
+    templates.add(18, "Connected to {} on {}", "<B*")
+    assert templates.render(18, b"\x02home wifi") == "Connected to 2 on home wifi"
+
+
+def test_bad_templates_and_arguments_render_a_note() -> None:
+    templates = TemplateDictionary()
+    templates.add(1, "ADC {} read {} mV", "<BH")
+    templates.add(2, "temp {c} C", "<h")
+    templates.add(3, "{} and {}", "<B")
+    assert templates.render(9, b"") == "<< Unknown template 9 >>"
+    # Too few bytes, a named field and too few arguments for the fields
+    for template, args in ((1, b"\x01"), (2, b"\x10\x00"), (3, b"\x01")):
+        assert templates.render(template, args).startswith(f"<< Template {template}: ")
+
+
+def test_load_and_clear(tmp_path: Path) -> None:
+    path = tmp_path / "templates.json"
+    path.write_text(json.dumps({"17": {"format": "Boot {}", "args": "<I"},
+                                "18": {"format": "Idle"}}))
+    templates = TemplateDictionary()
+    templates.load(str(path))
+    assert len(templates) == 2
+    assert templates.render(17, (7).to_bytes(4, "little")) == "Boot 7"
+    assert templates.render(18, b"") == "Idle"
+    templates.clear()
+    assert templates.get(17) is None
+
+
+def test_constant_templates() -> None:
+    assert Template("Idle").constant()
+    assert not Template("Boot {}", "<I").constant()
+    assert Template("ADC {} read {} mV", "<BH").literals == ("ADC ", " read ", " mV")
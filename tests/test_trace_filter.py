@@ -0,0 +1,212 @@
+"""The rows TraceFilter shows as the model grows, is evicted and the filter changes."""
+
+from typing import Callable
+
+import numpy as np
+from PySide6.QtCore import QModelIndex
+
+from FilterDSL import FilterDSL
+from TraceFilter import AcceptedRows, AllRows, FilterResults, TraceFilter
+from TraceModel import TraceModel
+from TraceStore import CHUNK_ROWS, TraceStore
+
+AddRows = Callable[[TraceModel, int, int], None]
+Wait = Callable[[Callable[[], bool]], None]
+
+
+def shown(proxy: TraceFilter) -> list[int]:
+    """The timestamps of the rows shown, which are their store rows in these tests."""
+    store = proxy.source.store
+    return [store.timestamp(proxy.store_row(row)) for row in range(proxy.rowCount())]
+
+
+def filtered(model: TraceModel, expr: str, wait: Wait) -> TraceFilter:
+    proxy = TraceFilter(model)
+    proxy.update_filter(expr)
+    wait(lambda: not proxy.busy())
+    return proxy
+
+
+def test_without_filter_every_row_is_shown(model: TraceModel, add_rows: AddRows) -> None:
+    proxy = TraceFilter(model)
+    add_rows(model, 0, 10)
+    assert shown(proxy) == list(range(10))
+
+
+def test_new_rows_are_appended_in_one_insert(model: TraceModel, add_rows: AddRows,
+                                             wait: Wait) -> None:
+    add_rows(model, 0, 30)
+    proxy = filtered(model, 'module eq "radio"', wait)
+    assert shown(proxy) == list(range(0, 30, 3))
+    inserts: list[tuple[int, int]] = []
+    proxy.rowsInserted.connect(lambda parent, first, last: inserts.append((first, last)))
+    add_rows(model, 30, 30)
+    assert inserts == [(10, 19)]
+    assert shown(proxy) == list(range(0, 60, 3))
+    # Rows none of which are accepted insert nothing
+    add_rows(model, 61, 2)
+    assert len(inserts) == 1
+
+
+def test_map_to_and_from_source(model: TraceModel, add_rows: AddRows, wait: Wait) -> None:
+    add_rows(model, 0, 30)
+    proxy = filtered(model, 'module eq "gps"', wait)
+    source = proxy.mapToSource(proxy.index(2, 0))
+    assert source.row() == 7
+    assert proxy.mapFromSource(source).row() == 2
+    assert not proxy.mapFromSource(model.index(6, 0)).isValid()
+    assert not proxy.mapToSource(QModelIndex()).isValid()
+
+
+def test_changing_the_filter_evaluates_every_row(model: TraceModel, add_rows: AddRows,
+                                                 wait: Wait) -> None:
+    add_rows(model, 0, 30)
+    proxy = filtered(model, 'module eq "radio"', wait)
+    proxy.update_filter('message contains "message 2"')
+    wait(lambda: not proxy.busy())
+    assert shown(proxy) == [2, *range(20, 30)]
+    proxy.update_filter("")
+    assert shown(proxy) == list(range(30))
+
+
+def test_history_length_evicts_from_the_front(model: TraceModel, add_rows: AddRows,
+                                              wait: Wait) -> None:
+    add_rows(model, 0, 30)
+    proxy = filtered(model, 'module eq "radio"', wait)
+    unfiltered = TraceFilter(model)
+    removed: list[tuple[int, int]] = []
+    proxy.rowsRemoved.connect(lambda parent, first, last: removed.append((first, last)))
+    model.set_history_length(20)
+    assert len(model.store) == 20 and model.store.first == 10
+    assert removed == [(0, 3)]
+    assert shown(proxy) == list(range(12, 30, 3))
+    assert shown(unfiltered) == list(range(10, 30))
+    add_rows(model, 30, 15)
+    assert len(model.store) == 20
+    assert shown(proxy) == list(range(27, 45, 3))
+    assert shown(unfiltered) == list(range(25, 45))
+    assert model.index(0, 0).data() == "[25] message 25"
+
+
+def test_rows_at_time() -> None:
+    store = TraceStore()
+    for i in range(100):
+        store.append("1", "radio", i * 10, "")
+    accepted = AcceptedRows(store, np.arange(0, 100, 4, dtype=np.int64))
+    everything = AllRows(store, 0, 100)
+    # The last row at or before the time, or the first row
+    for (timestamp, at) in ((-5, 0), (0, 0), (39, 0), (40, 1), (55, 1), (2000, 24)):
+        assert accepted.at_time(timestamp) == at
+    for (timestamp, at) in ((-5, 0), (0, 0), (39, 3), (40, 4), (2000, 99)):
+        assert everything.at_time(timestamp) == at
+    accepted.drop(10)
+    everything.drop(10)
+    assert accepted.at_time(55) == 0 and accepted.at_time(405) == 0
+    assert accepted.at_time(445) == 1 and everything.at_time(445) == 34
+
+
+def test_rows_at_time_with_late_rows() -> None:
+    store = TraceStore()
+    for timestamp in (0, 10, 20, 5, 30, 40):
+        store.append("1", "radio", timestamp, "")
+    assert not store.ordered()
+    accepted = AcceptedRows(store, np.arange(6, dtype=np.int64))
+    # The row before the first one past the time, as in a stream read in order
+    for (timestamp, at) in ((0, 0), (12, 1), (25, 3), (35, 4), (99, 5)):
+        assert accepted.at_time(timestamp) == at
+        assert AllRows(store, 0, 6).at_time(timestamp) == at
+
+def test_global_time_scrolls_to_the_row(model: TraceModel, add_rows: AddRows,
+                                        wait: Wait) -> None:
+    add_rows(model, 0, 30)
+    proxy = filtered(model, 'module eq "gps"', wait)
+    scrolled: list[int] = []
+    proxy.view_scroll_to_index.connect(lambda index: scrolled.append(index.row()))
+    proxy.global_time_updated(14)
+    proxy.global_time_updated(3)
+    assert scrolled == [4, 0]
+
+
+def test_refilter_runs_in_the_background(model: TraceModel, add_rows: AddRows,
+                                         wait: Wait) -> None:
+    add_rows(model, 0, CHUNK_ROWS + 100)
+    proxy = TraceFilter(model)
+    progress: list[int] = []
+    proxy.progress.connect(progress.append)
+    proxy.update_filter('module eq "power"')
+    assert proxy.busy()
+    # Rows ingested meanwhile wait for the refilter, to stay in order
+    add_rows(model, CHUNK_ROWS + 100, 10)
+    wait(lambda: not proxy.busy())
+    assert shown(proxy) == list(range(2, CHUNK_ROWS + 110, 3))
+    assert progress[0] == 0 and progress[-1] == 100
+    assert progress == sorted(progress) and 0 < progress[1] < 100
+
+
+def test_a_new_filter_cancels_the_refilter(model: TraceModel, add_rows: AddRows,
+                                           wait: Wait) -> None:
+    add_rows(model, 0, CHUNK_ROWS + 100)
+    proxy = TraceFilter(model)
+    proxy.update_filter('module eq "power"')
+    proxy.update_filter('module eq "gps" and timestamp lt 100')
+    wait(lambda: not proxy.busy() and not proxy.jobs)
+    assert shown(proxy) == list(range(1, 100, 3))
+
+
+def test_results_keep_the_recent_filters() -> None:
+    results = FilterResults(size=2, max_rows=100)
+    keys = [(FilterDSL(f"timestamp eq {i}").root, 0) for i in range(3)]
+    for (i, key) in enumerate(keys):
+        results.put(key, np.arange(i), i)
+    assert results.get(keys[0]) is None
+    (rows, evaluated) = results.get(keys[1])
+    assert rows.tolist() == [0] and evaluated == 1
+    results.put(keys[0], np.arange(90), 90)
+    assert results.get(keys[2]) is None and results.get(keys[1]) is not None
+    # Too many rows drops the least recently used, but never the last one
+    results.put(keys[2], np.arange(200), 200)
+    assert list(results.results) == [keys[2]]
+    # A new generation drops the results of the older ones
+    results.put((keys[0][0], 1), np.arange(1), 1)
+    assert list(results.results) == [(keys[0][0], 1)]
+
+
+def test_narrowing_evaluates_only_the_rows_shown(model: TraceModel, add_rows: AddRows,
+                                                 wait: Wait) -> None:
+    add_rows(model, 0, 300)
+    proxy = filtered(model, 'module eq "radio"', wait)
+    proxy.update_filter('module eq "radio" and message contains "1"')
+    assert proxy.jobs[-1].rows.tolist() == list(range(0, 300, 3))
+    wait(lambda: not proxy.busy())
+    assert shown(proxy) == [t for t in range(0, 300, 3) if "1" in str(t)]
+
+
+def test_switching_back_reuses_the_results(model: TraceModel, add_rows: AddRows,
+                                           wait: Wait) -> None:
+    add_rows(model, 0, 30)
+    proxy = filtered(model, 'module eq "radio"', wait)
+    proxy.update_filter('module eq "gps"')
+    wait(lambda: not proxy.busy())
+    add_rows(model, 30, 30)
+    # Only the rows added since are evaluated, without a refilter
+    proxy.update_filter('module  eq "radio"')
+    assert not proxy.busy()
+    assert shown(proxy) == list(range(0, 60, 3))
+    # A cleared model means other rows
+    model.clear()
+    add_rows(model, 0, 6)
+    proxy.update_filter('module eq "gps"')
+    wait(lambda: not proxy.busy())
+    assert shown(proxy) == [1, 4]
+
+
+def test_suspended_views_catch_up_when_resumed(model: TraceModel, add_rows: AddRows,
+                                               wait: Wait) -> None:
+    add_rows(model, 0, 30)
+    proxy = filtered(model, 'module eq "radio"', wait)
+    proxy.suspend(True)
+    add_rows(model, 30, 30)
+    assert shown(proxy) == list(range(0, 30, 3))
+    model.set_history_length(40)
+    proxy.suspend(False)
+    assert shown(proxy) == list(range(21, 60, 3))